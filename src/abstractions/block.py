@@ -2,16 +2,27 @@
 
 from backbone.merkle import MerkleTree
 from abstractions.transaction import Transaction
-from utils.view import visualize_blockchain
-from utils.cryptographic import double_hash, save_signature, load_signature
+from utils.cryptographic import double_hash, save_signature, load_signature, unpack_hash
+from utils import metrics
+from server import N_BLOCKS_PER_BRANCH
+import os
+import hashlib
+import sys
 import json
+import itertools
+import pickle
 
 class Block:
     """
-    Dummy Bitcoin Block
+    Dummy Bitcoin Block.
+    Slotted and the Merkle tree is only built when needed, e.g. to add transactions. hash is the same object as the
+    key of Blockchain.chain
     """
+    __slots__ = ("transactions", "hash", "prev", "nonce", "time", "creation_time", "_merkle_tree", "height",
+                 "merkle_root", "main_chain", "confirmed", "next", "mined_by", "signature")
+
     def __init__(self, hash, nonce, time, creation_time, height, previous_block=None, transactions=None, main_chain=True,
-                 confirmed=False, merkle_root=None, next=[], mined_by=None, signature=None):
+                 confirmed=False, merkle_root=None, next=None, mined_by=None, signature=None):
         """
 
         :param hash: str, block hash
@@ -36,18 +47,43 @@ class Block:
         self.nonce = nonce
         self.time = time # datetime.now().timestamp()
         self.creation_time = creation_time
-        self.merkle_tree = self.create_merkle_tree()
+        self._merkle_tree = None
         self.height = height
         if merkle_root is None:
-            self.merkle_root = self.merkle_tree.get_root()['hash']
+            self.merkle_root = self.merkle_tree.get_root_hash()
         else:
             self.merkle_root = merkle_root
         self.main_chain = main_chain  # if False, block is in a forked branch
         self.confirmed = confirmed  # becomes True if main_chain and more than N_BLOCKS_PER_BRANCH
+        if next is None:
+            next = []
         self.next = next
-        self.mined_by = mined_by
+        self.mined_by = sys.intern(mined_by) if isinstance(mined_by, str) else mined_by
         self.signature = signature  # signature with miner private key of block hash
 
+    @property
+    def merkle_tree(self):
+        """
+        built on first use, blocks received from the server only need their merkle_root
+        """
+        if self._merkle_tree is None:
+            self._merkle_tree = self.create_merkle_tree()
+        return self._merkle_tree
+
+    def __getstate__(self):
+        # the Merkle tree is rebuilt when needed
+        return {s: getattr(self, s) for s in self.__slots__ if s != "_merkle_tree"}
+
+    def __setstate__(self, state):
+        # blocks pickled before the slots have a "merkle_tree" key, the ones pickled with packed hashes have "_prev"
+        # and "_merkle_root" as bytes
+        self._merkle_tree = None
+        for k, v in state.items():
+            if k in ("_prev", "_merkle_root"):
+                setattr(self, k[1:], unpack_hash(v))
+            elif k != "merkle_tree":
+                setattr(self, k, v)
+
     def to_dict(self):
         """
         make Blocks into dict for serialization
@@ -72,8 +108,16 @@ class Block:
 
     @classmethod
     def load_json(cls, data):
-        data = json.loads(data)
-        transactions = [Transaction.load_json(json.dumps(t)) for t in data["transactions"]]
+        return cls.from_dict(json.loads(data))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        builds a block and its transactions from its to_dict() representation, without re-encoding anything
+        :param data: dict
+        :return: Block
+        """
+        transactions = [Transaction.from_dict(t) for t in data["transactions"]]
         signature = load_signature(data["signature"])
         return cls(
             hash=data['hash'],
@@ -103,8 +147,25 @@ class Block:
         return m
 
     def add_transaction(self, transaction):
-        """Add a new transaction to the block"""
+        """Add a new transaction to the block, the Merkle root is updated in O(log n)"""
+        tree = self.merkle_tree
         self.transactions.append(transaction)
+        self.merkle_root = tree.append(transaction.hash)
+
+    def remove_transaction(self, transaction):
+        """
+        Remove a transaction from the block, the last transaction of the block takes its place
+        :param transaction: Transaction object
+        :return: bool, False if the transaction is not in the block
+        """
+        i = self.merkle_tree.remove(transaction.hash)
+        if i is None:
+            return False
+        last = self.transactions.pop()
+        if i < len(self.transactions):
+            self.transactions[i] = last
+        self.merkle_root = self.merkle_tree.get_root_hash()
+        return True
 
     def get_transactions(self):
         """Retrieves the transactions in the block"""
@@ -115,16 +176,29 @@ class Block:
         redefine builtin func for printing
         :return:
         """
-        return str(self.__class__) + ": " + str(self.__dict__)
+        return str(self.__class__) + ": " + str(self.__getstate__())
 
 
 class Blockchain:
     """
-    Blockchain class as a list of blocks
+    Blockchain class as a list of blocks.
+    A fork-choice index is kept up to date by add_block: blocks per height, length of the branch ending at every
+    block and the branch of the current tip (the longest one, the first seen on a tie). Adding a block only visits
+    the blocks between the fork point and the tips, and the last N_BLOCKS_PER_BRANCH blocks for confirmation.
+    Only the branch of the tip is on the main chain, even on a tie, and its blocks followed by N_BLOCKS_PER_BRANCH
+    blocks are confirmed: a branch forking before them is never chosen.
     """
-    def __init__(self, block_list):
+    def __init__(self, block_list, validated_file=None):
+        """
+        :param block_list: list of Block objects
+        :param validated_file: str, file where the validated blocks are persisted (see backbone.chainstore),
+        None to keep them in memory only
+        """
         self.block_list = block_list
         self.chain = self.make_chain_from_list()
+        self.build_index()
+        self.validated_file = validated_file
+        self.validated = load_validated_hashes(validated_file)
         self.is_valid = self.is_chain_valid()
 
     def make_chain_from_list(self):
@@ -137,6 +211,163 @@ class Blockchain:
             dic[b.hash] = b
         return dic
 
+    def __setstate__(self, state):
+        """
+        blockchains pickled before the fork-choice index existed get it built on load, and the ones whose
+        validation cache only held hashes are validated again
+        """
+        self.__dict__.update(state)
+        if "lengths" not in state:
+            self.build_index()
+        if not isinstance(self.validated, dict):
+            self.validated = dict()
+
+    def build_index(self):
+        """
+        builds the fork-choice index of the blocks held, parents are indexed before their successors.
+        The main_chain and confirmed values are left as loaded, see confirm_chain
+        :return:
+        """
+        self.heights = dict()  # height -> list of block hashes
+        self.lengths = dict()  # hash -> number of blocks from the genesis block to this block
+        self.best_chain = []  # hashes of the branch ending at the tip, best_chain[i] has length i + 1
+        self.n_confirmed = 0  # number of leading blocks of best_chain which are confirmed
+        self.height = -1
+        tip = None
+        for b in sorted(self.chain.values(), key=lambda x: x.height):
+            if not self.index_block(b):
+                continue
+            # the tip is the end of the longest branch on the main chain as loaded, if there is one
+            key = (b.main_chain, self.lengths[b.hash])
+            if tip is None or key > (self.chain[tip].main_chain, self.lengths[tip]):
+                tip = b.hash
+        if tip is not None:
+            self.best_chain.extend(b.hash for b in self.iter_ancestors(tip))
+            self.best_chain.reverse()
+        while self.n_confirmed < len(self.best_chain) and self.chain[self.best_chain[self.n_confirmed]].confirmed:
+            self.n_confirmed += 1
+
+    def index_block(self, block):
+        """
+        :param block: Block object, its previous block must be indexed already
+        :return: bool, False if the previous block is unknown
+        """
+        if block.prev == 'None':
+            length = 1
+        elif block.prev in self.lengths:
+            length = self.lengths[block.prev] + 1
+            # one string per hash: prev becomes the key of the previous block
+            block.prev = self.chain[block.prev].hash
+        else:
+            return False
+        self.lengths[block.hash] = length
+        self.heights.setdefault(block.height, []).append(block.hash)
+        self.height = max(self.height, block.height)
+        return True
+
+    def is_on_best_chain(self, block_hash):
+        """
+        :param block_hash: str, hash of an indexed block
+        :return: bool, True if the block is in the branch of the tip
+        """
+        length = self.lengths[block_hash]
+        return length <= len(self.best_chain) and self.best_chain[length - 1] == block_hash
+
+    def update_tip(self, block_hash):
+        """
+        fork choice: the tip moves to block_hash if its branch is longer than the current one.
+        A branch forking before the last confirmed block is never chosen
+        :param block_hash: str, hash of an indexed block
+        :return: bool, True if block_hash is the new tip
+        """
+        if self.lengths[block_hash] <= len(self.best_chain):
+            return False
+        # walk back to the fork point with the branch of the current tip
+        branch = []
+        fork = 0
+        for b in self.iter_ancestors(block_hash):
+            if self.is_on_best_chain(b.hash):
+                fork = self.lengths[b.hash]
+                break
+            branch.append(b.hash)
+        if fork < self.n_confirmed:
+            return False
+        for h in self.best_chain[fork:]:
+            self.chain[h].main_chain = False
+        del self.best_chain[fork:]
+        for h in reversed(branch):
+            self.chain[h].main_chain = True
+            self.best_chain.append(h)
+        self.confirm_blocks()
+        return True
+
+    def confirm_blocks(self):
+        """
+        confirms the blocks of the tip branch followed by at least N_BLOCKS_PER_BRANCH blocks
+        :return:
+        """
+        while self.n_confirmed < len(self.best_chain) - N_BLOCKS_PER_BRANCH:
+            self.chain[self.best_chain[self.n_confirmed]].confirmed = True
+            self.n_confirmed += 1
+
+    def get_tip(self):
+        """
+        :return: Block, last block of the longest branch i.e. the block to mine on, None if empty
+        """
+        if not self.best_chain:
+            return None
+        return self.chain[self.best_chain[-1]]
+
+    def iter_ancestors(self, block_hash):
+        """
+        walks back from a block to the genesis block
+        :param block_hash: str, hash of the first block yielded
+        :return: generator of Block objects, stops at the first block whose previous block is unknown
+        """
+        b = self.chain.get(block_hash)
+        while b is not None:
+            yield b
+            b = self.chain.get(b.prev)
+
+    def iter_descendants(self, block_hash, visited=None):
+        """
+        depth-first walk of a block and all its successors, see iter_successors
+        :param block_hash: str, hash of the first block yielded
+        :param visited: set of block hashes not to visit, updated with the visited ones
+        :return: generator of Block objects
+        """
+        return iter_successors(self.chain, block_hash, visited)
+
+    def iter_branch(self, tip_hash=None):
+        """
+        walks forward from the genesis block to a tip. Only the blocks of tip_hash which are not on the branch of
+        the current tip are buffered, the others are read from the index
+        :param tip_hash: str, last block of the branch, None for the current tip
+        :return: generator of Block objects
+        """
+        side = []
+        if tip_hash is not None:
+            for b in self.iter_ancestors(tip_hash):
+                if b.hash in self.lengths and self.is_on_best_chain(b.hash):
+                    fork = self.lengths[b.hash]
+                    break
+                side.append(b.hash)
+            else:
+                fork = 0
+        else:
+            fork = len(self.best_chain)
+        for h in itertools.islice(self.best_chain, fork):
+            yield self.chain[h]
+        while side:
+            yield self.chain[side.pop()]
+
+    def get_blocks_at_height(self, height):
+        """
+        :param height: int
+        :return: list of Block objects at that height, more than one after a fork
+        """
+        return [self.chain[h] for h in self.heights.get(height, [])]
+
     def to_dict(self):
         """
         make Blockchain into dict for serialization
@@ -150,18 +381,49 @@ class Blockchain:
         }
 
     @classmethod
-    def load_json(cls, data):
-        data = json.loads(data)
-        blocks = [Block.load_json(json.dumps(b)) for b in data["chain"]]
+    @metrics.timed("blockchain.load_json")
+    def load_json(cls, data, validated_file=None):
+        return cls.from_dict(json.loads(data), validated_file)
+
+    @classmethod
+    @metrics.timed("blockchain.from_dict")
+    def from_dict(cls, data, validated_file=None):
+        """
+        builds a blockchain from its to_dict() representation, e.g. the data of a GET_BLOCKCHAIN response
+        :param data: dict
+        :param validated_file: str, see __init__
+        :return: Blockchain
+        """
         return cls(
-            block_list=blocks,
+            block_list=[Block.from_dict(b) for b in data["chain"]],
+            validated_file=validated_file,
         )
 
-    def is_chain_valid(self):
+    @classmethod
+    def load_stream(cls, chunks, validated_file=None):
+        """
+        builds a blockchain while its JSON is still being received, one block at a time
+        :param chunks: iterable of str or bytes, e.g. utils.flask_utils.flask_stream(GET_BLOCKCHAIN)
+        :param validated_file: str, see __init__
+        :return: Blockchain
         """
-        verify the current blockchain is valid
+        from utils.flask_utils import iter_json_array
+        return cls(
+            block_list=[Block.from_dict(b) for b in iter_json_array(chunks, "chain")],
+            validated_file=validated_file,
+        )
+
+    @metrics.timed("blockchain.is_chain_valid")
+    def is_chain_valid(self, trust_cache=False):
+        """
+        verify the current blockchain is valid. Only blocks whose header was not validated before are double
+        hashed, the new validated headers are persisted
+        :param trust_cache: bool, True for a chain loaded from the local ChainStore pickle: a validated hash is
+        then only looked up, its header is not rebuilt. Blocks from the server are compared to the digest of the
+        validated header
         :return:
         """
+        new_validated = dict()
         for key in self.chain:
             current_b = self.chain[key]
             if current_b.prev == 'None':
@@ -169,116 +431,174 @@ class Blockchain:
                 pass
             else:
                 # previous block
-                prev_b = self.chain[self.chain[key].prev]
-                # calculate current block hash
-                data = str(current_b.prev) + str(current_b.time) + str(current_b.merkle_root) + str(current_b.nonce)
-                current_b_hash = double_hash(data)
-                if current_b.hash != current_b_hash:
-                    # current hash is different from the calculated one
-                    return False
-                if current_b.prev != prev_b.hash:
+                prev_b = self.chain.get(current_b.prev)
+                if prev_b is None or current_b.prev != prev_b.hash:
                     # previous hash saved on the blockchain is different from the one fetched in the block list
                     return False
+                if trust_cache and key in self.validated:
+                    continue
+                digest = get_header_digest(current_b)
+                if self.validated.get(key) != digest:
+                    if not self.is_block_valid(current_b):
+                        # current hash is different from the calculated one
+                        return False
+                    new_validated[key] = digest
+        if new_validated:
+            self.validated.update(new_validated)
+            self.save_validated()
         return True
 
+    @staticmethod
+    def is_block_valid(block):
+        """
+        checks the proof of work of a block
+        :param block: Block object
+        :return: bool, True if the block hash is the double hash of its header
+        """
+        return block.hash == double_hash(get_header(block))
+
+    def save_validated(self):
+        """
+        persists the validated blocks
+        :return:
+        """
+        if self.validated_file is None:
+            return
+        os.makedirs(os.path.dirname(self.validated_file), exist_ok=True)
+        tmp = self.validated_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.validated, f)
+        os.replace(tmp, self.validated_file)
+
     def add_block(self, new_block):
         """
-        add a new block
+        add a new block, only the new block is validated. The fork-choice index, main_chain and confirmed values
+        are updated
         :param new_block : block just added
         :return: bool
         """
+        if new_block.hash in self.chain:
+            # already held, the object in the chain keeps its index, main_chain and confirmed values
+            return True
         # if genesis add it to the chain
         if new_block.prev == 'None':
+            self.block_list.append(new_block)
             self.chain[new_block.hash] = new_block
+            self.add_to_index(new_block)
             return True
         else:
             # not genesis
             value = self.chain.get(new_block.prev)
+            digest = get_header_digest(new_block)
+            if self.validated.get(new_block.hash) != digest:
+                if not self.is_block_valid(new_block):
+                    return False
+                self.validated[new_block.hash] = digest
             if value is not None:
                 # the previous block exists
-                # set main_chain same as predecessor
-                new_block.main_chain = self.chain[new_block.prev].main_chain
                 # add block to the chain
+                self.block_list.append(new_block)
                 self.chain[new_block.hash] = new_block
                 # add successors
-                self.chain[new_block.prev].next.append(new_block.hash)
+                if new_block.hash not in value.next:
+                    value.next.append(new_block.hash)
+                self.add_to_index(new_block)
                 return True
             else:
                 return False
 
+    def add_to_index(self, block):
+        """
+        indexes a block just added to the chain and runs the fork choice
+        :param block: Block object
+        :return:
+        """
+        if block.hash in self.lengths:
+            return
+        self.index_block(block)
+        if not self.update_tip(block.hash):
+            block.main_chain = self.is_on_best_chain(block.hash)
+
     def visit_branch_update_main_chain(self, hash, value=False, visited=None):
         """
-        recursively traverse the blockchain and update the main_chain value
+        traverse the branch starting at hash and update the main_chain value
         :param hash: starting block hash
         :param value
         :param visited: set of visited block hashes
         :return:
         """
-        if visited is None:
-            visited = set()
-        if hash in visited:
-            # block has already been visited, exit recursion
-            return
-        visited.add(hash)
-        b = self.chain[hash]
-        b.main_chain = value
-        for n in b.next:
-            self.visit_branch_update_main_chain(n, value, visited)
+        for b in self.iter_descendants(hash, visited):
+            b.main_chain = value
 
+    @metrics.timed("blockchain.confirm_chain")
     def confirm_chain(self):
         """
-        when a fork happens, it confirms the longest chain if at
-        least one branch is more than N_BLOCKS_PER_BRANCH blocks long
+        sets main_chain and confirmed of every block from the fork-choice index: only the branch of the tip is on
+        the main chain, its blocks followed by more than N_BLOCKS_PER_BRANCH blocks are confirmed.
+        add_block keeps these values up to date, call it only after they are changed from outside
         :return:
         """
-        from server import N_BLOCKS_PER_BRANCH
-        for k in self.chain:
-            b = self.chain[k]
-            if not b.confirmed:  # the chain can become false only if block has not being confirmed yet
-                if len(b.next) > 1:  # if fork
-                    hashes = b.next
-                    count_branches = []
-                    longest_branch = 0
-                    hash = None
-                    # count blocks for each branch
-                    for h in hashes:
-                        c = count_blocks_per_branch(self.chain, h)
-                        count_branches.append(c)
-                        # get longest branch
-                        if c[h] > longest_branch:
-                            longest_branch = c[h]
-                            hash = h
-                        elif c[h] == longest_branch:
-                            # branches are equal
-                            hash = None
-                        else:
-                            pass
-                    if hash is not None:
-                        if longest_branch > N_BLOCKS_PER_BRANCH:
-                            # change main_chain values
-                            for c in count_branches:
-                                for h, v in zip(c.keys(), c.values()):
-                                    if h != hash:
-                                        # if is not the main chain
-                                        self.visit_branch_update_main_chain(h, False)
-                                    else:
-                                        # main chain
-                                        self.visit_branch_update_main_chain(h, True)
-            else:
-                # block is confirmed check successors
-                confirmed_successor = None
-                hash_confirmed_successor = None
-                for hash_successor in b.next:
-                    successor = self.chain[hash_successor]
-                    if successor.confirmed:
-                        # found confirmed successor
-                        confirmed_successor = successor
-                        hash_confirmed_successor = confirmed_successor.hash
-                if confirmed_successor:
-                    for hash_successor in b.next:
-                        if hash_successor != hash_confirmed_successor:
-                            # found another branch, set main_chain to false
-                            self.visit_branch_update_main_chain(hash_successor, False)
+        self.confirm_blocks()
+        best = set(self.best_chain)
+        confirmed = set(self.best_chain[:self.n_confirmed])
+        for h, b in self.chain.items():
+            b.main_chain = h in best
+            b.confirmed = h in confirmed
+
+
+def get_header(block):
+    """
+    :param block: Block object
+    :return: str, the data double hashed by the proof of work: previous hash, time, Merkle root and nonce
+    """
+    return str(block.prev) + str(block.time) + str(block.merkle_root) + str(block.nonce)
+
+
+def get_header_digest(block):
+    """
+    fingerprint of a block header stored by the validation cache: a block reusing a validated hash with another
+    header is validated again
+    :param block: Block object
+    :return: bytes, 16
+    """
+    return hashlib.blake2b(get_header(block).encode(), digest_size=16).digest()
+
+
+def load_validated_hashes(validated_file):
+    """
+    :param validated_file: str, file written by Blockchain.save_validated, or None
+    :return: dict, hash -> header digest of the already validated blocks. Empty for files written before the
+    digests, which only held hashes
+    """
+    if validated_file is None or not os.path.exists(validated_file):
+        return dict()
+    with open(validated_file, 'rb') as f:
+        validated = pickle.load(f)
+    return validated if isinstance(validated, dict) else dict()
+
+
+def iter_successors(blockchain, start_hash, visited=None):
+    """
+    depth-first walk of the blockchain from a given block hash, with an explicit stack instead of recursion so
+    branches of any length can be visited. The first successor of a block is visited before the second, and so on,
+    every block is yielded exactly once
+    :param blockchain: Blockchain.chain object
+    :param start_hash: hash where to start the walk
+    :param visited: set of block hashes not to visit, updated with the visited ones
+    :return: generator of Block objects
+    """
+    if visited is None:
+        visited = set()
+    stack = [start_hash]
+    while stack:
+        block_hash = stack.pop()
+        if block_hash in visited or block_hash not in blockchain:
+            continue
+        visited.add(block_hash)
+        b = blockchain[block_hash]
+        yield b
+        # reversed so the first successor is popped first
+        stack.extend(reversed(b.next))
 
 
 def count_blocks_per_branch(blockchain, start_hash_branch):
@@ -288,33 +608,4 @@ def count_blocks_per_branch(blockchain, start_hash_branch):
     :param start_hash_branch: hash where to start the count
     :return: {hash : <count>}
     """
-    count = dict()
-    visited = set()
-    def dfs(block_hash, branch_id):
-        """
-        recursive function that implements a depth-first search
-        algorithm to traverse the blockchain starting from a given
-        block hash. The purpose of the dfs function is to count
-        the number of blocks in each branch of the blockchain by visiting
-        each block exactly once and adding its count to a dictionary that
-        maps each branch to its count. The algorithm uses the depth-first
-        approach to traverse the blockchain by visiting the first successor
-        of a block before visiting the second, and so on, until there are
-        no more successors to visit, then backtracking to visit the next
-        unvisited successor if there are any.
-        :param block_hash:
-        :param branch_id:
-        :return:
-        """
-        nonlocal count
-        if block_hash in visited:
-            return
-        visited.add(block_hash)
-        if branch_id not in count:
-            count[branch_id] = 0
-        count[branch_id] += 1
-        # for next_block_id in list of next
-        for next_block_id in blockchain[block_hash].next:
-            dfs(next_block_id, branch_id)
-    dfs(start_hash_branch, start_hash_branch)
-    return count
+    return {start_hash_branch: sum(1 for _ in iter_successors(blockchain, start_hash_branch))}
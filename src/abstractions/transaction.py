@@ -1,27 +1,33 @@
 # abstraction/transaction.py
 
+import sys
 import json
 import random
 from datetime import datetime
 
 from utils.cryptographic import hash_function
-from utils.cryptographic import load_public, save_signature, load_signature
+from utils.cryptographic import load_public, save_public, save_signature, load_signature, intern_public, unpack_hash
 
 class Transaction:
     """
-    Dummy Bitcoin Transaction
+    Dummy Bitcoin Transaction.
+    Slotted and receiver_pub is interned: the receivers are a few users. hash and prev_hash stay strings, the hash is
+    the same object as the keys of the dicts indexing the transaction
     """
+    __slots__ = ("source_address", "destination_address", "time", "amount", "prev_hash", "receiver_pub", "hash",
+                 "prev_owner_sig", "is_verified", "fee")
+
     def __init__(self, source_address, destination_address, amount, receiver_pub, prev_hash, hash=None, time=None,
                  prev_owner_sig=None, is_verified=False, fee=0):
-        self.source_address = source_address
-        self.destination_address = destination_address
+        self.source_address = intern_address(source_address)
+        self.destination_address = intern_address(destination_address)
         if time is None:
             self.time = datetime.now().timestamp()
         else:
             self.time = time
         self.amount = amount
         self.prev_hash = prev_hash  # last transaction from source address
-        self.receiver_pub = receiver_pub  # receiver public key
+        self.receiver_pub = intern_public(receiver_pub)  # receiver public key
         if hash is None:
             self.hash = hash_function(str(self.prev_hash) + str(self.receiver_pub) + str(self.time))
         else:
@@ -33,6 +39,19 @@ class Transaction:
             fee = self.assign_transaction_fee()
         self.fee = fee
 
+    def __getstate__(self):
+        return {s: getattr(self, s) for s in self.__slots__}
+
+    def __setstate__(self, state):
+        # transactions pickled before the slots have the same keys, the ones pickled with packed hashes have
+        # "_hash" and "_prev_hash" as bytes and may have their cached strings
+        for k, v in state.items():
+            if k in ("_hash", "_prev_hash"):
+                setattr(self, k[1:], unpack_hash(v))
+            elif k not in ("_hash_hex", "_prev_hash_hex"):
+                setattr(self, k, v)
+        self.receiver_pub = intern_public(self.receiver_pub)
+
     def assign_transaction_fee(self):
         """
         based on the amount of the transaction it assign a transaction fee
@@ -46,7 +65,7 @@ class Transaction:
         make transaction to dictionary for serialization
         :return:
         """
-        recv_pub = self.receiver_pub.save_pkcs1(format="PEM").decode('utf-8')
+        recv_pub = save_public(self.receiver_pub)
         signature = save_signature(self.prev_owner_sig)
         return {
             "source_address": self.source_address,
@@ -63,7 +82,15 @@ class Transaction:
 
     @classmethod
     def load_json(cls, data):
-        data = json.loads(data)
+        return cls.from_dict(json.loads(data))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        builds a transaction from its to_dict() representation, e.g. straight from a parsed response
+        :param data: dict
+        :return: Transaction
+        """
         recv_pub = load_public(data['receiver_pub'])
         prev_owner_sig = load_signature(data["prev_owner_sig"])
         return cls(
@@ -84,4 +111,12 @@ class Transaction:
         redefine builtin func for printing
         :return:
         """
-        return str(self.__class__) + ": " + str(self.__dict__)
\ No newline at end of file
+        return str(self.__class__) + ": " + str(self.__getstate__())
+
+
+def intern_address(address):
+    """
+    :param address: str, user address
+    :return: the interned address, a few users send and receive every transaction
+    """
+    return sys.intern(address) if isinstance(address, str) else address
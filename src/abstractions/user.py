@@ -11,7 +11,7 @@ from server.db import get_user
 
 class User:
     def __init__(self, username=None, initial_balance=None, from_db=False, user_to_load=None, public=None,
-                 transactions=[], private=None, mined_blocks=0, confirmed_blocks=0, total_reward=0):
+                 transactions=None, private=None, mined_blocks=0, confirmed_blocks=0, total_reward=0):
         """
 
         :param username:
@@ -37,6 +37,8 @@ class User:
                 self.pubkey = public
                 self.privkey = private
             self.address = hash_function(str(self.username + str(self.pubkey)))  # unique user ID / address
+            if transactions is None:
+                transactions = []
             self.transactions = transactions
             self.mined_blocks = mined_blocks
             self.confirmed_blocks = confirmed_blocks
@@ -61,7 +63,15 @@ class User:
 
     @classmethod
     def load_json(cls, data):
-        data = json.loads(data)
+        return cls.from_dict(json.loads(data))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        builds a user from its to_dict() representation
+        :param data: dict
+        :return: User
+        """
         if data['privkey'] == 'Secret':
             privkey = data['privkey']
         else:
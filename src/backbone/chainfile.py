@@ -0,0 +1,478 @@
+# backbone/chainfile.py
+"""
+Compact binary format of a Blockchain, read through mmap so a block is loaded by hash or height
+without reading the rest of the chain.
+
+    +-------------+  magic, number of blocks, offsets of the sections
+    |   header    |
+    +-------------+
+    |   records   |  one fixed-width record per block, sorted by height:
+    |             |  hash, prev, merkle_root, time, nonce, height, flags, body offset and length
+    +-------------+
+    | hash index  |  (hash, record number) sorted by hash, binary searched
+    +-------------+
+    |   bodies    |  variable-length part of every block: miner, signature, next, transactions
+    +-------------+
+
+Hashes are stored as 32 raw bytes. Any value which does not fit the compact encoding (e.g. a hash which is not
+64 hexadecimal characters) is kept as is, so reading a block gives back exactly its to_dict().
+"""
+import os
+import mmap
+import json
+import base64
+import struct
+import hashlib
+import functools
+
+import rsa
+
+from abstractions.block import Block, Blockchain
+from utils.cryptographic import load_public
+from server import BLOCKCHAIN_PATH, CHAIN_BINARY_FILE
+
+MAGIC = b'BCF1'
+FILE_HEADER = struct.Struct('<4sIQQQ')  # magic, n_blocks, records, index, bodies offsets
+# hash, prev, merkle_root, time, nonce, height, flags, body offset, body length
+RECORD = struct.Struct('<32s32s32sdQIBQI')
+INDEX = struct.Struct('<32sI')  # hash, record number
+
+# record flags
+MAIN_CHAIN = 1
+CONFIRMED = 2
+TIME_INT = 4  # time was an int
+EXTRAS = 8  # some header fields are stored in the body, see pack_block
+
+HEX_DIGITS = set('0123456789abcdef')
+MAX_U32 = 2 ** 32 - 1
+MAX_U64 = 2 ** 64 - 1
+
+# value tags, RAW are decoded signatures and DER public keys
+NONE, HASH, STR, INT, FLOAT, JSON, RAW = range(7)
+
+
+def hash_key(hash):
+    """
+    32-byte key of a hash: its raw bytes if it is 64 hexadecimal characters, its SHA-256 otherwise
+    :param hash: str
+    :return: bytes
+    """
+    if is_hex_hash(hash):
+        return bytes.fromhex(hash)
+    return hashlib.sha256(str(hash).encode()).digest()
+
+
+def is_hex_hash(value):
+    """
+    :param value:
+    :return: bool, True if value is a lowercase SHA-256 hexadecimal digest
+    """
+    return isinstance(value, str) and len(value) == 64 and set(value) <= HEX_DIGITS
+
+
+class Packer:
+    """
+    appends tagged values to a bytearray
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def value(self, v):
+        """
+        packs a hash as 32 bytes, numbers in 8 bytes, anything else as a string or JSON
+        :param v: None, str, int, float or any JSON serializable value
+        :return:
+        """
+        if v is None:
+            self.buffer.append(NONE)
+        elif is_hex_hash(v):
+            self.buffer.append(HASH)
+            self.buffer += bytes.fromhex(v)
+        elif isinstance(v, str):
+            self.buffer.append(STR)
+            self.bytes(v.encode('utf-8'))
+        elif isinstance(v, int) and not isinstance(v, bool) and -2 ** 63 <= v < 2 ** 63:
+            self.buffer.append(INT)
+            self.buffer += struct.pack('<q', v)
+        elif isinstance(v, float):
+            self.buffer.append(FLOAT)
+            self.buffer += struct.pack('<d', v)
+        else:
+            self.buffer.append(JSON)
+            self.bytes(json.dumps(v).encode('utf-8'))
+
+    def list(self, values):
+        """
+        :param values: list of values, or any other value
+        :return:
+        """
+        if not isinstance(values, list):
+            self.buffer.append(0)
+            self.value(values)
+            return
+        self.buffer.append(1)
+        self.buffer += struct.pack('<I', len(values))
+        for v in values:
+            self.value(v)
+
+    def bytes(self, b):
+        """
+        :param b: bytes, length prefixed
+        :return:
+        """
+        self.buffer += struct.pack('<I', len(b))
+        self.buffer += b
+
+    def signature(self, s):
+        """
+        base64 signatures are stored decoded, unless decoding would not give back the same string
+        :param s: str
+        :return:
+        """
+        if isinstance(s, str):
+            try:
+                raw = base64.b64decode(s.encode('utf-8'), validate=True)
+                if base64.b64encode(raw).decode('utf-8') == s:
+                    self.buffer.append(RAW)
+                    self.bytes(raw)
+                    return
+            except ValueError:
+                pass
+        self.value(s)
+
+    def public_key(self, pem):
+        """
+        PEM public keys are stored as DER, unless converting back would not give the same PEM
+        :param pem: str
+        :return:
+        """
+        der = pem_to_der(pem) if isinstance(pem, str) else None
+        if der is not None:
+            self.buffer.append(RAW)
+            self.bytes(der)
+            return
+        self.value(pem)
+
+
+class Unpacker:
+    """
+    reads values written by Packer from a buffer
+    """
+    def __init__(self, buffer, pos=0):
+        self.buffer = buffer
+        self.pos = pos
+
+    def value(self):
+        tag = self.buffer[self.pos]
+        self.pos += 1
+        if tag == NONE:
+            return None
+        if tag == HASH:
+            v = bytes(self.buffer[self.pos:self.pos + 32]).hex()
+            self.pos += 32
+            return v
+        if tag == STR:
+            return self.bytes().decode('utf-8')
+        if tag == INT:
+            v = struct.unpack_from('<q', self.buffer, self.pos)[0]
+            self.pos += 8
+            return v
+        if tag == FLOAT:
+            v = struct.unpack_from('<d', self.buffer, self.pos)[0]
+            self.pos += 8
+            return v
+        return json.loads(self.bytes().decode('utf-8'))
+
+    def list(self):
+        is_list = self.buffer[self.pos]
+        self.pos += 1
+        if not is_list:
+            return self.value()
+        n = struct.unpack_from('<I', self.buffer, self.pos)[0]
+        self.pos += 4
+        return [self.value() for _ in range(n)]
+
+    def bytes(self):
+        n = struct.unpack_from('<I', self.buffer, self.pos)[0]
+        self.pos += 4
+        b = bytes(self.buffer[self.pos:self.pos + n])
+        self.pos += n
+        return b
+
+    def signature(self):
+        if self.buffer[self.pos] != RAW:
+            return self.value()
+        self.pos += 1
+        return base64.b64encode(self.bytes()).decode('utf-8')
+
+    def public_key(self):
+        if self.buffer[self.pos] != RAW:
+            return self.value()
+        self.pos += 1
+        return der_to_pem(self.bytes())
+
+
+# a few users receive every transaction, their keys are converted once
+@functools.lru_cache(maxsize=4096)
+def pem_to_der(pem):
+    """
+    :param pem: str, PEM public key
+    :return: bytes, DER public key, None if converting it back would not give the same PEM
+    """
+    try:
+        der = load_public(pem).save_pkcs1(format='DER')
+    except (ValueError, TypeError):
+        return None
+    return der if der_to_pem(der) == pem else None
+
+
+@functools.lru_cache(maxsize=4096)
+def der_to_pem(der):
+    """
+    :param der: bytes, DER public key
+    :return: str, PEM public key
+    """
+    return rsa.PublicKey.load_pkcs1(der, format='DER').save_pkcs1(format='PEM').decode('utf-8')
+
+
+TRANSACTION_VALUES = ["source_address", "destination_address", "time", "amount", "prev_hash", "hash",
+                      "is_verified", "fee"]
+
+
+def pack_block(block_dict):
+    """
+    splits a block into its fixed-width record fields and its body
+    :param block_dict: dict, see Block.to_dict
+    :return: tuple of record fields (without body offset and length), body bytes
+    """
+    extras = dict()
+    flags = 0
+    if block_dict["main_chain"]:
+        flags |= MAIN_CHAIN
+    if block_dict["confirmed"]:
+        flags |= CONFIRMED
+    for field in ("main_chain", "confirmed"):
+        if not isinstance(block_dict[field], bool):
+            extras[field] = block_dict[field]
+    for field in ("hash", "prev", "merkle_root"):
+        if not is_hex_hash(block_dict[field]):
+            extras[field] = block_dict[field]
+    time = block_dict["time"]
+    if isinstance(time, int) and not isinstance(time, bool) and abs(time) < 2 ** 53:
+        flags |= TIME_INT
+        time = float(time)
+    elif not isinstance(time, float):
+        extras["time"] = time
+        time = 0.0
+    nonce = block_dict["nonce"]
+    if not (isinstance(nonce, int) and not isinstance(nonce, bool) and 0 <= nonce <= MAX_U64):
+        extras["nonce"] = nonce
+        nonce = 0
+    height = block_dict["height"]
+    if not (isinstance(height, int) and not isinstance(height, bool) and 0 <= height <= MAX_U32):
+        extras["height"] = height
+        height = 0
+    if extras:
+        flags |= EXTRAS
+
+    body = Packer()
+    if extras:
+        body.bytes(json.dumps(extras).encode('utf-8'))
+    body.value(block_dict["mined_by"])
+    body.signature(block_dict["signature"])
+    body.value(block_dict["creation_time"])
+    body.list(block_dict["next"])
+    body.buffer += struct.pack('<I', len(block_dict["transactions"]))
+    for t in block_dict["transactions"]:
+        for field in TRANSACTION_VALUES:
+            body.value(t[field])
+        body.public_key(t["receiver_pub"])
+        body.signature(t["prev_owner_sig"])
+    record = (hash_key(block_dict["hash"]), hash_key(block_dict["prev"]), hash_key(block_dict["merkle_root"]),
+              time, nonce, height, flags)
+    return record, bytes(body.buffer)
+
+
+def unpack_block(record, body):
+    """
+    :param record: tuple, unpacked RECORD
+    :param body: buffer of the block body
+    :return: dict, same as the Block.to_dict written
+    """
+    hash, prev, merkle_root, time, nonce, height, flags, _, _ = record
+    reader = Unpacker(body)
+    extras = json.loads(reader.bytes().decode('utf-8')) if flags & EXTRAS else dict()
+    d = {
+        "hash": hash.hex(),
+        "prev": prev.hex(),
+        "nonce": nonce,
+        "time": int(time) if flags & TIME_INT else time,
+        "merkle_root": merkle_root.hex(),
+        "main_chain": bool(flags & MAIN_CHAIN),
+        "confirmed": bool(flags & CONFIRMED),
+        "height": height,
+    }
+    d["mined_by"] = reader.value()
+    d["signature"] = reader.signature()
+    d["creation_time"] = reader.value()
+    d["next"] = reader.list()
+    n = struct.unpack_from('<I', reader.buffer, reader.pos)[0]
+    reader.pos += 4
+    transactions = []
+    for _ in range(n):
+        t = {field: reader.value() for field in TRANSACTION_VALUES}
+        t["receiver_pub"] = reader.public_key()
+        t["prev_owner_sig"] = reader.signature()
+        transactions.append(t)
+    d["transactions"] = transactions
+    d.update(extras)
+    return d
+
+
+def write_chain(blockchain, path=BLOCKCHAIN_PATH + CHAIN_BINARY_FILE):
+    """
+    writes a blockchain in the binary format
+    :param blockchain: Blockchain object
+    :param path: str, output file
+    :return:
+    """
+    blocks = sorted((b.to_dict() for b in blockchain.chain.values()),
+                    key=lambda d: d["height"] if isinstance(d["height"], int) else 0)
+    records = []
+    bodies = bytearray()
+    for d in blocks:
+        record, body = pack_block(d)
+        records.append(record + (len(bodies), len(body)))
+        bodies += body
+    records_offset = FILE_HEADER.size
+    index_offset = records_offset + RECORD.size * len(records)
+    bodies_offset = index_offset + INDEX.size * len(records)
+    index = sorted((r[0], i) for i, r in enumerate(records))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(FILE_HEADER.pack(MAGIC, len(records), records_offset, index_offset, bodies_offset))
+        for r in records:
+            f.write(RECORD.pack(*r))
+        for key, i in index:
+            f.write(INDEX.pack(key, i))
+        f.write(bodies)
+    os.replace(tmp, path)
+
+
+class ChainFile:
+    """
+    read-only, memory-mapped access to a chain written by write_chain
+    """
+    def __init__(self, path=BLOCKCHAIN_PATH + CHAIN_BINARY_FILE):
+        """
+        :param path: str, binary chain file
+        """
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_blocks, self.records_offset, self.index_offset, self.bodies_offset = \
+            FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a binary chain file")
+
+    def __len__(self):
+        return self.n_blocks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def get_height(self):
+        """
+        :return: int, height of the highest block, -1 if the file is empty
+        """
+        return self.get_record(self.n_blocks - 1)[5] if self.n_blocks else -1
+
+    def get_record(self, i):
+        """
+        :param i: int, record number
+        :return: tuple hash, prev, merkle_root, time, nonce, height, flags, body offset, body length
+        """
+        return RECORD.unpack_from(self.map, self.records_offset + i * RECORD.size)
+
+    def get_block_dict(self, i):
+        """
+        :param i: int, record number
+        :return: dict, see Block.to_dict
+        """
+        record = self.get_record(i)
+        start = self.bodies_offset + record[7]
+        return unpack_block(record, memoryview(self.map)[start:start + record[8]])
+
+    def get_block(self, i):
+        """
+        :param i: int, record number
+        :return: Block
+        """
+        return Block.from_dict(self.get_block_dict(i))
+
+    def find(self, hash):
+        """
+        binary search in the hash index
+        :param hash: str, block hash
+        :return: int, record number, None if not found
+        """
+        key = hash_key(hash)
+        low, high = 0, self.n_blocks
+        while low < high:
+            middle = (low + high) // 2
+            k, i = INDEX.unpack_from(self.map, self.index_offset + middle * INDEX.size)
+            if k < key:
+                low = middle + 1
+            elif k > key:
+                high = middle
+            else:
+                return i
+        return None
+
+    def get_by_hash(self, hash):
+        """
+        :param hash: str, block hash
+        :return: Block, None if not found
+        """
+        i = self.find(hash)
+        return self.get_block(i) if i is not None else None
+
+    def get_by_height(self, height):
+        """
+        binary search in the records, sorted by height
+        :param height: int
+        :return: list of Block at that height, more than one if there is a fork
+        """
+        low, high = 0, self.n_blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_record(middle)[5] < height:
+                low = middle + 1
+            else:
+                high = middle
+        blocks = []
+        while low < self.n_blocks and self.get_record(low)[5] == height:
+            blocks.append(self.get_block(low))
+            low += 1
+        return blocks
+
+    def iter_block_dicts(self):
+        """
+        :return: generator of dict, see Block.to_dict
+        """
+        for i in range(self.n_blocks):
+            yield self.get_block_dict(i)
+
+    def to_blockchain(self):
+        """
+        :return: Blockchain with every block of the file
+        """
+        return Blockchain.from_dict({"chain": list(self.iter_block_dicts())})
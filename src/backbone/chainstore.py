@@ -0,0 +1,155 @@
+# backbone/chainstore.py
+
+import os
+import pickle
+
+from abstractions.block import Block, Blockchain
+from backbone.chainfile import ChainFile, write_chain
+from server import BLOCKCHAIN_PATH, BLOCKCHAIN_FILE, VALIDATED_FILE, CHAIN_BINARY_FILE, GET_BLOCKCHAIN
+from utils.flask_utils import flask_call
+from utils.view import Colors
+
+
+class ChainStore:
+    """
+    Local copy of the blockchain, pickled in vis/blockchain/blockchain.pkl and also written next to it in the
+    binary format of backbone.chainfile, which tools read block by block without loading the whole chain.
+    sync() asks the server only for the blocks after the local height and tip. A response without the local tip
+    (the server was restarted or ignored the query) is the full dump, or one is fetched: the local chain is then
+    rebuilt from it and the blocks the server no longer has are dropped.
+    """
+    def __init__(self, path=BLOCKCHAIN_PATH + BLOCKCHAIN_FILE):
+        """
+        :param path: str, store file
+        """
+        self.path = path
+        self.chain_file_path = os.path.join(os.path.dirname(path), CHAIN_BINARY_FILE)
+        self.blockchain = None
+
+    @classmethod
+    def load(cls, path=BLOCKCHAIN_PATH + BLOCKCHAIN_FILE):
+        """
+        :param path: str, store file
+        :return: ChainStore, empty if the file does not exist yet
+        """
+        store = cls(path)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                store.blockchain = pickle.load(f)
+            # the blocks were validated before they were saved, only the ones missing from the cache are hashed
+            store.blockchain.is_valid = store.blockchain.is_chain_valid(trust_cache=True)
+        return store
+
+    def save(self):
+        """
+        pickles the chain and writes its binary chain file
+        :return:
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.blockchain, f)
+        os.replace(tmp, self.path)
+        if self.blockchain is not None:
+            write_chain(self.blockchain, self.chain_file_path)
+
+    def open_chain_file(self):
+        """
+        :return: backbone.chainfile.ChainFile of the last saved chain, None if it was never saved
+        """
+        if not os.path.exists(self.chain_file_path):
+            return None
+        return ChainFile(self.chain_file_path)
+
+    def get_height(self):
+        """
+        :return: int, height of the highest block held, -1 if empty
+        """
+        if self.blockchain is None:
+            return -1
+        return self.blockchain.height
+
+    def get_tip(self):
+        """
+        :return: str, hash of the last block of the longest branch, None if empty
+        """
+        if self.blockchain is None:
+            return None
+        tip = self.blockchain.get_tip()
+        return tip.hash if tip is not None else None
+
+    def apply(self, block_dicts):
+        """
+        merges the blocks of a GET_BLOCKCHAIN response. A delta is added on top of the local chain, only the
+        blocks missing locally are deserialized. main_chain and confirmed always come from the local fork-choice
+        index, never from the server
+        :param block_dicts: list of blocks as dict, see Block.to_dict
+        :return: int, number of new blocks, None if the response is a delta which does not attach to the local
+        chain (e.g. the server was restarted): fetch the full dump and call replace
+        """
+        if self.blockchain is None:
+            return self.replace(block_dicts)
+        hashes = {d['hash'] for d in block_dicts}
+        if self.get_tip() not in hashes:
+            # the server does not know our tip: a full dump replaces the local chain, a delta cannot be applied
+            if any(d['prev'] == 'None' for d in block_dicts):
+                return self.replace(block_dicts)
+            return None
+        chain = self.blockchain.chain
+        new_blocks = [d for d in block_dicts if d['hash'] not in chain]
+        for d in sorted(new_blocks, key=lambda x: x['height']):
+            if not self.blockchain.add_block(Block.from_dict(d)):
+                return None
+        if new_blocks:
+            self.blockchain.save_validated()
+        return len(new_blocks)
+
+    def replace(self, block_dicts):
+        """
+        rebuilds the local chain from the full dump of the server: local blocks the server no longer has are
+        dropped, blocks failing validation are reported and left out. Known headers are not double hashed again
+        :param block_dicts: list of every block as dict, see Block.to_dict
+        :return: int, number of blocks not held before
+        """
+        old = self.blockchain.chain if self.blockchain is not None else dict()
+        blockchain = Blockchain([], validated_file=os.path.join(os.path.dirname(self.path), VALIDATED_FILE))
+        if self.blockchain is not None:
+            blockchain.validated.update(self.blockchain.validated)
+        rejected = [d['hash'] for d in sorted(block_dicts, key=lambda x: x['height'])
+                    if not blockchain.add_block(Block.from_dict(d))]
+        if rejected:
+            print(Colors.WARNING + f"{len(rejected)} blocks of the server rejected (invalid proof of work or "
+                                   f"unknown previous block): " + ", ".join(h[:12] for h in rejected) + Colors.ENDC)
+        dropped = sum(1 for h in old if h not in blockchain.chain)
+        if dropped:
+            print(Colors.WARNING + f"{dropped} local blocks dropped, the server no longer has them" + Colors.ENDC)
+        blockchain.save_validated()
+        self.blockchain = blockchain
+        return sum(1 for h in blockchain.chain if h not in old)
+
+    def get_sync_params(self):
+        """
+        :return: dict, query string of a GET_BLOCKCHAIN asking only for the blocks missing locally
+        """
+        if self.blockchain is None:
+            return None
+        return {'height': self.get_height(), 'tip': self.get_tip()}
+
+    def sync(self):
+        """
+        fetches the blocks missing locally and saves the store
+        :return: int, number of new blocks
+        """
+        _, data, _ = flask_call('GET', GET_BLOCKCHAIN, params=self.get_sync_params())
+        if not data:
+            # no answer, the local chain is kept
+            return 0
+        new = self.apply(data['chain'])
+        if new is None:
+            # the delta does not attach to the local chain, fall back to the full dump
+            _, data, _ = flask_call('GET', GET_BLOCKCHAIN)
+            if not data:
+                return 0
+            new = self.replace(data['chain'])
+        self.save()
+        return new
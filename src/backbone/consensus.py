@@ -1,6 +1,502 @@
 # backbone/consensus.py
 
-# TODO: Implement Proof of Work
+import os
+import queue
+import ctypes
+import hashlib
+import functools
+import multiprocessing as mp
+import time as timer
+from datetime import datetime
 
-# TODO: Build a block
+from server import DIFFICULTY, SELF, PRIVATE_KEY_FILE, MAX_TXS_PER_BLOCK, BLOCK_PROPOSAL
+from backbone.merkle import MerkleTree
+from backbone.template import BlockTemplateBuilder
+from backbone.poller import TIP_CHANGED, DIFFICULTY_CHANGED
+from backbone.strategy import get_strategy
+from abstractions.block import Block
+from utils.cryptographic import MiningHasher, double_hash, load_private, sign_message
+from utils.flask_utils import flask_call
+from utils import metrics
 
+# number of nonces a worker tests in one backend call, before checking whether it has to stop
+# (solution found or stale work), i.e. a few milliseconds of hashing
+BATCH_SIZE = 5000
+# seconds between two liveness checks of the workers while waiting for their results
+WORKER_TIMEOUT = 1.0
+# shared library built from backbone/native/pow.c
+NATIVE_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'native', 'libpow.so')
+
+
+def get_block_header(prev, time, merkle_root):
+    """
+    builds the part of the block header which stays the same for every nonce.
+    The order is the one checked by the server: previous block hash, time, Merkle root (then nonce)
+    :param prev: str, hash of the previous block
+    :param time: timestamp of the block
+    :param merkle_root: str, root of the Merkle tree of the block transactions
+    :return: str
+    """
+    return str(prev) + str(time) + str(merkle_root)
+
+
+def is_hash_valid(hash, difficulty=DIFFICULTY):
+    """
+    checks if a hash solves the proof of work puzzle
+    :param hash: str, double hash of the block header
+    :param difficulty: int, number of leading zeros required
+    :return: bool
+    """
+    return hash.startswith('0' * difficulty)
+
+
+class HashBackend:
+    """
+    Interface of a mining backend: it tests a whole batch of nonces in a single call,
+    so the per-call overhead is paid once per batch and not once per nonce.
+    """
+    name = None
+
+    @classmethod
+    def is_available(cls):
+        """
+        :return: bool, True if the backend can be used on this machine
+        """
+        return True
+
+    def hash(self, header, nonce):
+        """
+        :param header: str, block header without nonce
+        :param nonce: int
+        :return: str, same as double_hash(header + str(nonce))
+        """
+        raise NotImplementedError
+
+    def search(self, header, start, step, count, difficulty):
+        """
+        tests the nonces start, start + step, ..., start + (count - 1) * step
+        :param header: str, block header without nonce
+        :param start: int, first nonce
+        :param step: int, distance between two nonces
+        :param count: int, number of nonces to test
+        :param difficulty: int, number of leading zeros required
+        :return: number of nonces tested, nonce, hash. nonce and hash are None if no valid nonce is found
+        """
+        raise NotImplementedError
+
+
+class HashlibBackend(HashBackend):
+    """
+    pure Python backend, midstate-cached hashlib SHA-256
+    """
+    name = 'hashlib'
+
+    def hash(self, header, nonce):
+        return MiningHasher(header).double_hash(nonce)
+
+    def search(self, header, start, step, count, difficulty):
+        target = '0' * difficulty
+        # local bindings keep attribute lookups out of the loop
+        copy = MiningHasher(header).midstate.copy
+        sha256 = hashlib.sha256
+        nonce = start
+        for i in range(count):
+            hash_obj = copy()
+            hash_obj.update(str(nonce).encode())
+            d_hash = sha256(hash_obj.hexdigest().encode()).hexdigest()
+            if d_hash.startswith(target):
+                return i + 1, nonce, d_hash
+            nonce += step
+        return count, None, None
+
+
+class NativeBackend(HashBackend):
+    """
+    C backend, the whole batch is searched in backbone/native/pow.c.
+    Available only once the shared library is built, see the header of pow.c
+    """
+    name = 'native'
+
+    def __init__(self):
+        self.lib = ctypes.CDLL(NATIVE_LIBRARY)
+        self.lib.pow_hash.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint64, ctypes.c_char_p]
+        self.lib.pow_hash.restype = None
+        self.lib.pow_search.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint64, ctypes.c_uint64,
+                                        ctypes.c_uint64, ctypes.c_int, ctypes.POINTER(ctypes.c_uint64),
+                                        ctypes.c_char_p]
+        self.lib.pow_search.restype = ctypes.c_uint64
+
+    @classmethod
+    def is_available(cls):
+        return os.path.exists(NATIVE_LIBRARY)
+
+    def hash(self, header, nonce):
+        data = header.encode()
+        out = ctypes.create_string_buffer(64)
+        self.lib.pow_hash(data, len(data), nonce, out)
+        return out.raw.decode()
+
+    def search(self, header, start, step, count, difficulty):
+        data = header.encode()
+        nonce = ctypes.c_uint64()
+        out = ctypes.create_string_buffer(64)
+        tested = self.lib.pow_search(data, len(data), start, step, count, difficulty, ctypes.byref(nonce), out)
+        if tested:
+            return tested, nonce.value, out.raw.decode()
+        return count, None, None
+
+
+# fastest first
+BACKENDS = {
+    NativeBackend.name: NativeBackend,
+    HashlibBackend.name: HashlibBackend,
+}
+
+
+def check_backend(backend, header="prev" + "1707912345.123456" + "merkle_root", n=200):
+    """
+    correctness test shared by every backend: hashes and searches must match double_hash,
+    which is what the server uses to verify a block
+    :param backend: HashBackend instance
+    :param header: str, block header used for the test
+    :param n: number of nonces checked
+    :return: bool
+    """
+    # 2 ** 64 - 1 is the last nonce of the native backend (uint64)
+    for nonce in list(range(n)) + [10 ** 12 + 7, 2 ** 64 - 1]:
+        if backend.hash(header, nonce) != double_hash(header + str(nonce)):
+            return False
+    # reference search with difficulty 2 on the nonces 3, 8, 13, ...
+    expected = None
+    for i in range(5000):
+        d_hash = double_hash(header + str(3 + 5 * i))
+        if d_hash.startswith('00'):
+            expected = (i + 1, 3 + 5 * i, d_hash)
+            break
+    return backend.search(header, 3, 5, 5000, 2) == (expected or (5000, None, None))
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend(name=None):
+    """
+    selects a mining backend at runtime, the choice is cached for the process
+    :param name: str, backend name in BACKENDS. If None, the fastest available backend passing check_backend
+    :return: HashBackend instance
+    """
+    if name is not None:
+        backend = BACKENDS[name]()
+        if not check_backend(backend):
+            raise ValueError(f"backend {name} does not match double_hash")
+        return backend
+    for backend_class in BACKENDS.values():
+        if backend_class.is_available():
+            backend = backend_class()
+            if check_backend(backend):
+                return backend
+    raise ValueError("no mining backend available")
+
+
+def pow_worker(worker_id, header, difficulty, start, step, found, results, backend_name=HashlibBackend.name):
+    """
+    searches the nonces start, start + step, start + 2 * step, ... in batches of BATCH_SIZE until a valid hash
+    is found by this worker or by any other worker (found event is set).
+    It always puts exactly one result in the results queue before returning.
+    :param worker_id: int
+    :param header: str, block header without nonce
+    :param difficulty: int
+    :param start: int, first nonce tested
+    :param step: int, distance between two nonces tested, i.e. number of workers
+    :param found: multiprocessing.Event, set when a solution is found
+    :param results: multiprocessing.Queue
+    :param backend_name: str, name of the backend in BACKENDS
+    :return:
+    """
+    backend = BACKENDS[backend_name]()
+    nonce = start
+    hashes = 0
+    solution = None
+    start_time = timer.perf_counter()
+    while solution is None and not found.is_set():
+        tested, valid_nonce, d_hash = backend.search(header, nonce, step, BATCH_SIZE, difficulty)
+        hashes += tested
+        if valid_nonce is not None:
+            solution = (valid_nonce, d_hash)
+            found.set()
+        nonce += BATCH_SIZE * step
+    elapsed = timer.perf_counter() - start_time
+    results.put({
+        "worker": worker_id,
+        "hashes": hashes,
+        "seconds": elapsed,
+        "hashrate": hashes / elapsed if elapsed > 0 else 0,
+        "solution": solution
+    })
+
+
+def proof_of_work(prev, time, merkle_root, difficulty=DIFFICULTY, n_workers=None, backend=None, stop=None):
+    """
+    splits the nonce space across n_workers processes, each one testing every n_workers-th nonce.
+    All workers are stopped as soon as one of them finds a valid hash, or as soon as stop is set from outside.
+    :param prev: str, hash of the previous block
+    :param time: timestamp of the block
+    :param merkle_root: str, root of the Merkle tree of the block transactions
+    :param difficulty: int, number of leading zeros required
+    :param n_workers: int, number of processes, defaults to the number of cores
+    :param backend: str, name of the mining backend, defaults to the fastest available one
+    :param stop: multiprocessing.Event, set it to abort the search (e.g. the tip changed). None for a private one
+    :return: nonce, hash, list of per-worker stats {worker, hashes, seconds, hashrate}.
+    nonce and hash are None if the search was aborted
+    :raise RuntimeError: if a worker died without reporting
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    backend = get_backend(backend).name
+    header = get_block_header(prev, time, merkle_root)
+    found = stop if stop is not None else mp.Event()
+    results = mp.Queue()
+    workers = [mp.Process(target=pow_worker, args=(i, header, difficulty, i, n_workers, found, results, backend),
+                          daemon=True) for i in range(n_workers)]
+    for w in workers:
+        w.start()
+    stats = []
+    solution = None
+    try:
+        # every worker reports once, drain the queue before joining the processes
+        while len(stats) < n_workers:
+            try:
+                result = results.get(timeout=WORKER_TIMEOUT)
+            except queue.Empty:
+                # a worker which exited cleanly has already flushed its result, only a crash loses it
+                reported = {s["worker"] for s in stats}
+                for i, w in enumerate(workers):
+                    if i not in reported and not w.is_alive() and w.exitcode != 0:
+                        raise RuntimeError(f"proof of work worker {i} died with exit code {w.exitcode}")
+                continue
+            if result["solution"] is not None and solution is None:
+                solution = result["solution"]
+                found.set()
+            stats.append(result)
+    finally:
+        found.set()
+        for w in workers:
+            w.join()
+    nonce, d_hash = solution if solution is not None else (None, None)
+    stats = sorted(({k: v for k, v in s.items() if k != "solution"} for s in stats), key=lambda s: s["worker"])
+    return nonce, d_hash, stats
+
+
+def get_tip(blockchain):
+    """
+    gets the last block of the longest branch, i.e. the block to mine on
+    :param blockchain: Blockchain object
+    :return: Block
+    """
+    return blockchain.get_tip()
+
+
+def mine_block(prev_block, transactions, difficulty=DIFFICULTY, n_workers=None, backend=None, stop=None,
+               merkle_root=None):
+    """
+    builds a new block on top of prev_block containing transactions and solves its proof of work.
+    The block hash is signed with the miner private key.
+    :param prev_block: Block, parent of the new block
+    :param transactions: list of Transaction objects
+    :param difficulty: int
+    :param n_workers: int, number of processes
+    :param backend: str, name of the mining backend
+    :param stop: multiprocessing.Event, aborts the proof of work when set
+    :param merkle_root: str, Merkle root of transactions, e.g. kept up to date by the Miner. None to compute it
+    :return: Block (None if aborted), list of per-worker stats
+    """
+    start = timer.time()
+    time = datetime.now().timestamp()
+    if merkle_root is None:
+        merkle_root = MerkleTree([t.hash for t in transactions]).get_root_hash()
+    nonce, d_hash, stats = proof_of_work(prev_block.hash, time, merkle_root, difficulty, n_workers, backend, stop)
+    if nonce is None:
+        return None, stats
+    with open(PRIVATE_KEY_FILE, 'r') as f:
+        private_key = load_private(f.read())
+    block = Block(
+        hash=d_hash,
+        nonce=nonce,
+        time=time,
+        creation_time=timer.time() - start,
+        height=prev_block.height + 1,
+        previous_block=prev_block.hash,
+        transactions=transactions,
+        merkle_root=merkle_root,
+        next=[],
+        mined_by=SELF,
+        signature=sign_message(d_hash, private_key),
+    )
+    return block, stats
+
+
+class Miner:
+    """
+    Mining loop fed by a backbone.poller.ChainPoller. When the tip (or the difficulty) changes, the in-flight
+    proof of work is aborted within one batch, the header is rebuilt on the new tip keeping the selected
+    transactions which are still in the mempool, and the hashing time lost on the old tip is recorded.
+    The Merkle tree of the template is kept between rounds and only the leaves which changed are rehashed.
+    """
+    def __init__(self, poller, n_workers=None, backend=None, max_txs=MAX_TXS_PER_BLOCK, strategy=None):
+        """
+        :param poller: ChainPoller, with a mempool
+        :param n_workers: int, number of processes
+        :param backend: str, name of the mining backend
+        :param max_txs: int, maximum number of transactions in a block
+        :param strategy: str, name of the parent selection strategy, see backbone.strategy
+        """
+        self.poller = poller
+        self.strategy = get_strategy(strategy)
+        self.n_workers = n_workers
+        self.backend = backend
+        self.max_txs = max_txs
+        # the server one once the poller knows it, see mine_round
+        self.difficulty = poller.difficulty if poller.difficulty is not None else DIFFICULTY
+        self.stop = mp.Event()
+        self.tip_version = 0  # poller tip version when the current round started
+        self.closed = False  # set by close(), ends run() when mining forever
+        self.transactions = []  # selected for the current round
+        self.merkle_tree = MerkleTree([])  # of self.transactions, see update_merkle_tree
+        self.rounds = 0
+        self.stale_rounds = 0
+        self.stale_hashes = 0
+        self.stale_seconds = 0.0  # wall time spent hashing on a stale tip
+        self.total_seconds = 0.0
+        self.last_stats = []
+        poller.subscribe(self.on_event)
+
+    def on_event(self, event, value):
+        """
+        called from the poller thread
+        :param event: str, see backbone.poller
+        :param value: new tip Block or new difficulty
+        :return:
+        """
+        if event == DIFFICULTY_CHANGED:
+            self.difficulty = value
+            self.stop.set()
+        elif event == TIP_CHANGED:
+            self.stop.set()
+
+    def select_transactions(self):
+        """
+        keeps the previously selected transactions still in the mempool (i.e. not mined in the new tip)
+        and fills the block with the best remaining ones which do not conflict with them
+        :return: list of Transaction objects
+        """
+        mempool = self.poller.mempool
+        with self.poller.lock:
+            kept = [t for t in self.transactions if t.hash in mempool]
+            builder = BlockTemplateBuilder(mempool.transactions.values(), max_txs=self.max_txs)
+        return builder.build(preselected=kept)
+
+    def update_merkle_tree(self, transactions):
+        """
+        brings the Merkle tree of the template to transactions. The kept transactions come first in the same order,
+        so the leaves up to the first one which left the template stay, the next ones are popped and the new
+        transactions appended
+        :param transactions: list of Transaction objects, the new template
+        :return: str, Merkle root
+        """
+        tree = self.merkle_tree
+        same = 0
+        for tx_hash, t in zip(tree.data, transactions):
+            if tx_hash != t.hash:
+                break
+            same += 1
+        while len(tree.data) > same:
+            tree.pop()
+        for t in transactions[same:]:
+            tree.append(t.hash)
+        return tree.get_root_hash()
+
+    def get_tip(self):
+        """
+        :return: Block, parent chosen by the strategy among the blocks known by the poller
+        """
+        with self.poller.lock:
+            return self.strategy.select(self.poller.store.blockchain)
+
+    def mine_round(self):
+        """
+        one proof of work on the current tip
+        :return: Block, None if the round was aborted because its work became stale
+        """
+        self.stop.clear()
+        if self.closed:
+            # close() was called before the stop event was cleared
+            return None
+        # read after clearing the stop event: a change from now on aborts the round
+        self.tip_version = self.poller.tip_version
+        if self.poller.difficulty is not None:
+            self.difficulty = self.poller.difficulty
+        tip = self.get_tip()
+        self.transactions = self.select_transactions()
+        merkle_root = self.update_merkle_tree(self.transactions)
+        start = timer.perf_counter()
+        block, self.last_stats = mine_block(tip, self.transactions, self.difficulty, self.n_workers, self.backend,
+                                            self.stop, merkle_root)
+        elapsed = timer.perf_counter() - start
+        self.rounds += 1
+        self.total_seconds += elapsed
+        if block is None:
+            self.stale_rounds += 1
+            self.stale_seconds += elapsed
+            self.stale_hashes += sum(s["hashes"] for s in self.last_stats)
+        self.record_metrics(block, elapsed)
+        return block
+
+    def record_metrics(self, block, elapsed):
+        """
+        :param block: Block, None if the round was aborted
+        :param elapsed: float, seconds of the round
+        :return:
+        """
+        hashes = sum(s["hashes"] for s in self.last_stats)
+        for s in self.last_stats:
+            metrics.set_gauge(f"miner.worker.{s['worker']}.hashrate", s["hashrate"])
+        metrics.set_gauge("miner.hashrate", hashes / elapsed if elapsed > 0 else 0)
+        metrics.set_gauge("miner.stale_ratio", self.get_stale_ratio())
+        metrics.set_gauge("miner.difficulty", self.difficulty)
+        metrics.inc("miner.hashes", hashes)
+        metrics.inc("miner.rounds")
+        if block is None:
+            metrics.inc("miner.stale_rounds")
+            metrics.inc("miner.stale_hashes", hashes)
+        else:
+            metrics.observe("miner.time_to_solution", elapsed)
+
+    def run(self, n_blocks=1):
+        """
+        mines and proposes blocks, restarting on every tip change
+        :param n_blocks: int, number of blocks to propose, None to mine forever
+        :return: list of (Block, server message, status code)
+        """
+        proposed = []
+        while not self.closed and (n_blocks is None or len(proposed) < n_blocks):
+            block = self.mine_round()
+            if block is not None and not self.closed:
+                msg, _, code = flask_call('POST', BLOCK_PROPOSAL, data=block.to_dict())
+                proposed.append((block, msg, code))
+                if code == 200 and (n_blocks is None or len(proposed) < n_blocks):
+                    # until the poller sees our block, the next round would mine its sibling.
+                    # Returns at once if the tip already changed during the round or the proposal
+                    self.poller.wait_for_tip(self.tip_version, 2 * self.poller.interval)
+        return proposed
+
+    def close(self):
+        """
+        aborts the round in flight and ends run(), e.g. from another thread
+        :return:
+        """
+        self.closed = True
+        self.stop.set()
+
+    def get_stale_ratio(self):
+        """
+        :return: float, share of the mining time lost on stale tips
+        """
+        return self.stale_seconds / self.total_seconds if self.total_seconds else 0.0
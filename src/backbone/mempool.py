@@ -0,0 +1,192 @@
+# backbone/mempool.py
+
+import os
+import pickle
+
+from server import MEMPOOL_PATH, MEMPOOL_FILE, MEMPOOL_MINED_BLOCKS
+from backbone.verification import check_new_transactions
+
+
+class Mempool:
+    """
+    Local pool of the transactions fetched from the server, indexed by hash and by source address.
+    Transactions of the last MEMPOOL_MINED_BLOCKS blocks of the main chain are not added again.
+    The pool is pickled under vis/ so a restart does not download and verify everything again.
+    """
+    def __init__(self, path=MEMPOOL_PATH + MEMPOOL_FILE):
+        """
+        :param path: str, snapshot file
+        """
+        self.path = path
+        self.transactions = dict()  # hash -> Transaction
+        self.by_source = dict()  # source_address -> {hash: Transaction}, in insertion order
+        self.mined = set()  # hashes of the transactions in seen_blocks
+        self.forged = set()  # hashes of the transactions with a wrong signature still in the server pool
+        self.sender_keys = dict()  # source address -> PEM public key, see backbone.verification
+        self.seen_blocks = []  # (block hash, transaction hashes) of the last main chain blocks evicted, oldest first
+
+    def __setstate__(self, state):
+        """
+        snapshots taken before the reorgs were handled kept every block ever seen, a set of hashes, the ones taken
+        before the signatures were verified have no forged and sender_keys
+        """
+        self.__dict__.update(state)
+        self.__dict__.setdefault("forged", set())
+        self.__dict__.setdefault("sender_keys", dict())
+        if not isinstance(self.seen_blocks, list):
+            self.seen_blocks = []
+            self.mined = set()
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.transactions
+
+    def add_transaction(self, transaction):
+        """
+        add a transaction unless it is a duplicate, it is already in a block or its signature is wrong
+        :param transaction: Transaction object
+        :return: bool, True if added
+        """
+        if self.is_known(transaction.hash):
+            return False
+        self.transactions[transaction.hash] = transaction
+        self.by_source.setdefault(transaction.source_address, dict())[transaction.hash] = transaction
+        return True
+
+    def add_transactions(self, transactions):
+        """
+        :param transactions: list of Transaction objects
+        :return: int, number of transactions added
+        """
+        return sum(self.add_transaction(t) for t in transactions)
+
+    def add_checked_transactions(self, transactions, n_workers=None):
+        """
+        verifies the signatures of new transactions against sender_keys in a batch, then adds the correct ones.
+        The forged ones are remembered while the server keeps them, see retain
+        :param transactions: list of Transaction objects
+        :param n_workers: int, number of processes
+        :return: int, number of transactions added
+        """
+        transactions = list(transactions)
+        self.forged.update(check_new_transactions(transactions, self.sender_keys, n_workers))
+        return self.add_transactions(transactions)
+
+    def get_unknown_senders(self, transactions):
+        """
+        :param transactions: list of Transaction objects
+        :return: set of the source addresses without a key in sender_keys
+        """
+        return {t.source_address for t in transactions} - self.sender_keys.keys()
+
+    def is_known(self, tx_hash):
+        """
+        :param tx_hash: str, transaction hash
+        :return: bool, True if the transaction is in the pool, in a recent block of the main chain or forged, no need
+        to deserialize it again
+        """
+        return tx_hash in self.transactions or tx_hash in self.mined or tx_hash in self.forged
+
+    def remove_transaction(self, tx_hash):
+        """
+        :param tx_hash: str, transaction hash
+        :return: Transaction object, None if not in the pool
+        """
+        transaction = self.transactions.pop(tx_hash, None)
+        if transaction is not None:
+            same_source = self.by_source[transaction.source_address]
+            del same_source[tx_hash]
+            if not same_source:
+                del self.by_source[transaction.source_address]
+        return transaction
+
+    def get_transaction(self, tx_hash):
+        """
+        :param tx_hash: str, transaction hash
+        :return: Transaction object or None
+        """
+        return self.transactions.get(tx_hash)
+
+    def get_by_source(self, source_address):
+        """
+        :param source_address: str, address of the sender
+        :return: list of Transaction objects sent by source_address
+        """
+        return list(self.by_source.get(source_address, dict()).values())
+
+    def retain(self, tx_hashes):
+        """
+        removes the transactions which are not in tx_hashes, e.g. the ones the server mined or dropped
+        :param tx_hashes: set of transaction hashes, e.g. the ones of the last REQUEST_TXS response
+        :return: int, number of transactions removed
+        """
+        stale = [h for h in self.transactions if h not in tx_hashes]
+        for h in stale:
+            self.remove_transaction(h)
+        self.forged.intersection_update(tx_hashes)
+        return len(stale)
+
+    def evict_mined(self, blockchain, max_blocks=MEMPOOL_MINED_BLOCKS):
+        """
+        removes the transactions included in the main chain, e.g. after a GET_BLOCKCHAIN. The branch is walked back
+        from the tip to the last block processed by a previous call. The transactions of the processed blocks which
+        left the main chain on a reorg can be added again: the server returns them to its pool
+        :param blockchain: Blockchain object, None if there is no chain yet
+        :param max_blocks: int, number of blocks of the main chain remembered
+        :return: int, number of transactions evicted
+        """
+        tip = blockchain.get_tip() if blockchain is not None else None
+        if tip is None:
+            return 0
+        positions = {h: i for i, (h, _) in enumerate(self.seen_blocks)}
+        fork = -1
+        new_blocks = []
+        for b in blockchain.iter_ancestors(tip.hash):
+            if b.hash in positions:
+                fork = positions[b.hash]
+                break
+            if len(new_blocks) == max_blocks:
+                break
+            new_blocks.append(b)
+        # blocks processed before, no longer on the main chain
+        for _, tx_hashes in self.seen_blocks[fork + 1:]:
+            self.mined.difference_update(tx_hashes)
+        del self.seen_blocks[fork + 1:]
+        evicted = 0
+        for b in reversed(new_blocks):
+            tx_hashes = [t.hash for t in b.transactions]
+            self.mined.update(tx_hashes)
+            self.seen_blocks.append((b.hash, tx_hashes))
+            for h in tx_hashes:
+                if self.remove_transaction(h) is not None:
+                    evicted += 1
+        for _, tx_hashes in self.seen_blocks[:-max_blocks]:
+            self.mined.difference_update(tx_hashes)
+        del self.seen_blocks[:-max_blocks]
+        return evicted
+
+    def save(self):
+        """
+        snapshot the pool to disk
+        :return:
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(tmp, self.path)
+
+    @classmethod
+    def load(cls, path=MEMPOOL_PATH + MEMPOOL_FILE):
+        """
+        :param path: str, snapshot file
+        :return: Mempool, empty if there is no snapshot yet
+        """
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, 'rb') as f:
+            mempool = pickle.load(f)
+        mempool.path = path
+        return mempool
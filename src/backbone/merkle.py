@@ -1,13 +1,219 @@
-# TODO: Make Merkle tree structure
+# backbone/merkle.py
+
+from collections import Counter
+
+from utils.cryptographic import hash_function
+
+# root of a block without transactions
+EMPTY_ROOT = hash_function('')
+
 
 class MerkleTree:
+    """
+    Merkle tree stored as a flat list of hashes per level:
+    levels[0] are the leaves h(tx), levels[-1] is [root].
+    A parent is h(left + right), or h(left) when left is the last node of an odd level.
+    append, pop and replace only rehash the path from the changed leaf to the root, O(log n).
+    """
     def __init__(self, txs):
-        self.data = None
-        self.leaf_nodes = None
+        """
+        :param txs: list of transaction hashes
+        """
+        self.data = list(txs)
+        self.index = dict()  # transaction hash -> leaf position
+        for i, t in enumerate(self.data):
+            self.index.setdefault(t, i)
+        self.counts = Counter(self.data)  # a transaction hash can appear more than once
+        self.levels = [[]]
+        self.root_node = None  # dict representation, built lazily by get_root
         self.build_tree()
 
+    @staticmethod
+    def parent_hash(left, right=None):
+        """
+        :param left: str, hash of the left child
+        :param right: str, hash of the right child, None if left has no sibling
+        :return: str, hash of the parent node
+        """
+        if right is None:
+            return hash_function(left)
+        return hash_function(left + right)
+
     def build_tree(self):
-        return None
+        """
+        hashes the leaves and every level up to the root
+        :return: list of levels
+        """
+        level = [hash_function(t) for t in self.data]
+        self.levels = [level]
+        while len(level) > 1:
+            level = [self.parent_hash(*level[i:i + 2]) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+        self.root_node = None
+        return self.levels
+
+    def update_path(self, i):
+        """
+        recomputes the hashes from leaf i up to the root, resizing every level to fit the current leaves
+        :param i: int, position of the changed leaf
+        :return:
+        """
+        i = min(i, len(self.levels[0]) - 1)
+        level_idx = 0
+        while len(self.levels[level_idx]) > 1:
+            child = self.levels[level_idx]
+            if level_idx + 1 == len(self.levels):
+                self.levels.append([])
+            parent = self.levels[level_idx + 1]
+            del parent[(len(child) + 1) // 2:]
+            i //= 2
+            h = self.parent_hash(*child[2 * i:2 * i + 2])
+            if i < len(parent):
+                parent[i] = h
+            else:
+                parent.append(h)
+            level_idx += 1
+        del self.levels[level_idx + 1:]
+        self.root_node = None
+
+    def forget(self, tx_hash, i):
+        """
+        updates the index after tx_hash has been removed from leaf i
+        :param tx_hash: str
+        :param i: int
+        :return:
+        """
+        self.counts[tx_hash] -= 1
+        if self.counts[tx_hash] == 0:
+            del self.counts[tx_hash]
+            del self.index[tx_hash]
+        elif self.index[tx_hash] == i:
+            # duplicated transaction, point to its other occurrence
+            self.index[tx_hash] = self.data.index(tx_hash)
+
+    def append(self, tx_hash):
+        """
+        adds a transaction as the rightmost leaf
+        :param tx_hash: str, transaction hash
+        :return: str, new Merkle root
+        """
+        self.data.append(tx_hash)
+        self.index.setdefault(tx_hash, len(self.data) - 1)
+        self.counts[tx_hash] += 1
+        self.levels[0].append(hash_function(tx_hash))
+        self.update_path(len(self.data) - 1)
+        return self.get_root_hash()
+
+    def pop(self):
+        """
+        removes the rightmost leaf
+        :return: str, hash of the removed transaction
+        """
+        tx_hash = self.data.pop()
+        self.levels[0].pop()
+        self.forget(tx_hash, len(self.data))
+        self.update_path(len(self.data) - 1)
+        return tx_hash
+
+    def replace(self, i, tx_hash):
+        """
+        replaces the transaction in leaf i
+        :param i: int, leaf position
+        :param tx_hash: str, hash of the new transaction
+        :return: str, new Merkle root
+        """
+        old = self.data[i]
+        self.data[i] = tx_hash
+        self.forget(old, i)
+        self.index[tx_hash] = min(self.index.get(tx_hash, i), i)
+        self.counts[tx_hash] += 1
+        self.levels[0][i] = hash_function(tx_hash)
+        self.update_path(i)
+        return self.get_root_hash()
+
+    def remove(self, tx_hash):
+        """
+        removes a transaction, the last leaf takes its place so only two paths are rehashed
+        :param tx_hash: str, transaction hash
+        :return: int, position the transaction had, None if not in the tree
+        """
+        i = self.index.get(tx_hash)
+        if i is None:
+            return None
+        last = self.pop()
+        if i < len(self.data):
+            self.replace(i, last)
+        return i
+
+    def get_root_hash(self):
+        """
+        :return: str, Merkle root
+        """
+        if not self.data:
+            return EMPTY_ROOT
+        return self.levels[-1][0]
 
     def get_root(self):
-        return None
+        """
+        root as nested dict nodes, the shape expected by utils.view.visualize_tree:
+        leaves are {'hash', 'data'}, inner nodes {'hash', 'left'} plus 'right' if any.
+        Nodes are built from the levels on first call only.
+        :return: dict
+        """
+        if self.root_node is None:
+            if not self.data:
+                self.root_node = {'hash': EMPTY_ROOT, 'data': ''}
+                return self.root_node
+            nodes = [{'hash': h, 'data': t} for h, t in zip(self.levels[0], self.data)]
+            for level in self.levels[1:]:
+                parents = []
+                for i, h in enumerate(level):
+                    node = {'hash': h, 'left': nodes[2 * i]}
+                    if 2 * i + 1 < len(nodes):
+                        node['right'] = nodes[2 * i + 1]
+                    parents.append(node)
+                nodes = parents
+            self.root_node = nodes[0]
+        return self.root_node
+
+    def get_proof(self, tx_hash):
+        """
+        inclusion proof of a transaction: one sibling per level, from the leaf up to the root
+        :param tx_hash: str, transaction hash
+        :return: list of [side, sibling hash], side is 'left' or 'right' ([None, None] if no sibling).
+        None if the transaction is not in the tree
+        """
+        i = self.index.get(tx_hash)
+        if i is None:
+            return None
+        proof = []
+        for level in self.levels[:-1]:
+            if i % 2 == 1:
+                proof.append(['left', level[i - 1]])
+            elif i + 1 < len(level):
+                proof.append(['right', level[i + 1]])
+            else:
+                proof.append([None, None])
+            i //= 2
+        return proof
+
+    @staticmethod
+    def verify_proof(tx_hash, proof, root):
+        """
+        checks that a transaction is in a block without the other transactions of the block
+        :param tx_hash: str, transaction hash
+        :param proof: list returned by get_proof
+        :param root: str, Merkle root of the block
+        :return: bool
+        """
+        if proof is None:
+            return False
+        h = hash_function(tx_hash)
+        for side, sibling in proof:
+            if side == 'left':
+                h = MerkleTree.parent_hash(sibling, h)
+            elif side == 'right':
+                h = MerkleTree.parent_hash(h, sibling)
+            else:
+                h = MerkleTree.parent_hash(h)
+        return h == root
@@ -0,0 +1,206 @@
+/*
+ * backbone/native/pow.c
+ *
+ * Native nonce search used by the "native" mining backend in backbone/consensus.py.
+ * It computes exactly utils.cryptographic.double_hash(header + str(nonce)), i.e. SHA-256 of the
+ * hexadecimal digest of SHA-256(header + nonce), with the header absorbed only once per batch.
+ *
+ * Build from src/ with:
+ *     cc -O3 -shared -fPIC -o backbone/native/libpow.so backbone/native/pow.c
+ */
+#include <stdint.h>
+#include <stddef.h>
+#include <string.h>
+
+typedef struct {
+    uint32_t state[8];
+    uint8_t buffer[64];
+    uint64_t length;
+    size_t buffer_length;
+} sha256_ctx;
+
+static const uint32_t K[64] = {
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+};
+
+static const char HEX[] = "0123456789abcdef";
+
+#define ROTR(x, n) (((x) >> (n)) | ((x) << (32 - (n))))
+
+static void sha256_transform(uint32_t state[8], const uint8_t block[64])
+{
+    uint32_t w[64];
+    uint32_t a, b, c, d, e, f, g, h, t1, t2;
+    int i;
+
+    for (i = 0; i < 16; i++) {
+        w[i] = ((uint32_t)block[4 * i] << 24) | ((uint32_t)block[4 * i + 1] << 16) |
+               ((uint32_t)block[4 * i + 2] << 8) | (uint32_t)block[4 * i + 3];
+    }
+    for (i = 16; i < 64; i++) {
+        uint32_t s0 = ROTR(w[i - 15], 7) ^ ROTR(w[i - 15], 18) ^ (w[i - 15] >> 3);
+        uint32_t s1 = ROTR(w[i - 2], 17) ^ ROTR(w[i - 2], 19) ^ (w[i - 2] >> 10);
+        w[i] = w[i - 16] + s0 + w[i - 7] + s1;
+    }
+    a = state[0]; b = state[1]; c = state[2]; d = state[3];
+    e = state[4]; f = state[5]; g = state[6]; h = state[7];
+    for (i = 0; i < 64; i++) {
+        t1 = h + (ROTR(e, 6) ^ ROTR(e, 11) ^ ROTR(e, 25)) + ((e & f) ^ (~e & g)) + K[i] + w[i];
+        t2 = (ROTR(a, 2) ^ ROTR(a, 13) ^ ROTR(a, 22)) + ((a & b) ^ (a & c) ^ (b & c));
+        h = g; g = f; f = e; e = d + t1;
+        d = c; c = b; b = a; a = t1 + t2;
+    }
+    state[0] += a; state[1] += b; state[2] += c; state[3] += d;
+    state[4] += e; state[5] += f; state[6] += g; state[7] += h;
+}
+
+static void sha256_init(sha256_ctx *ctx)
+{
+    ctx->state[0] = 0x6a09e667; ctx->state[1] = 0xbb67ae85;
+    ctx->state[2] = 0x3c6ef372; ctx->state[3] = 0xa54ff53a;
+    ctx->state[4] = 0x510e527f; ctx->state[5] = 0x9b05688c;
+    ctx->state[6] = 0x1f83d9ab; ctx->state[7] = 0x5be0cd19;
+    ctx->length = 0;
+    ctx->buffer_length = 0;
+}
+
+static void sha256_update(sha256_ctx *ctx, const uint8_t *data, size_t length)
+{
+    ctx->length += length;
+    while (length > 0) {
+        size_t n = 64 - ctx->buffer_length;
+        if (n > length) {
+            n = length;
+        }
+        memcpy(ctx->buffer + ctx->buffer_length, data, n);
+        ctx->buffer_length += n;
+        data += n;
+        length -= n;
+        if (ctx->buffer_length == 64) {
+            sha256_transform(ctx->state, ctx->buffer);
+            ctx->buffer_length = 0;
+        }
+    }
+}
+
+static void sha256_final(sha256_ctx *ctx, uint8_t digest[32])
+{
+    uint64_t bits = ctx->length * 8;
+    int i;
+
+    ctx->buffer[ctx->buffer_length++] = 0x80;
+    if (ctx->buffer_length > 56) {
+        memset(ctx->buffer + ctx->buffer_length, 0, 64 - ctx->buffer_length);
+        sha256_transform(ctx->state, ctx->buffer);
+        ctx->buffer_length = 0;
+    }
+    memset(ctx->buffer + ctx->buffer_length, 0, 56 - ctx->buffer_length);
+    for (i = 0; i < 8; i++) {
+        ctx->buffer[63 - i] = (uint8_t)(bits >> (8 * i));
+    }
+    sha256_transform(ctx->state, ctx->buffer);
+    for (i = 0; i < 8; i++) {
+        digest[4 * i] = (uint8_t)(ctx->state[i] >> 24);
+        digest[4 * i + 1] = (uint8_t)(ctx->state[i] >> 16);
+        digest[4 * i + 2] = (uint8_t)(ctx->state[i] >> 8);
+        digest[4 * i + 3] = (uint8_t)ctx->state[i];
+    }
+}
+
+static void to_hex(const uint8_t digest[32], char out[64])
+{
+    int i;
+    for (i = 0; i < 32; i++) {
+        out[2 * i] = HEX[digest[i] >> 4];
+        out[2 * i + 1] = HEX[digest[i] & 0x0f];
+    }
+}
+
+/* number of characters written in out, same as Python str(nonce) */
+static size_t nonce_to_str(uint64_t nonce, char out[20])
+{
+    char tmp[20];
+    size_t n = 0, i;
+    do {
+        tmp[n++] = (char)('0' + nonce % 10);
+        nonce /= 10;
+    } while (nonce);
+    for (i = 0; i < n; i++) {
+        out[i] = tmp[n - 1 - i];
+    }
+    return n;
+}
+
+/* 1 if the hexadecimal representation of digest starts with difficulty zeros */
+static int meets_difficulty(const uint8_t digest[32], int difficulty)
+{
+    int i;
+    for (i = 0; i < difficulty && i < 64; i++) {
+        uint8_t nibble = (i % 2 == 0) ? digest[i / 2] >> 4 : digest[i / 2] & 0x0f;
+        if (nibble) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static void double_hash_from(const sha256_ctx *midstate, uint64_t nonce, uint8_t digest[32])
+{
+    sha256_ctx ctx = *midstate;
+    char nonce_str[20];
+    char hex[64];
+    uint8_t first[32];
+    size_t n = nonce_to_str(nonce, nonce_str);
+
+    sha256_update(&ctx, (const uint8_t *)nonce_str, n);
+    sha256_final(&ctx, first);
+    to_hex(first, hex);
+    sha256_init(&ctx);
+    sha256_update(&ctx, (const uint8_t *)hex, 64);
+    sha256_final(&ctx, digest);
+}
+
+/*
+ * double hashes header + nonce, writes the 64 hexadecimal characters (not null terminated) in hash_out
+ */
+void pow_hash(const char *header, size_t header_length, uint64_t nonce, char *hash_out)
+{
+    sha256_ctx midstate;
+    uint8_t digest[32];
+
+    sha256_init(&midstate);
+    sha256_update(&midstate, (const uint8_t *)header, header_length);
+    double_hash_from(&midstate, nonce, digest);
+    to_hex(digest, hash_out);
+}
+
+/*
+ * tests the nonces start, start + step, ..., start + (count - 1) * step.
+ * returns the number of nonces tested if a valid one is found (nonce_out and hash_out are set), 0 otherwise
+ */
+uint64_t pow_search(const char *header, size_t header_length, uint64_t start, uint64_t step, uint64_t count,
+                    int difficulty, uint64_t *nonce_out, char *hash_out)
+{
+    sha256_ctx midstate;
+    uint8_t digest[32];
+    uint64_t i, nonce = start;
+
+    sha256_init(&midstate);
+    sha256_update(&midstate, (const uint8_t *)header, header_length);
+    for (i = 0; i < count; i++, nonce += step) {
+        double_hash_from(&midstate, nonce, digest);
+        if (meets_difficulty(digest, difficulty)) {
+            *nonce_out = nonce;
+            to_hex(digest, hash_out);
+            return i + 1;
+        }
+    }
+    return 0;
+}
@@ -0,0 +1,221 @@
+# backbone/poller.py
+
+import asyncio
+import threading
+
+import requests
+
+from server import GET_BLOCKCHAIN, REQUEST_TXS, REQUEST_DIFFICULTY, GET_USERS, POLL_INTERVAL
+from abstractions.transaction import Transaction
+from backbone.verification import get_sender_keys
+from utils.flask_utils import flask_call, async_flask_call
+from utils.view import Colors
+from utils import metrics
+
+# events sent to the subscribers
+TIP_CHANGED = 'tip_changed'  # value: Block, new tip of the main chain
+DIFFICULTY_CHANGED = 'difficulty_changed'  # value: int
+NEW_TRANSACTIONS = 'new_transactions'  # value: int, number of transactions added to the mempool
+
+
+def parse_difficulty(msg, data, code):
+    """
+    reads the difficulty from a REQUEST_DIFFICULTY response. The message is never parsed, an error page
+    (e.g. 429 Too Many Requests) would be read as a difficulty
+    :param msg: response message
+    :param data: response data
+    :param code: HTTP status code
+    :return: int
+    :raise requests.HTTPError: if the request failed or the data holds no difficulty
+    """
+    if code == 200:
+        if isinstance(data, int):
+            return data
+        if isinstance(data, dict) and isinstance(data.get('difficulty'), int):
+            return data['difficulty']
+    raise requests.HTTPError(f"{REQUEST_DIFFICULTY} answered {code}: {str(msg)[:80]}")
+
+
+class ChainPoller:
+    """
+    Polls GET_BLOCKCHAIN, REQUEST_TXS and REQUEST_DIFFICULTY concurrently on an asyncio event loop running in its
+    own thread, and notifies the subscribers when the tip or the difficulty changes or new transactions arrive.
+    The miner keeps hashing in its worker processes meanwhile.
+    """
+    def __init__(self, store, mempool=None, interval=POLL_INTERVAL, log_errors=True):
+        """
+        :param store: backbone.chainstore.ChainStore, updated with the new blocks
+        :param mempool: backbone.mempool.Mempool, updated with the new transactions. None to not poll REQUEST_TXS
+        :param interval: float, seconds between two polls
+        :param log_errors: bool, print when the polls start and stop failing. They are counted in the metrics anyway
+        """
+        self.store = store
+        self.mempool = mempool
+        self.interval = interval
+        self.tip = store.get_tip()
+        self.tip_version = 0  # incremented at every tip change, see wait_for_tip
+        self.tip_changed = threading.Condition()
+        self.difficulty = None  # set by start() before the first poll
+        self.subscribers = []
+        self.lock = threading.Lock()  # held while the store and the mempool are updated
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.log_errors = log_errors
+        self.failed_polls = 0  # consecutive polls with at least one failed request
+        self.unknown_users = set()  # source addresses missing from the last GET_USERS, not asked for again
+        self.last_error = None
+
+    def subscribe(self, callback):
+        """
+        :param callback: function(event, value), called from the poller thread
+        :return:
+        """
+        self.subscribers.append(callback)
+
+    def notify(self, event, value):
+        for callback in self.subscribers:
+            callback(event, value)
+
+    async def poll_chain(self):
+        """
+        fetches the new blocks and notifies TIP_CHANGED if the main chain tip changed
+        :return:
+        """
+        _, data, _ = await async_flask_call('GET', GET_BLOCKCHAIN, params=self.store.get_sync_params())
+        if not data:
+            return
+        with self.lock:
+            new = self.store.apply(data['chain'])
+        if new is None:
+            # the delta does not attach to the local chain, fall back to the full dump
+            _, data, _ = await async_flask_call('GET', GET_BLOCKCHAIN)
+            if not data:
+                return
+            with self.lock:
+                self.store.replace(data['chain'])
+        tip = self.store.get_tip()
+        if tip is not None and tip != self.tip:
+            self.tip = tip
+            if self.mempool is not None:
+                with self.lock:
+                    self.mempool.evict_mined(self.store.blockchain)
+            with self.tip_changed:
+                self.tip_version += 1
+                self.tip_changed.notify_all()
+            self.notify(TIP_CHANGED, self.store.blockchain.chain[tip])
+
+    async def poll_transactions(self):
+        """
+        fetches the transaction pool and notifies NEW_TRANSACTIONS if the mempool grew. The signatures of the new
+        transactions are verified, the keys of their senders are fetched if they are not known yet
+        :return:
+        """
+        if self.mempool is None:
+            return
+        _, txs, code = await async_flask_call('GET', REQUEST_TXS)
+        if code != 200 or not isinstance(txs, list):
+            return
+        new_txs = [Transaction.from_dict(t) for t in txs if not self.mempool.is_known(t['hash'])]
+        unknown = self.mempool.get_unknown_senders(new_txs) - self.unknown_users
+        if unknown:
+            _, users, code = await async_flask_call('GET', GET_USERS)
+            if code == 200 and isinstance(users, list):
+                keys = get_sender_keys(users)
+                self.unknown_users.update(unknown - keys.keys())
+                with self.lock:
+                    self.mempool.sender_keys.update(keys)
+        with self.lock:
+            # transactions the server mined or dropped would get our blocks rejected
+            self.mempool.retain({t['hash'] for t in txs})
+            added = self.mempool.add_checked_transactions(new_txs)
+        if added:
+            self.notify(NEW_TRANSACTIONS, added)
+
+    async def poll_difficulty(self):
+        """
+        fetches the difficulty and notifies DIFFICULTY_CHANGED if it changed from a known value.
+        On a failed request the difficulty is kept, the error is counted by record_errors
+        :return:
+        """
+        difficulty = parse_difficulty(*await async_flask_call('GET', REQUEST_DIFFICULTY))
+        if difficulty != self.difficulty:
+            previous, self.difficulty = self.difficulty, difficulty
+            if previous is not None:
+                self.notify(DIFFICULTY_CHANGED, difficulty)
+
+    def wait_for_tip(self, version, timeout):
+        """
+        :param version: int, tip_version seen by the caller
+        :param timeout: float, seconds
+        :return: bool, True if the tip changed since version, False on timeout
+        """
+        with self.tip_changed:
+            return self.tip_changed.wait_for(lambda: self.tip_version != version, timeout)
+
+    async def poll_once(self):
+        """
+        the three requests are in flight at the same time; a failing one does not stop the others
+        :return: list of the exceptions raised, if any
+        """
+        results = await asyncio.gather(self.poll_chain(), self.poll_transactions(), self.poll_difficulty(),
+                                       return_exceptions=True)
+        return [r for r in results if isinstance(r, Exception)]
+
+    def record_errors(self, errors):
+        """
+        counts the failed requests of a poll, so an unreachable server is told apart from an idle chain
+        :param errors: list of exceptions returned by poll_once
+        :return:
+        """
+        for e in errors:
+            metrics.inc("poller.errors")
+            metrics.inc(f"poller.errors.{type(e).__name__}")
+        if errors:
+            self.failed_polls += 1
+            self.last_error = errors[0]
+            if self.failed_polls == 1 and self.log_errors:
+                print(Colors.WARNING + f"polling the server failed: {errors[0]!r}" + Colors.ENDC)
+            return
+        if self.failed_polls and self.log_errors:
+            print(Colors.OKGREEN + f"polling the server works again after {self.failed_polls} failed polls"
+                  + Colors.ENDC)
+        self.failed_polls = 0
+
+    async def run(self):
+        """
+        polls every interval seconds until stop() is called
+        :return:
+        """
+        while not self.stop_event.is_set():
+            self.record_errors(await self.poll_once())
+            await asyncio.get_running_loop().run_in_executor(None, self.stop_event.wait, self.interval)
+
+    def start(self):
+        """
+        fetches the difficulty, so the first round is mined at the server one, then runs the event loop in a
+        daemon thread
+        :return: threading.Thread
+        """
+        try:
+            self.difficulty = parse_difficulty(*flask_call('GET', REQUEST_DIFFICULTY))
+        except requests.RequestException as e:
+            # the first poll will set it
+            self.record_errors([e])
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """
+        stops the event loop and saves the store and the mempool
+        :return:
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            self.store.save()
+            if self.mempool is not None:
+                self.mempool.save()
@@ -0,0 +1,162 @@
+# backbone/strategy.py
+
+import copy
+from datetime import datetime
+
+from server import N_BLOCKS_PER_BRANCH
+from abstractions.block import Blockchain, get_header_digest
+
+
+def get_candidate_tips(blockchain, depth=N_BLOCKS_PER_BRANCH):
+    """
+    blocks without successors in the last depth heights, i.e. the parents worth mining on.
+    Only the height index is read, not the whole chain
+    :param blockchain: Blockchain object
+    :param depth: int, number of heights below the highest block considered
+    :return: list of Block objects
+    """
+    candidates = []
+    for height in range(max(blockchain.height - depth, 0), blockchain.height + 1):
+        candidates.extend(b for b in blockchain.get_blocks_at_height(height) if not b.next)
+    return candidates
+
+
+class ParentStrategy:
+    """
+    Rule choosing the block to mine on. A block mined on a parent which ends up out of the main chain is orphaned
+    and all its proof of work is lost.
+    """
+    name = None
+
+    def select(self, blockchain, now=None):
+        """
+        :param blockchain: Blockchain object
+        :param now: float, current timestamp, to compare with Block.time
+        :return: Block, None if the blockchain is empty
+        """
+        raise NotImplementedError
+
+
+class LongestChain(ParentStrategy):
+    """
+    mines on the tip of the fork-choice index: the longest branch, the first seen on a tie
+    """
+    name = 'longest'
+
+    def select(self, blockchain, now=None):
+        return blockchain.get_tip()
+
+
+class MostRecentTip(ParentStrategy):
+    """
+    mines on the most recently solved candidate tip
+    """
+    name = 'recent'
+
+    def select(self, blockchain, now=None):
+        candidates = get_candidate_tips(blockchain)
+        if not candidates:
+            return blockchain.get_tip()
+        return max(candidates, key=lambda b: b.time)
+
+
+class WeightedScore(ParentStrategy):
+    """
+    scores every candidate tip by the length of its branch, minus the age of the tip, plus the number of distinct
+    miners of the last blocks of its branch: a branch extended by many miners has more hash power behind it
+    """
+    name = 'weighted'
+
+    def __init__(self, length_weight=1.0, age_weight=0.01, miner_weight=0.5, window=N_BLOCKS_PER_BRANCH):
+        """
+        :param length_weight: float, score of one block of branch length
+        :param age_weight: float, penalty of one second of tip age
+        :param miner_weight: float, score of one distinct miner in the window
+        :param window: int, number of blocks of the branch read to count the miners
+        """
+        self.length_weight = length_weight
+        self.age_weight = age_weight
+        self.miner_weight = miner_weight
+        self.window = window
+
+    def score(self, blockchain, block, now):
+        """
+        :param blockchain: Blockchain object
+        :param block: candidate tip
+        :param now: float, current timestamp
+        :return: float
+        """
+        miners = set()
+        for i, b in enumerate(blockchain.iter_ancestors(block.hash)):
+            if i == self.window:
+                break
+            miners.add(b.mined_by)
+        return (self.length_weight * blockchain.lengths[block.hash]
+                - self.age_weight * max(now - block.time, 0)
+                + self.miner_weight * len(miners))
+
+    def select(self, blockchain, now=None):
+        candidates = get_candidate_tips(blockchain, self.window)
+        if not candidates:
+            return blockchain.get_tip()
+        if now is None:
+            now = datetime.now().timestamp()
+        return max(candidates, key=lambda b: self.score(blockchain, b, now))
+
+
+STRATEGIES = {s.name: s for s in (LongestChain, MostRecentTip, WeightedScore)}
+
+
+def get_strategy(name=None):
+    """
+    :param name: str, key of STRATEGIES, None for the longest chain
+    :return: ParentStrategy instance
+    """
+    if name is None:
+        return LongestChain()
+    if name not in STRATEGIES:
+        raise ValueError(f"unknown parent strategy {name}, use one of {', '.join(STRATEGIES)}")
+    return STRATEGIES[name]()
+
+
+def simulate(blockchain, strategies=None):
+    """
+    replays a recorded chain block by block, in the order the blocks were solved. Before every block arrives each
+    strategy picks a parent; the pick is orphaned if the parent is not on the main chain recorded at the end.
+    The recorded blocks are not modified
+    :param blockchain: Blockchain object, e.g. ChainStore.load().blockchain
+    :param strategies: list of ParentStrategy instances, None for one of each
+    :return: dict, strategy name -> {"decisions", "orphaned", "orphan_rate"}
+    """
+    if strategies is None:
+        strategies = [s() for s in STRATEGIES.values()]
+    main_chain = {h for h, b in blockchain.chain.items() if b.main_chain}
+    blocks = sorted(blockchain.chain.values(), key=lambda b: (b.time, b.height))
+    replay = Blockchain([])
+    # the recorded blocks are validated already
+    replay.validated.update((h, get_header_digest(b)) for h, b in blockchain.chain.items())
+    pending = dict()  # hash of a missing parent -> blocks waiting for it
+    results = {s.name: {"decisions": 0, "orphaned": 0, "orphan_rate": 0.0} for s in strategies}
+    for b in blocks:
+        if replay.chain:
+            for s in strategies:
+                parent = s.select(replay, now=b.time)
+                r = results[s.name]
+                r["decisions"] += 1
+                if parent is None or parent.hash not in main_chain:
+                    r["orphaned"] += 1
+        # a block solved before its parent by a skewed clock waits for it
+        arrived = [b]
+        while arrived:
+            b = copy.copy(arrived.pop())
+            b.next = []
+            b.main_chain = True
+            b.confirmed = False
+            if replay.add_block(b):
+                arrived.extend(pending.pop(b.hash, []))
+            else:
+                pending.setdefault(b.prev, []).append(b)
+    for r in results.values():
+        if r["decisions"]:
+            r["orphan_rate"] = r["orphaned"] / r["decisions"]
+    return results
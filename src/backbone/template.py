@@ -0,0 +1,138 @@
+# backbone/template.py
+
+import heapq
+import json
+
+from server import MAX_TXS_PER_BLOCK
+
+
+class BlockTemplateBuilder:
+    """
+    Transaction pool indexed to build the most profitable block template.
+    A transaction is ready when its prev_hash is not in the pool (it is on the chain already);
+    ready transactions are kept in a max-heap by fee, the others wait for their predecessor.
+    Adding or removing a transaction is O(log n), building a template O(k log n) for k selected transactions.
+    """
+    def __init__(self, transactions=None, max_txs=MAX_TXS_PER_BLOCK, max_size=None):
+        """
+        :param transactions: list of Transaction objects in the pool
+        :param max_txs: int, maximum number of transactions in a block
+        :param max_size: int, maximum size in bytes of the serialized transactions in a block. If set, transactions
+        are ranked by fee density (fee per byte) instead of fee
+        """
+        self.max_txs = max_txs
+        self.max_size = max_size
+        self.pool = dict()  # hash -> Transaction
+        self.sizes = dict()  # hash -> serialized size, only if max_size is set
+        self.children = dict()  # prev_hash -> list of hashes of the transactions spending it
+        self.ready = []  # heap of (-priority, hash) of transactions whose predecessor is not in the pool
+        for t in transactions or []:
+            self.add_transaction(t)
+
+    def priority(self, transaction):
+        """
+        :param transaction: Transaction object
+        :return: fee, or fee per byte if max_size is set
+        """
+        if self.max_size is None:
+            return transaction.fee
+        return transaction.fee / self.sizes[transaction.hash]
+
+    def add_transaction(self, transaction):
+        """
+        add a transaction to the pool
+        :param transaction: Transaction object
+        :return: bool, False if the transaction was already in the pool
+        """
+        if transaction.hash in self.pool:
+            return False
+        self.pool[transaction.hash] = transaction
+        if self.max_size is not None:
+            self.sizes[transaction.hash] = len(json.dumps(transaction.to_dict()))
+        self.children.setdefault(transaction.prev_hash, []).append(transaction.hash)
+        if transaction.prev_hash not in self.pool:
+            # successors already in the heap are no longer ready, their entries are skipped lazily
+            heapq.heappush(self.ready, (-self.priority(transaction), transaction.hash))
+        return True
+
+    def remove_transaction(self, tx_hash):
+        """
+        remove a transaction from the pool, e.g. once it is in a block. Its successors become ready
+        :param tx_hash: str, transaction hash
+        :return: Transaction object, None if not in the pool
+        """
+        transaction = self.pool.pop(tx_hash, None)
+        if transaction is None:
+            return None
+        self.sizes.pop(tx_hash, None)
+        siblings = self.children[transaction.prev_hash]
+        siblings.remove(tx_hash)
+        if not siblings:
+            del self.children[transaction.prev_hash]
+        # the entry of the removed transaction stays in the heap and is skipped lazily
+        for h in self.children.get(tx_hash, []):
+            heapq.heappush(self.ready, (-self.priority(self.pool[h]), h))
+        if len(self.ready) > 2 * len(self.pool) + 64:
+            self.compact()
+        return transaction
+
+    def is_ready(self, tx_hash):
+        """
+        :param tx_hash: str, transaction hash
+        :return: bool, True if the transaction is in the pool and its predecessor is not
+        """
+        return tx_hash in self.pool and self.pool[tx_hash].prev_hash not in self.pool
+
+    def compact(self):
+        """
+        drops stale entries from the ready heap
+        :return:
+        """
+        self.ready = list({h: (p, h) for p, h in self.ready if self.is_ready(h)}.values())
+        heapq.heapify(self.ready)
+
+    def build(self, preselected=()):
+        """
+        greedily selects the highest-fee ready transactions; once a transaction is selected, the transactions
+        spending it become candidates. Predecessors always come before their successors.
+        Transactions of a sender spending the same prev_hash conflict: only the first selected, i.e. the
+        highest-fee one, is kept, the others and their successors are dropped.
+        :param preselected: list of Transaction objects of the pool placed first in the block, e.g. the ones kept
+        from the previous template. They count against max_txs and max_size and win over conflicting spends
+        :return: list of Transaction objects
+        """
+        candidates = [r for r in self.ready if self.is_ready(r[1])]
+        heapq.heapify(candidates)
+        selected = []
+        seen = set()
+        spent = set()  # (source_address, prev_hash) of the selected transactions
+        size = 0
+        for transaction in preselected[:self.max_txs]:
+            seen.add(transaction.hash)
+            spent.add((transaction.source_address, transaction.prev_hash))
+            if self.max_size is not None:
+                size += self.sizes[transaction.hash]
+            selected.append(transaction)
+        for transaction in selected:
+            for child in self.children.get(transaction.hash, []):
+                heapq.heappush(candidates, (-self.priority(self.pool[child]), child))
+        while candidates and len(selected) < self.max_txs:
+            _, h = heapq.heappop(candidates)
+            if h in seen:
+                continue
+            seen.add(h)
+            transaction = self.pool[h]
+            spend = (transaction.source_address, transaction.prev_hash)
+            if spend in spent:
+                # conflicting spend, its successors are never pushed
+                continue
+            if self.max_size is not None:
+                if size + self.sizes[h] > self.max_size:
+                    # does not fit, neither do its successors
+                    continue
+                size += self.sizes[h]
+            spent.add(spend)
+            selected.append(transaction)
+            for child in self.children.get(h, []):
+                heapq.heappush(candidates, (-self.priority(self.pool[child]), child))
+        return selected
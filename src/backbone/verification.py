@@ -0,0 +1,78 @@
+# backbone/verification.py
+
+from utils.cryptographic import verify_signatures
+from utils import metrics
+
+
+def verify_transactions(transactions, public_keys, n_workers=None):
+    """
+    verifies prev_owner_sig of every transaction not verified yet and sets is_verified in bulk
+    :param transactions: list of Transaction objects
+    :param public_keys: dict {source address : public key}, key as rsa.PublicKey or PEM string
+    :param n_workers: int, number of processes
+    :return: list of bool, one per transaction
+    """
+    to_verify = [t for t in transactions if not t.is_verified]
+    items = [(t.hash, t.prev_owner_sig, public_keys.get(t.source_address)) for t in to_verify]
+    results = verify_signatures(items, n_workers)
+    for t, result in zip(to_verify, results):
+        t.is_verified = result
+    return [t.is_verified for t in transactions]
+
+
+def check_new_transactions(transactions, public_keys, n_workers=None):
+    """
+    verifies the transactions entering the mempool, the is_verified value sent by the server is not trusted.
+    Transactions whose sender has no known key are left unverified
+    :param transactions: list of Transaction objects
+    :param public_keys: dict {source address : public key}, see get_sender_keys
+    :param n_workers: int, number of processes
+    :return: set of the hashes of the transactions with a wrong signature
+    """
+    for t in transactions:
+        t.is_verified = False
+    known = [t for t in transactions if t.source_address in public_keys]
+    verify_transactions(known, public_keys, n_workers)
+    forged = {t.hash for t in known if not t.is_verified}
+    metrics.inc("mempool.forged_transactions", len(forged))
+    return forged
+
+
+def get_sender_keys(users):
+    """
+    :param users: list of users as dict, data of a GET_USERS response
+    :return: dict {address : PEM public key}
+    """
+    return {u['address']: u['pubkey'] for u in users
+            if isinstance(u, dict) and isinstance(u.get('address'), str) and isinstance(u.get('pubkey'), str)}
+
+
+def verify_blocks(blocks, public_keys, n_workers=None):
+    """
+    verifies the signature of every block, i.e. sign(block hash) with the miner private key
+    :param blocks: list of Block objects
+    :param public_keys: dict {username : public key}, key as rsa.PublicKey or PEM string
+    :param n_workers: int, number of processes
+    :return: list of bool, one per block
+    """
+    return verify_signatures([(b.hash, b.signature, public_keys.get(b.mined_by)) for b in blocks], n_workers)
+
+
+def verify_chain_signatures(blockchain, miner_keys, sender_keys, n_workers=None):
+    """
+    verifies every block and transaction signature of a blockchain in a single batch
+    :param blockchain: Blockchain object
+    :param miner_keys: dict {username : public key}
+    :param sender_keys: dict {source address : public key}
+    :param n_workers: int, number of processes
+    :return: dict {block hash : bool}, True if the block and all its transactions are correctly signed
+    """
+    blocks = [b for b in blockchain.chain.values() if b.prev != 'None']
+    transactions = [t for b in blocks for t in b.transactions if not t.is_verified]
+    items = [(b.hash, b.signature, miner_keys.get(b.mined_by)) for b in blocks]
+    items += [(t.hash, t.prev_owner_sig, sender_keys.get(t.source_address)) for t in transactions]
+    results = verify_signatures(items, n_workers)
+    for t, result in zip(transactions, results[len(blocks):]):
+        t.is_verified = result
+    return {b.hash: result and all(t.is_verified for t in b.transactions)
+            for b, result in zip(blocks, results[:len(blocks)])}
@@ -0,0 +1,79 @@
+# benchmarks/hashing.py
+"""
+micro-benchmark of the nonce loop hash: double_hash against the midstate-cached MiningHasher
+and against every available mining backend on the same hardware.
+Run from src/ with: python -m benchmarks.hashing [n_hashes]
+"""
+import sys
+import timeit
+
+from utils.cryptographic import double_hash, MiningHasher
+from backbone.consensus import BACKENDS, check_backend
+
+# header of a realistic block: previous block hash + timestamp + Merkle root
+HEADER = "000000" + "a" * 58 + "1707912345.123456" + "b" * 64
+
+
+def bench_double_hash(n):
+    """
+    :param n: number of nonces hashed
+    :return: hashes/sec
+    """
+    def loop():
+        for nonce in range(n):
+            double_hash(HEADER + str(nonce))
+    return n / min(timeit.repeat(loop, number=1, repeat=3))
+
+
+def bench_mining_hasher(n):
+    """
+    :param n: number of nonces hashed
+    :return: hashes/sec
+    """
+    hasher = MiningHasher(HEADER)
+
+    def loop():
+        for nonce in range(n):
+            hasher.double_hash(nonce)
+    return n / min(timeit.repeat(loop, number=1, repeat=3))
+
+
+def bench_backend(backend, n):
+    """
+    :param backend: HashBackend instance
+    :param n: number of nonces searched in a single batch, with a difficulty no hash can meet
+    :return: hashes/sec
+    """
+    return n / min(timeit.repeat(lambda: backend.search(HEADER, 0, 1, n, 64), number=1, repeat=3))
+
+
+def check_compatibility(n=1000):
+    """
+    MiningHasher must produce exactly the hashes the server computes with double_hash
+    :param n: number of nonces checked
+    :return: bool
+    """
+    hasher = MiningHasher(HEADER)
+    return all(hasher.double_hash(nonce) == double_hash(HEADER + str(nonce)) for nonce in range(n))
+
+
+def main(n=200000):
+    if not check_compatibility():
+        raise ValueError("MiningHasher is not compatible with double_hash")
+    baseline = bench_double_hash(n)
+    midstate = bench_mining_hasher(n)
+    print(f"double_hash   : {baseline:12,.0f} hashes/s")
+    print(f"MiningHasher  : {midstate:12,.0f} hashes/s  (x{midstate / baseline:.2f})")
+    for name, backend_class in BACKENDS.items():
+        if not backend_class.is_available():
+            print(f"{name:<14}: not available")
+            continue
+        backend = backend_class()
+        if not check_backend(backend):
+            raise ValueError(f"backend {name} is not compatible with double_hash")
+        rate = bench_backend(backend, n)
+        print(f"{name:<14}: {rate:12,.0f} hashes/s  (x{rate / baseline:.2f})")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,63 @@
+# benchmarks/memory.py
+"""
+memory held by the deserialized blockchain and mempool, per 10k blocks and per 10k transactions.
+The synthetic chain goes through JSON as a GET_BLOCKCHAIN response would, so no string is shared with the generator.
+Run from src/ with: python -m benchmarks.memory [n_blocks] [txs_per_block]
+"""
+import gc
+import sys
+import json
+import tracemalloc
+
+from abstractions.block import Block, Blockchain
+from abstractions.transaction import Transaction
+from backbone.mempool import Mempool
+from benchmarks.synthetic import make_chain_dicts, make_transaction_dicts
+
+
+def measure(build):
+    """
+    :param build: function returning the object to measure
+    :return: (object, bytes allocated and still held)
+    """
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def bench_blockchain(n_blocks=10000, txs_per_block=10):
+    """
+    :return: bytes per 10k blocks
+    """
+    data = json.dumps(make_chain_dicts(n_blocks, txs_per_block, fork_rate=0.05))
+    _, size = measure(lambda: Blockchain([Block.from_dict(b) for b in json.loads(data)], validated_file=None))
+    return size * 10000 / n_blocks
+
+
+def bench_mempool(n_txs=10000):
+    """
+    :return: bytes per 10k transactions
+    """
+    data = json.dumps(make_transaction_dicts(n_txs))
+
+    def build():
+        mempool = Mempool()
+        mempool.add_transactions(Transaction.from_dict(t) for t in json.loads(data))
+        return mempool
+    _, size = measure(build)
+    return size * 10000 / n_txs
+
+
+def main(n_blocks=10000, txs_per_block=10):
+    chain = bench_blockchain(n_blocks, txs_per_block)
+    mempool = bench_mempool(n_blocks)
+    print(f"blockchain : {chain / 2 ** 20:8.1f} MiB per 10k blocks of {txs_per_block} transactions")
+    print(f"mempool    : {mempool / 2 ** 20:8.1f} MiB per 10k transactions")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,23 @@
+# benchmarks/orphans.py
+"""
+offline orphan rate of every parent selection strategy, replayed on the local copy of the blockchain
+(vis/blockchain/blockchain.pkl, see backbone.chainstore).
+Run from src/ with: python -m benchmarks.orphans
+"""
+from backbone.chainstore import ChainStore
+from backbone.strategy import simulate
+from utils.view import create_visualization_table
+
+
+def main():
+    store = ChainStore.load()
+    if store.blockchain is None:
+        raise ValueError("no local blockchain, run main.py -v b or -m first")
+    results = simulate(store.blockchain)
+    rows = [[name, r["decisions"], r["orphaned"], f"{100 * r['orphan_rate']:.2f} %"] for name, r in results.items()]
+    print(create_visualization_table(["Strategy", "Parents chosen", "Orphaned", "Orphan rate"], rows,
+                                     f"Parent selection on {len(store.blockchain.chain)} recorded blocks"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/startup.py
+"""
+startup time of every main.py command: the time from the process start to its first request to the server
+(or to its exit for the commands which do not call the server), i.e. the import cost paid before any useful work.
+The server is a local stub answering every request at once, the process is killed after the first request.
+Also reports the heavy packages already imported at that point and the ones imported by a spawned mining worker.
+Run from src/ with: python -m benchmarks.startup [repeat]
+"""
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+import multiprocessing as mp
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.view import create_visualization_table
+
+FLAGS = ("-h", "-d", "-t", "-m", "-v b", "-i b")
+HEAVY_PACKAGES = ("matplotlib", "networkx", "prettytable", "flask")
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def respond(self):
+        if self.server.first_request is None:
+            self.server.first_request = time.perf_counter()
+        body = json.dumps({"msg": "stub", "data": None}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client was killed right after its request
+            pass
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_imported_packages(importtime_log):
+    """
+    :param importtime_log: str, stderr of python -X importtime
+    :return: list of the heavy packages imported
+    """
+    imported = set()
+    for line in importtime_log.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            imported.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return sorted(imported.intersection(HEAVY_PACKAGES))
+
+
+def measure(flag, stub, repeat=3):
+    """
+    :param flag: str, main.py arguments
+    :param stub: ThreadingHTTPServer, stub server
+    :param repeat: int
+    :return: (fastest startup in seconds, heavy packages imported before the first request)
+    """
+    env = dict(os.environ, MINING_SERVER_URL=f"http://127.0.0.1:{stub.server_address[1]}/")
+    times = []
+    packages = []
+    for _ in range(repeat):
+        stub.first_request = None
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-X", "importtime", "main.py"] + flag.split(), cwd=SRC_PATH,
+                                   env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        # stderr is read in a thread, a full pipe would block the child
+        log = []
+        reader = threading.Thread(target=lambda: log.append(process.stderr.read()))
+        reader.start()
+        while stub.first_request is None and process.poll() is None:
+            time.sleep(0.001)
+        end = stub.first_request if stub.first_request is not None else time.perf_counter()
+        process.kill()
+        process.wait()
+        reader.join()
+        times.append(end - start)
+        packages = get_imported_packages(log[0])
+    return min(times), packages
+
+
+def get_worker_packages():
+    """
+    runs in a spawned worker: imports the module of the proof of work worker and returns the heavy packages loaded
+    :return: list of str
+    """
+    import backbone.consensus
+    return sorted(p for p in HEAVY_PACKAGES if p in sys.modules)
+
+
+def measure_worker():
+    """
+    :return: (seconds to spawn a worker and import backbone.consensus in it, heavy packages imported)
+    """
+    start = time.perf_counter()
+    with mp.get_context("spawn").Pool(1) as pool:
+        packages = pool.apply(get_worker_packages)
+    return time.perf_counter() - start, packages
+
+
+def main(repeat=3):
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    stub.first_request = None
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    rows = []
+    try:
+        for flag in FLAGS:
+            seconds, packages = measure(flag, stub, repeat)
+            rows.append([f"main.py {flag}", f"{1000 * seconds:.0f}", ", ".join(packages) or "-"])
+    finally:
+        stub.shutdown()
+    seconds, packages = measure_worker()
+    rows.append(["spawned mining worker", f"{1000 * seconds:.0f}", ", ".join(packages) or "-"])
+    print(create_visualization_table(["Command", "Startup (ms)", "Heavy packages imported"], rows,
+                                     "Startup time to the first request"))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,211 @@
+# benchmarks/suite.py
+"""
+offline benchmark suite of the hot paths, on synthetic data (see benchmarks.synthetic):
+hashing, Merkle root, chain loading and validation, fork choice, signature verification and nonce search.
+Results are saved as JSON in vis/benchmarks/<commit>.json, --compare prints the change against a previous run.
+Run from src/ with: python -m benchmarks.suite [--quick] [--compare ../vis/benchmarks/<commit>.json]
+"""
+import os
+import sys
+import copy
+import json
+import time
+import random
+import platform
+import argparse
+import subprocess
+from datetime import datetime
+
+from abstractions.block import Blockchain
+from abstractions.transaction import Transaction
+from backbone.merkle import MerkleTree
+from backbone.consensus import proof_of_work, get_backend
+from benchmarks.synthetic import make_chain_dicts, make_transaction_dicts, get_user_keys
+from utils.cryptographic import hash_function, double_hash, verify_signature, verify_signatures
+from utils.view import create_visualization_table
+
+BENCHMARK_PATH = "../vis/benchmarks/"
+
+# sizes of the full and of the --quick run
+MERKLE_SIZES = ((10, 100, 1000, 10000), (10, 100, 1000))
+CHAIN_SIZES = ((1000, 10000, 100000), (1000, 10000))
+DIFFICULTIES = ((1, 2, 3, 4), (1, 2, 3))
+N_SIGNATURES = (400, 100)
+N_HASHES = (200000, 50000)
+
+
+def best_time(function, repeat=3):
+    """
+    :param function: function without arguments
+    :param repeat: int
+    :return: float, fastest run in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def result(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def bench_hashing(n):
+    header = "0" * 64 + "1707912345.123456" + "b" * 64
+    return {
+        "hash_function": result(n / best_time(lambda: [hash_function(header + str(i)) for i in range(n)]),
+                                "hashes/s", True),
+        "double_hash": result(n / best_time(lambda: [double_hash(header + str(i)) for i in range(n)]),
+                              "hashes/s", True),
+    }
+
+
+def bench_merkle(sizes):
+    results = dict()
+    for n in sizes:
+        hashes = [hash_function(str(i)) for i in range(n)]
+        results[f"merkle_root_{n}"] = result(1000 * best_time(lambda: MerkleTree(hashes).get_root_hash()), "ms", False)
+    return results
+
+
+def bench_chain(sizes, fork_rate=0.2):
+    """
+    load_json and is_chain_valid on linear chains, fork choice (add_block) and confirm_chain on forky chains.
+    One transaction per block keeps the 100k blocks chain in memory
+    """
+    results = dict()
+    for n in sizes:
+        data = json.dumps({"chain": make_chain_dicts(n, txs_per_block=1)})
+        results[f"load_json_{n}"] = result(best_time(lambda: Blockchain.load_json(data, validated_file=None), 1),
+                                           "s", False)
+        blockchain = Blockchain.load_json(data, validated_file=None)
+
+        def validate():
+            blockchain.validated.clear()
+            assert blockchain.is_chain_valid()
+        results[f"is_chain_valid_{n}"] = result(best_time(validate), "s", False)
+
+        forky = Blockchain.load_json(json.dumps({"chain": make_chain_dicts(n, 1, fork_rate)}), validated_file=None)
+        blocks = [copy.copy(b) for b in sorted(forky.chain.values(), key=lambda b: b.height)]
+        for b in blocks:
+            b.next = []
+
+        def add_blocks():
+            chain = Blockchain([], validated_file=None)
+            chain.validated = forky.validated
+            for b in blocks:
+                chain.add_block(b)
+        results[f"add_block_forks_{n}"] = result(best_time(add_blocks, 1), "s", False)
+        results[f"confirm_chain_forks_{n}"] = result(best_time(forky.confirm_chain), "s", False)
+    return results
+
+
+def bench_signatures(n):
+    keys = get_user_keys()
+    txs = [Transaction.from_dict(t) for t in make_transaction_dicts(n, signed=True)]
+    items = [(t.hash, t.prev_owner_sig, keys[t.source_address][0]) for t in txs]
+    return {
+        "verify_signature": result(len(items) / best_time(lambda: [verify_signature(*i) for i in items], 1),
+                                   "signatures/s", True),
+        "verify_signatures_parallel": result(len(items) / best_time(lambda: verify_signatures(items), 1),
+                                             "signatures/s", True),
+    }
+
+
+def bench_mining(difficulties, rounds=3):
+    """
+    end-to-end nonce search with the default backend: time to a solution and hashrate
+    """
+    rng = random.Random(0)
+    results = {"backend": get_backend().name}
+    for d in difficulties:
+        seconds = hashes = 0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            _, _, stats = proof_of_work("0" * 64, time.time(), hash_function(str(rng.random())), d)
+            seconds += time.perf_counter() - start
+            hashes += sum(s["hashes"] for s in stats)
+        results[f"pow_time_difficulty_{d}"] = result(seconds / rounds, "s", False)
+        results[f"pow_hashrate_difficulty_{d}"] = result(hashes / seconds, "hashes/s", True)
+    return results
+
+
+def get_commit():
+    """
+    :return: str, short hash of the current commit, "unknown" outside a git checkout
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(quick=False):
+    """
+    :param quick: bool, smaller sizes
+    :return: dict, run metadata and results
+    """
+    i = 1 if quick else 0
+    results = dict()
+    for name, bench in (("hashing", lambda: bench_hashing(N_HASHES[i])),
+                        ("merkle", lambda: bench_merkle(MERKLE_SIZES[i])),
+                        ("chain", lambda: bench_chain(CHAIN_SIZES[i])),
+                        ("signatures", lambda: bench_signatures(N_SIGNATURES[i])),
+                        ("mining", lambda: bench_mining(DIFFICULTIES[i]))):
+        print(f"running {name} ...", file=sys.stderr)
+        results.update(bench())
+    return {
+        "commit": get_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def compare(current, previous):
+    """
+    :param current: dict, returned by run
+    :param previous: dict, loaded from a saved run
+    :return: list of rows [name, previous, current, unit, change %], positive changes are improvements
+    """
+    rows = []
+    for name, r in current["results"].items():
+        old = previous["results"].get(name)
+        if not isinstance(r, dict) or not isinstance(old, dict) or not old["value"]:
+            continue
+        ratio = r["value"] / old["value"] if r["higher_is_better"] else old["value"] / r["value"]
+        rows.append([name, f"{old['value']:.4g}", f"{r['value']:.4g}", r["unit"], f"{100 * (ratio - 1):+.1f}"])
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark suite of the hot paths")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, a few seconds")
+    parser.add_argument("--output", default=None, help="JSON file, default vis/benchmarks/<commit>.json")
+    parser.add_argument("--compare", default=None, help="JSON file of a previous run")
+    args = parser.parse_args(argv)
+
+    current = run(args.quick)
+    output = args.output or BENCHMARK_PATH + current["commit"] + ".json"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(current, f, indent=2)
+    rows = [[name, f"{r['value']:.4g}", r["unit"]] for name, r in current["results"].items() if isinstance(r, dict)]
+    print(create_visualization_table(["Benchmark", "Value", "Unit"], rows, f"Commit {current['commit']}"))
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(create_visualization_table(["Benchmark", f"Before ({previous['commit']})",
+                                          f"After ({current['commit']})", "Unit", "Change %"],
+                                         compare(current, previous), "Comparison, positive is faster"))
+    print(f"results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# benchmarks/synthetic.py
+"""
+reproducible synthetic transactions and chains in the GET_BLOCKCHAIN format, for the offline benchmarks.
+Block hashes are the real double hash of their header, so the chains pass Blockchain.is_chain_valid
+(the difficulty is not enforced). Signatures are random bytes unless signed=True.
+"""
+import random
+
+import rsa
+
+from utils.cryptographic import double_hash, hash_function, save_key, save_signature, sign_message
+from backbone.merkle import MerkleTree
+
+# 512 bits, as the keys of the competition users
+KEY_SIZE = 512
+_key_pairs = []
+
+
+def make_key_pair(seed):
+    """
+    rsa.newkeys takes its primes from os.urandom, here they are searched from a seeded generator instead
+    :param seed: int
+    :return: (rsa.PublicKey, rsa.PrivateKey), the same for the same seed
+    """
+    rng = random.Random(seed)
+
+    def getprime(nbits):
+        while True:
+            # odd, with the top bit set as rsa.prime.getprime does
+            candidate = rng.getrandbits(nbits) | 1 << (nbits - 1) | 1
+            if rsa.prime.is_prime(candidate):
+                return candidate
+
+    p, q, e, d = rsa.key.gen_keys(KEY_SIZE, getprime)
+    return rsa.PublicKey(p * q, e), rsa.PrivateKey(p * q, e, d, p, q)
+
+
+def get_key_pairs(n):
+    """
+    key generation is slow, the pairs are generated once per process and shared by every generator.
+    The i-th pair is always the same, so are the keys, hashes and signatures of the synthetic data
+    :param n: int, number of key pairs
+    :return: list of (rsa.PublicKey, rsa.PrivateKey)
+    """
+    while len(_key_pairs) < n:
+        _key_pairs.append(make_key_pair(len(_key_pairs)))
+    return _key_pairs[:n]
+
+
+def get_address(i):
+    """
+    :param i: int, index of a synthetic user
+    :return: str, its address
+    """
+    return hash_function(str(i))
+
+
+def get_user_keys(n_users=20):
+    """
+    :param n_users: int
+    :return: dict, address -> (rsa.PublicKey, rsa.PrivateKey) of the synthetic users
+    """
+    return {get_address(i): pair for i, pair in enumerate(get_key_pairs(n_users))}
+
+
+def make_transaction_dicts(n, n_users=20, seed=0, signed=False):
+    """
+    :param n: int, number of transactions
+    :param n_users: int, number of senders and receivers
+    :param seed: int
+    :param signed: bool, sign every transaction hash with the sender key
+    :return: list of transactions as dict, see Transaction.to_dict. Transactions of the same sender are chained
+    by prev_hash
+    """
+    rng = random.Random(seed)
+    pairs = get_key_pairs(n_users)
+    pems = [save_key(pub) for pub, _ in pairs]
+    addresses = [get_address(i) for i in range(n_users)]
+    last = ['None'] * n_users
+    txs = []
+    for i in range(n):
+        sender, receiver = rng.randrange(n_users), rng.randrange(n_users)
+        amount = rng.randint(1, 1000)
+        time = 1700000000 + i + rng.random()
+        tx_hash = hash_function(str(last[sender]) + str(pairs[receiver][0]) + str(time))
+        if signed:
+            signature = sign_message(tx_hash, pairs[sender][1])
+        else:
+            signature = rng.randbytes(KEY_SIZE // 8)
+        txs.append({
+            "source_address": addresses[sender],
+            "destination_address": addresses[receiver],
+            "time": time,
+            "amount": amount,
+            "prev_hash": last[sender],
+            "receiver_pub": pems[receiver],
+            "hash": tx_hash,
+            "prev_owner_sig": save_signature(signature),
+            "is_verified": False,
+            "fee": rng.randint(1, max(amount // 5, 1)),
+        })
+        last[sender] = tx_hash
+    return txs
+
+
+def make_chain_dicts(n_blocks, txs_per_block=10, fork_rate=0.0, n_miners=8, seed=0):
+    """
+    :param n_blocks: int, number of blocks, genesis included
+    :param txs_per_block: int
+    :param fork_rate: float, probability that a block is mined on a recent block other than the tip
+    :param n_miners: int
+    :param seed: int
+    :return: list of blocks as dict, see Block.to_dict, parents first
+    """
+    rng = random.Random(seed)
+    txs = make_transaction_dicts(n_blocks * txs_per_block, seed=seed)
+    blocks = []
+    tip = None
+    for i in range(n_blocks):
+        if tip is None:
+            prev, height = 'None', 0
+        else:
+            parent = rng.choice(blocks[-4:]) if rng.random() < fork_rate else tip
+            prev, height = parent["hash"], parent["height"] + 1
+        block_txs = txs[i * txs_per_block:(i + 1) * txs_per_block]
+        merkle_root = MerkleTree([t["hash"] for t in block_txs]).get_root_hash()
+        time = 1700000000 + 10 * i + rng.random()
+        nonce = rng.randrange(2 ** 32)
+        block = {
+            "transactions": block_txs,
+            "hash": double_hash(str(prev) + str(time) + str(merkle_root) + str(nonce)),
+            "prev": prev,
+            "nonce": nonce,
+            "time": time,
+            "creation_time": rng.random() * 10,
+            "merkle_root": merkle_root,
+            "main_chain": True,
+            "confirmed": False,
+            "next": [],
+            "mined_by": f"miner{rng.randrange(n_miners)}",
+            "height": height,
+            "signature": save_signature(rng.randbytes(KEY_SIZE // 8)),
+        }
+        if tip is None or height > tip["height"]:
+            tip = block
+        blocks.append(block)
+    return blocks
@@ -8,34 +8,87 @@ Assignment 1 - Blockchain Mining Competition
 
 Usage:
         -h                  : display usage information
-        -i [b, u]           : display information for blocks or users   #TODO
-        -t                  : request N transactions                    #TODO
-        -m                  : mine a block                              #TODO
-        -v b                : visualize blockchain, saved to vis/blockchain/blockchain.pdf
+        -i [b, u]           : display information for the last local blocks or users   #TODO: users
+        -t                  : request the transaction pool, build the best block template
+        -m                  : mine a block
+        -v [b, s]           : visualize blockchain, saved to vis/blockchain/blockchain.pdf, with s to
+                              vis/blockchain/blockchain.svg without matplotlib
+        -w [b, m]           : watch the last blocks live, with m also mine and show our hashrate
         -d                  : request DIFFICULTY level
+        -p                  : profile the command, stats saved to vis/metrics/main.prof
+        -M                  : dump metrics to vis/metrics/metrics.json and serve them on 127.0.0.1:9100/metrics
 """
 __author__ = "Enrico Tedeschi"
 __copyright__ = "Copyright (C) 2023 Enrico Tedeschi"
 __license__ = "GNU General Public License."
 __version__ = "v1.0"
 
+import os
 import sys
+import time
 import getopt
+import threading
+import cProfile
+import pstats
 import random
 import requests
-import json
 from datetime import datetime
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
-from utils.flask_utils import flask_call
-from abstractions.block import Blockchain
-from server import BLOCK_PROPOSAL, REQUEST_DIFFICULTY, GET_BLOCKCHAIN, ADDRESS, PORT
-from utils.view import visualize_blockchain, visualize_blockchain_terminal
+from utils.flask_utils import flask_call, get_session
+from abstractions.transaction import Transaction
+from backbone.consensus import Miner
+from backbone.poller import ChainPoller
+from backbone.template import BlockTemplateBuilder
+from backbone.mempool import Mempool
+from backbone.chainstore import ChainStore
+from backbone.verification import get_sender_keys
+from server import REQUEST_DIFFICULTY, REQUEST_TXS, GET_USERS, ADDRESS, PORT
+from utils import metrics
+from server import METRICS_PATH, METRICS_PORT, PROFILE_FILE, DIFFICULTY
+from utils.view import visualize_blockchain, visualize_blockchain_terminal, create_visualization_table, \
+    TerminalDashboard, BlockchainSVG, get_hash_for_visualization
 
 def main(argv):
     try:
-        opts, args = getopt.getopt(argv, "hi:tmdv:")
+        opts, args = getopt.getopt(argv, "hi:tmdv:pMw:")
         # print(f'opts : {opts}\nargs : {args}')
+        if ("-p", "") in opts:
+            profile(opts)
+            return
+        reporter = metrics.start(METRICS_PORT) if ("-M", "") in opts else None
+        try:
+            run(opts)
+        finally:
+            if reporter is not None:
+                reporter.stop()
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+
+def profile(opts):
+    """
+    runs the command under cProfile, prints the slowest functions and saves the stats for snakeviz/pstats
+    :param opts: options of the command, -p included
+    :return:
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        main([o + a for o, a in opts if o != "-p"])
+    finally:
+        profiler.disable()
+        os.makedirs(METRICS_PATH, exist_ok=True)
+        profiler.dump_stats(METRICS_PATH + PROFILE_FILE)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+def run(opts):
+    """
+    runs the commands of the parsed options
+    :param opts: list of (option, argument) from getopt
+    :return:
+    """
+    try:
         valid_args = False
         for opt, arg in opts:
             if opt == "-h":  # usage
@@ -43,15 +96,40 @@ def main(argv):
                 valid_args = True
                 break
             if opt == "-m":  # mine block
-                # TODO: IMPLEMENT BLOCK MINING
-                response, _, _ = flask_call('POST', BLOCK_PROPOSAL, data=None)
+                store = ChainStore.load()
+                store.sync()
+                if store.get_tip() is None:
+                    print("the blockchain is empty, there is no block to mine on")
+                    valid_args = True
+                    continue
+                mempool = Mempool.load()
+                request_transactions(mempool)
+                mempool.evict_mined(store.blockchain)
+                # the poller restarts the proof of work as soon as the tip changes
+                poller = ChainPoller(store, mempool)
+                miner = Miner(poller)
+                poller.start()
+                try:
+                    [(block, response, _)] = miner.run(n_blocks=1)
+                finally:
+                    poller.stop()
+                rows = [[s["worker"], s["hashes"], round(s["seconds"], 2), int(s["hashrate"])]
+                        for s in miner.last_stats]
+                print(create_visualization_table(["Worker", "Hashes", "Time (s)", "Hashes/s"], rows,
+                                                 f"Proof of Work: {miner.stale_rounds} restarts on a new tip, "
+                                                 f"{miner.stale_seconds:.1f} s of stale work"))
                 print(response)
                 valid_args = True
             if opt == "-i":
                 # INFO
                 if arg == "b":
-                    # TODO: GET INFO ABOUT BLOCKCHAIN
-                    print("To be implemented ...")
+                    # read block by block from the binary chain file, the chain is not loaded
+                    chain_file = ChainStore().open_chain_file()
+                    if chain_file is None:
+                        print("no local blockchain yet, run -v b, -m or -t first")
+                    else:
+                        with chain_file:
+                            print_blocks_info(chain_file)
                     valid_args = True
                 elif arg == "u":
                     # TODO: GET INFO ABOUT USERS
@@ -60,20 +138,46 @@ def main(argv):
                 else:
                     valid_args = False
             if opt == "-t":
-                # TODO: Implement GET_TXS
-                print("To be implemented ...")
+                store = ChainStore.load()
+                store.sync()
+                mempool = Mempool.load()
+                request_transactions(mempool)
+                mempool.evict_mined(store.blockchain)
+                mempool.save()
+                pool = list(mempool.transactions.values())
+                start = time.perf_counter()
+                template = BlockTemplateBuilder(pool).build()
+                elapsed = (time.perf_counter() - start) * 1000
+                rows = [[t.hash[:8], t.source_address[:8], t.amount, t.fee] for t in template]
+                print(create_visualization_table(["Hash", "Source", "Amount", "Fee"], rows,
+                                                 f"Block template: {len(template)}/{len(pool)} transactions, "
+                                                 f"total fee {sum(t.fee for t in template)}, {elapsed:.2f} ms"))
                 valid_args = True
             if opt == "-v":
                 if arg == "b":
-                    # fetch blockchain from server
-                    # get blockchain info
-                    _, blockchain, code = flask_call('GET', GET_BLOCKCHAIN)
-                    if blockchain:
-                        b_chain = Blockchain.load_json(json.dumps(blockchain))
+                    # fetch the new blocks from server
+                    store = ChainStore.load()
+                    store.sync()
+                    b_chain = store.blockchain
+                    if b_chain:
                         # saves the blockchain as pdf in "vis/blockchain/blockchain.pdf"
-                        visualize_blockchain(b_chain.block_list, n_blocks=40)
+                        visualize_blockchain(b_chain.block_list)
                         visualize_blockchain_terminal(b_chain.block_list, n_blocks=40)
                     valid_args = True
+                if arg == "s":
+                    store = ChainStore.load()
+                    store.sync()
+                    if store.blockchain:
+                        # saves the blockchain as svg in "vis/blockchain/blockchain.svg"
+                        n_blocks = BlockchainSVG().update(store.blockchain.block_list)
+                        print(f"{n_blocks} blocks drawn")
+                    valid_args = True
+            if opt == "-w":
+                if arg in ("b", "m"):
+                    watch(mine=arg == "m")
+                    valid_args = True
+            if opt in ("-p", "-M"):
+                continue
             if opt == "-d":
                 response, table, code = flask_call('GET', REQUEST_DIFFICULTY)
                 print(response)
@@ -81,9 +185,6 @@ def main(argv):
                 valid_args = True
         if valid_args is False:
             print(__doc__)
-    except getopt.GetoptError:
-        print(__doc__)
-        sys.exit(2)
     except ValueError as e:
         print(e)
         print(__doc__)
@@ -91,13 +192,105 @@ def main(argv):
     except KeyboardInterrupt as e:
         print(e)
 
+def watch(mine=False, n_blocks=15, refresh=1.0):
+    """
+    live dashboard of the last blocks and of the miner, until Ctrl-C. The poller keeps the chain and the mempool
+    up to date, the dashboard is redrawn on its events or every refresh seconds
+    :param mine: bool, also mine forever in a background thread
+    :param n_blocks: int, number of heights shown
+    :param refresh: float, seconds between two redraws without events
+    :return:
+    """
+    store = ChainStore.load()
+    store.sync()
+    mempool = Mempool.load()
+    mempool.evict_mined(store.blockchain)
+    # errors are shown in the status line, a print would break the frame
+    poller = ChainPoller(store, mempool, log_errors=False)
+    changed = threading.Event()
+    poller.subscribe(lambda event, value: changed.set())
+    miner = Miner(poller) if mine and store.get_tip() is not None else None
+    dashboard = TerminalDashboard()
+    poller.start()
+    if miner is not None:
+        threading.Thread(target=miner.run, args=(None,), daemon=True).start()
+    try:
+        while True:
+            with poller.lock:
+                blockchain = store.blockchain
+                tip = blockchain.get_tip() if blockchain is not None else None
+                blocks = []
+                if tip is not None:
+                    for height in range(blockchain.height, max(blockchain.height - n_blocks, -1), -1):
+                        blocks += blockchain.get_blocks_at_height(height)
+                pending = len(mempool)
+            hashrate = metrics.get_gauge("miner.hashrate")
+            status = {
+                "Tip": f"{get_hash_for_visualization(tip.hash)} ({tip.height})" if tip is not None else "-",
+                "Difficulty": poller.difficulty if poller.difficulty is not None else DIFFICULTY,
+                "Pending txs": pending,
+                "Hashrate": f"{int(hashrate)} H/s" if hashrate is not None else "-",
+            }
+            if miner is not None:
+                status["Stale"] = f"{miner.stale_rounds}/{miner.rounds} rounds"
+            if poller.failed_polls:
+                status["Server"] = f"{poller.failed_polls} failed polls, {poller.last_error!r}"[:80]
+            status["Updated"] = datetime.now().strftime('%H:%M:%S')
+            dashboard.update(blocks, status)
+            changed.wait(refresh)
+            changed.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dashboard.close()
+        if miner is not None:
+            miner.close()
+        poller.stop()
+
+def print_blocks_info(chain_file, n_blocks=10):
+    """
+    prints the last blocks of the local chain
+    :param chain_file: backbone.chainfile.ChainFile
+    :param n_blocks: int, number of heights shown
+    :return:
+    """
+    height = chain_file.get_height()
+    rows = []
+    for h in range(height, max(height - n_blocks, -1), -1):
+        for b in chain_file.get_by_height(h):
+            rows.append([h, get_hash_for_visualization(b.hash), b.mined_by, len(b.transactions),
+                         b.main_chain, b.confirmed])
+    print(create_visualization_table(["Height", "Hash", "Miner", "Txs", "Main chain", "Confirmed"], rows,
+                                     f"Local blockchain: {len(chain_file)} blocks, height {height}"))
+
+def request_transactions(mempool):
+    """
+    fetches the transaction pool from the server and adds it to the local mempool.
+    Transactions already known by the mempool are not deserialized again, the ones no longer in the server pool
+    (mined or dropped) are removed. The signatures of the new ones are verified, the keys of their senders are
+    fetched if they are not known yet
+    :param mempool: Mempool object
+    :return: int, number of new transactions
+    """
+    _, txs, code = flask_call('GET', REQUEST_TXS)
+    if code != 200 or not isinstance(txs, list):
+        # no answer, the local pool is kept as it is
+        return 0
+    mempool.retain({t['hash'] for t in txs})
+    new_txs = [Transaction.from_dict(t) for t in txs if not mempool.is_known(t['hash'])]
+    if mempool.get_unknown_senders(new_txs):
+        _, users, code = flask_call('GET', GET_USERS)
+        if code == 200 and isinstance(users, list):
+            mempool.sender_keys.update(get_sender_keys(users))
+    return mempool.add_checked_transactions(new_txs)
+
 def connect_to_server():
     """
 
     :return:
     """
     url = 'https://' + ADDRESS + ':' + PORT + '/'
-    response = requests.get(url, verify=False)
+    response = get_session().get(url)
     return response
 
 if __name__ == "__main__":
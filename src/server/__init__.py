@@ -1,15 +1,40 @@
+import os
+
 DIFFICULTY = 6
+N_BLOCKS_PER_BRANCH = 6  # a block on the main chain is confirmed once this many blocks are mined after it
+MAX_TXS_PER_BLOCK = 100  # cap used when building a block template
+BLOCK_REWARD = 6.25  # BTC granted to the miner of a confirmed block
 USER_PATH = "../vis/users/"
 USER_FILE = "users.db"
 BLOCKCHAIN_PATH = "../vis/blockchain/"
 BLOCKCHAIN_FILE = "blockchain.pkl"
+VALIDATED_FILE = "validated.pkl"
+CHAIN_BINARY_FILE = "blockchain.bin"
+MEMPOOL_PATH = "../vis/mempool/"
+MEMPOOL_FILE = "mempool.pkl"
+MEMPOOL_MINED_BLOCKS = 100  # last main chain blocks whose transactions are kept out of the mempool
 KEY_PAIRS_PATH = "../vis/users/keys/"
 KEY_PAIRS_DICT = "user_keys.pkl"
+PRIVATE_KEY_FILE = USER_PATH + "user_pvk.pem"
+PUBLIC_KEY_FILE = USER_PATH + "user_pbk.pem"
+METRICS_PATH = "../vis/metrics/"
+METRICS_FILE = "metrics.json"
+PROFILE_FILE = "main.prof"
+METRICS_INTERVAL = 10  # seconds between two dumps of the metrics, see utils.metrics
+METRICS_PORT = 9100  # main.py -M serves the metrics on http://127.0.0.1:9100/metrics
+LOCAL_SERVER_PATH = "../vis/local/"  # users database and key pairs of the local stand-in server, see server.local
 
 # network
 PORT = '8080'
 ADDRESS = 'ete011@inf3203.cs.uit.no'
-URL = 'https://' + ADDRESS + ':' + PORT + '/'
+# e.g. MINING_SERVER_URL=http://127.0.0.1:8080/ to run against the local stand-in server, see server.local
+URL = os.environ.get('MINING_SERVER_URL', 'https://' + ADDRESS + ':' + PORT + '/')
+REQUEST_TIMEOUT = (3.05, 30)  # seconds to connect, seconds to read
+REQUEST_RETRIES = 3  # retries on connection errors, 429 and 503. POST requests are retried only if not sent
+REQUEST_BACKOFF = 0.5  # seconds, doubled at every retry unless the server sends Retry-After
+REQUEST_MAX_DELAY = 30  # seconds, upper bound of a retry delay, Retry-After included
+REQUEST_GZIP = False  # gzip the body of POST requests
+POLL_INTERVAL = 2  # seconds between two polls of the chain tip, transaction pool and difficulty
 
 SELF = 'your_username'  # TODO: insert your username here
 
@@ -0,0 +1,119 @@
+# server/db.py
+"""
+SQLite database of the competition users. One row per user, in the order read by User.load_user:
+username, public key (PEM), address, balance, mined blocks, confirmed blocks, total reward, transactions (JSON list)
+Every call opens its own connection, so the database can be used from the Flask threads.
+"""
+import os
+import json
+import sqlite3
+from contextlib import closing
+
+from server import USER_PATH, USER_FILE
+
+# database used when no db_file is given, see configure
+DB_FILE = USER_PATH + USER_FILE
+
+FIELDS = ("username", "pubkey", "address", "balance", "mined_blocks", "confirmed_blocks", "total_reward",
+          "transactions")
+
+
+def configure(db_file):
+    """
+    changes the default database, e.g. to the one of the local stand-in server
+    :param db_file: str
+    :return:
+    """
+    global DB_FILE
+    DB_FILE = db_file
+
+
+def connect(db_file=None):
+    """
+    :param db_file: str, None for DB_FILE
+    :return: sqlite3.Connection
+    """
+    db_file = db_file or DB_FILE
+    os.makedirs(os.path.dirname(db_file), exist_ok=True)
+    return sqlite3.connect(db_file, timeout=10)
+
+
+def create_table(db_file=None):
+    """
+    :param db_file: str, None for DB_FILE
+    :return:
+    """
+    with closing(connect(db_file)) as conn, conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, pubkey TEXT, address TEXT UNIQUE, "
+                     "balance REAL, mined_blocks INTEGER, confirmed_blocks INTEGER, total_reward REAL, "
+                     "transactions TEXT)")
+
+
+def insert_user(username, pubkey, address, balance, db_file=None):
+    """
+    adds a user, or resets it if the username exists
+    :param username: str
+    :param pubkey: str, PEM public key
+    :param address: str
+    :param balance: float
+    :param db_file: str, None for DB_FILE
+    :return:
+    """
+    with closing(connect(db_file)) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, 0, 0, 0.0, '[]')",
+                     (username, pubkey, address, balance))
+
+
+def get_user(address, db_file=None):
+    """
+    :param address: str, address or username
+    :param db_file: str, None for DB_FILE
+    :return: list, user row, None if unknown
+    """
+    with closing(connect(db_file)) as conn:
+        row = conn.execute("SELECT * FROM users WHERE address = ? OR username = ?", (address, address)).fetchone()
+    return list(row) if row is not None else None
+
+
+def get_users(db_file=None):
+    """
+    :param db_file: str, None for DB_FILE
+    :return: list of user rows
+    """
+    with closing(connect(db_file)) as conn:
+        return [list(row) for row in conn.execute("SELECT * FROM users ORDER BY username")]
+
+
+def update_user(username, balance=0.0, mined_blocks=0, confirmed_blocks=0, total_reward=0.0, db_file=None):
+    """
+    adds the given amounts to the user counters
+    :param username: str
+    :param db_file: str, None for DB_FILE
+    :return:
+    """
+    with closing(connect(db_file)) as conn, conn:
+        conn.execute("UPDATE users SET balance = balance + ?, mined_blocks = mined_blocks + ?, "
+                     "confirmed_blocks = confirmed_blocks + ?, total_reward = total_reward + ? WHERE username = ?",
+                     (balance, mined_blocks, confirmed_blocks, total_reward, username))
+
+
+def set_transactions(username, transactions, db_file=None):
+    """
+    :param username: str
+    :param transactions: list of the hashes of the transactions sent by the user
+    :param db_file: str, None for DB_FILE
+    :return:
+    """
+    with closing(connect(db_file)) as conn, conn:
+        conn.execute("UPDATE users SET transactions = ? WHERE username = ?", (json.dumps(transactions), username))
+
+
+def row_to_dict(row):
+    """
+    :param row: list, user row
+    :return: dict, as User.to_dict(pvt=False)
+    """
+    user = dict(zip(FIELDS, row))
+    user["privkey"] = "Secret"
+    user["transactions"] = json.loads(user["transactions"])
+    return user
@@ -0,0 +1,75 @@
+# server/filesys.py
+"""
+key pairs of the users, pickled as {username: (public PEM, private PEM)} in KEY_PAIRS_PATH + KEY_PAIRS_DICT
+"""
+import os
+import pickle
+import threading
+
+from server import KEY_PAIRS_PATH, KEY_PAIRS_DICT
+from utils.cryptographic import save_key, load_public, load_private
+
+# key file used when no keys_file is given, see configure
+KEYS_FILE = KEY_PAIRS_PATH + KEY_PAIRS_DICT
+_lock = threading.Lock()
+
+
+def configure(keys_file):
+    """
+    changes the default key file, e.g. to the one of the local stand-in server
+    :param keys_file: str
+    :return:
+    """
+    global KEYS_FILE
+    KEYS_FILE = keys_file
+
+
+def load_key_pairs(keys_file=None):
+    """
+    :param keys_file: str, None for KEYS_FILE
+    :return: dict, username -> (public PEM, private PEM)
+    """
+    keys_file = keys_file or KEYS_FILE
+    if not os.path.exists(keys_file):
+        return dict()
+    with open(keys_file, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_key_pair(username, public, private, keys_file=None):
+    """
+    :param username: str
+    :param public: rsa.PublicKey
+    :param private: rsa.PrivateKey, None if only the public key is known
+    :param keys_file: str, None for KEYS_FILE
+    :return:
+    """
+    keys_file = keys_file or KEYS_FILE
+    with _lock:
+        pairs = load_key_pairs(keys_file)
+        pairs[username] = (save_key(public), save_key(private) if private is not None else None)
+        os.makedirs(os.path.dirname(keys_file), exist_ok=True)
+        tmp = keys_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(pairs, f)
+        os.replace(tmp, keys_file)
+
+
+def load_public_key(username, keys_file=None):
+    """
+    :param username: str
+    :param keys_file: str, None for KEYS_FILE
+    :return: rsa.PublicKey, None if unknown
+    """
+    pair = load_key_pairs(keys_file).get(username)
+    return load_public(pair[0]) if pair else None
+
+
+def load_private_key(username, keys_file=None):
+    """
+    :param username: str
+    :param keys_file: str, None for KEYS_FILE
+    :return: rsa.PrivateKey, None if unknown
+    """
+    pair = load_key_pairs(keys_file).get(username)
+    return load_private(pair[1]) if pair and pair[1] else None
@@ -0,0 +1,370 @@
+# server/local.py
+"""
+local stand-in for the competition server, a reproducible target to load test the client (mining throughput,
+orphan rate, sync latency). It serves every endpoint of server/__init__.py with the same {'msg', 'data'} responses,
+keeps the users in SQLite (server.db), generates signed transactions and runs simulated competing miners
+(server.simulation). Difficulty and rate limit can be changed while it runs.
+Run from src/ with: python -m server.local --difficulty 4 --miners 3
+then point the client at it: MINING_SERVER_URL=http://127.0.0.1:8080/ python main.py -m
+"""
+import os
+import gzip
+import json
+import binascii
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime
+
+import rsa
+from flask import Flask, jsonify, request
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+
+from server import db, filesys
+from server import DIFFICULTY, N_BLOCKS_PER_BRANCH, BLOCK_REWARD, SELF, PUBLIC_KEY_FILE, PRIVATE_KEY_FILE, USER_FILE, \
+    KEY_PAIRS_DICT, LOCAL_SERVER_PATH, PORT, BLOCK_PROPOSAL, GET_BLOCKCHAIN, GET_USERS, REQUEST_TXS, GET_DATABASE, \
+    REQUEST_DIFFICULTY
+from server.simulation import TransactionGenerator, SimulatedMiner
+from abstractions.block import Block, Blockchain
+from abstractions.user import User
+from backbone.merkle import MerkleTree, EMPTY_ROOT
+from backbone.template import BlockTemplateBuilder
+from backbone.consensus import is_hash_valid
+from utils.cryptographic import double_hash, save_key, load_public, load_private, check_signature, sign_message
+
+# endpoints of the local server only
+SET_DIFFICULTY = 'set_difficulty'
+SET_RATE_LIMIT = 'set_rate_limit'
+STATS = 'stats'
+
+INITIAL_BALANCE = 1000.0
+
+
+def make_genesis_block():
+    """
+    :return: Block, same on every run. The rest of the chain is not: the server starts from this block on every
+    run, and a client ChainStore drops the blocks of a previous run on its next sync
+    """
+    time = 0
+    return Block(
+        hash=double_hash('None' + str(time) + EMPTY_ROOT + '0'),
+        nonce=0,
+        time=time,
+        creation_time=0,
+        height=0,
+        previous_block='None',
+        merkle_root=EMPTY_ROOT,
+        mined_by='genesis',
+        signature=b'',
+    )
+
+
+class CompetitionServer:
+    """
+    state of the local server: blockchain, transaction pool and users. Every method is thread safe
+    """
+    def __init__(self, difficulty=DIFFICULTY, rate_limit="1200 per minute", max_pool=10000, path=LOCAL_SERVER_PATH):
+        """
+        :param difficulty: int, leading zeros required in a block hash
+        :param rate_limit: str, Flask-Limiter limit per client, e.g. "10 per second"
+        :param max_pool: int, maximum number of pending transactions, the oldest are dropped
+        :param path: str, directory of the users database and key pairs
+        """
+        self.difficulty = difficulty
+        self.rate_limit = rate_limit
+        self.max_pool = max_pool
+        db.configure(path + USER_FILE)
+        filesys.configure(path + KEY_PAIRS_DICT)
+        db.create_table()
+        self.lock = threading.RLock()
+        genesis = make_genesis_block()
+        self.blockchain = Blockchain([genesis], validated_file=None)
+        self.block_dicts = {genesis.hash: genesis.to_dict()}  # serialized once, flags are refreshed on every read
+        self.pool = dict()  # hash -> Transaction, oldest first
+        self.pool_dicts = dict()
+        self.stats = Counter()
+        self.rewarded = 0  # number of blocks of the main chain whose miner got the reward
+
+    def register_user(self, username, public=None, private=None, balance=INITIAL_BALANCE):
+        """
+        :param username: str
+        :param public: rsa.PublicKey, None to generate a key pair
+        :param private: rsa.PrivateKey
+        :param balance: float
+        :return: User
+        """
+        user = User(username, balance, public=public, private=private)
+        db.insert_user(user.username, save_key(user.pubkey), user.address, user.balance)
+        filesys.save_key_pair(user.username, user.pubkey, user.privkey)
+        return user
+
+    def register_self(self):
+        """
+        registers SELF with the key pair in vis/users/, generated if there is none, so main.py -m works unchanged
+        :return: User
+        """
+        if os.path.exists(PUBLIC_KEY_FILE):
+            with open(PUBLIC_KEY_FILE, 'r') as f:
+                public = load_public(f.read())
+            private = None
+            if os.path.exists(PRIVATE_KEY_FILE):
+                with open(PRIVATE_KEY_FILE, 'r') as f:
+                    private = load_private(f.read())
+            return self.register_user(SELF, public, private)
+        public, private = rsa.newkeys(512)
+        os.makedirs(os.path.dirname(PUBLIC_KEY_FILE), exist_ok=True)
+        with open(PUBLIC_KEY_FILE, 'w') as f:
+            f.write(save_key(public))
+        with open(PRIVATE_KEY_FILE, 'w') as f:
+            f.write(save_key(private))
+        return self.register_user(SELF, public, private)
+
+    def add_transaction(self, transaction):
+        """
+        :param transaction: Transaction object
+        :return:
+        """
+        with self.lock:
+            if len(self.pool) >= self.max_pool:
+                oldest = next(iter(self.pool))
+                del self.pool[oldest]
+                del self.pool_dicts[oldest]
+            self.pool[transaction.hash] = transaction
+            self.pool_dicts[transaction.hash] = transaction.to_dict()
+
+    def get_transactions(self):
+        """
+        :return: list of the pending transactions as dict
+        """
+        with self.lock:
+            return list(self.pool_dicts.values())
+
+    def get_block_dict(self, block_hash):
+        b = self.blockchain.chain[block_hash]
+        d = dict(self.block_dicts[block_hash])
+        d.update(main_chain=b.main_chain, confirmed=b.confirmed, next=list(b.next))
+        return d
+
+    def get_blockchain(self, height=None, tip=None):
+        """
+        :param height: int, height of the client, see ChainStore.get_sync_params
+        :param tip: str, tip of the client. If it is known, only the blocks from N_BLOCKS_PER_BRANCH below height
+        are sent, so the client gets the new blocks and the flags which may have changed
+        :return: dict, as Blockchain.to_dict
+        """
+        with self.lock:
+            if height is not None and tip in self.blockchain.chain:
+                hashes = []
+                for h in range(max(height - N_BLOCKS_PER_BRANCH, 0), self.blockchain.height + 1):
+                    hashes.extend(self.blockchain.heights.get(h, []))
+            else:
+                hashes = list(self.blockchain.chain)
+            chain = [self.get_block_dict(h) for h in hashes]
+        return {"block_list": None, "chain": chain, "is_valid": True}
+
+    def check_block(self, block, check_difficulty=True):
+        """
+        :param block: Block object
+        :param check_difficulty: bool
+        :return: str, reason why the block is rejected, None if it can be added
+        """
+        chain = self.blockchain.chain
+        if block.hash in chain:
+            return "block already in the blockchain"
+        if block.prev not in chain:
+            return "previous block not found"
+        if block.height != chain[block.prev].height + 1:
+            return "wrong block height"
+        if check_difficulty and not is_hash_valid(block.hash, self.difficulty):
+            return f"the block hash does not meet difficulty {self.difficulty}"
+        if MerkleTree([t.hash for t in block.transactions]).get_root_hash() != block.merkle_root:
+            return "wrong Merkle root"
+        if any(t.hash not in self.pool for t in block.transactions):
+            return "transaction not in the pool"
+        miner = db.get_user(block.mined_by)
+        if miner is None:
+            return f"unknown miner {block.mined_by}"
+        if not check_signature((block.hash, block.signature, miner[1])):
+            return "wrong block signature"
+        return None
+
+    def propose_block(self, data, check_difficulty=True):
+        """
+        BLOCK_PROPOSAL: validates and adds a block, rewards the miners of the blocks it confirms
+        :param data: dict, see Block.to_dict
+        :param check_difficulty: bool, False for the simulated miners
+        :return: msg, status code
+        """
+        try:
+            block = Block.from_dict(data)
+        except (KeyError, TypeError, ValueError, AttributeError, binascii.Error):
+            self.stats["malformed block"] += 1
+            return "malformed block", 400
+        with self.lock:
+            error = self.check_block(block, check_difficulty)
+            if error is None and not self.blockchain.add_block(block):
+                error = "wrong proof of work"
+            if error is not None:
+                self.stats[error] += 1
+                return error, 400
+            self.block_dicts[block.hash] = dict(data)
+            for t in block.transactions:
+                self.pool.pop(t.hash, None)
+                self.pool_dicts.pop(t.hash, None)
+            # confirmed blocks are never reorganised, each one is rewarded once
+            for h in self.blockchain.best_chain[self.rewarded:self.blockchain.n_confirmed]:
+                b = self.blockchain.chain[h]
+                db.update_user(b.mined_by, balance=BLOCK_REWARD, confirmed_blocks=1, total_reward=BLOCK_REWARD)
+            self.rewarded = self.blockchain.n_confirmed
+            db.update_user(block.mined_by, mined_blocks=1)
+            self.stats["blocks added"] += 1
+        return "block added to the blockchain", 200
+
+    def add_simulated_block(self, user, fork=False):
+        """
+        block of a simulated miner, built on the tip or on its parent, with the best transactions of the pool
+        :param user: User, the miner
+        :param fork: bool, mine on the parent of the tip
+        :return: msg, status code
+        """
+        with self.lock:
+            tip = self.blockchain.get_tip()
+            if fork and tip.prev in self.blockchain.chain:
+                tip = self.blockchain.chain[tip.prev]
+            transactions = BlockTemplateBuilder(self.pool.values()).build()
+            time = datetime.now().timestamp()
+            merkle_root = MerkleTree([t.hash for t in transactions]).get_root_hash()
+            nonce = 0
+            block_hash = double_hash(str(tip.hash) + str(time) + str(merkle_root) + str(nonce))
+            block = Block(block_hash, nonce, time, 0, tip.height + 1, tip.hash, transactions, merkle_root=merkle_root,
+                          mined_by=user.username, signature=sign_message(block_hash, user.privkey))
+            return self.propose_block(block.to_dict(), check_difficulty=False)
+
+    def get_stats(self):
+        """
+        :return: dict, counters of the proposals and size of the chain and pool
+        """
+        with self.lock:
+            n_blocks = len(self.blockchain.chain)
+            orphans = n_blocks - len(self.blockchain.best_chain)
+            return dict(self.stats, blocks=n_blocks, height=self.blockchain.height, orphans=orphans,
+                        pending_transactions=len(self.pool), difficulty=self.difficulty, rate_limit=self.rate_limit)
+
+
+def create_app(server):
+    """
+    :param server: CompetitionServer
+    :return: Flask application serving the competition endpoints
+    """
+    app = Flask(__name__)
+    # the limit is read on every request, so SET_RATE_LIMIT applies immediately
+    limiter = Limiter(get_remote_address, app=app, default_limits=[lambda: server.rate_limit],
+                      storage_uri="memory://")
+
+    def respond(msg, data=None, code=200):
+        return jsonify({'msg': msg, 'data': data}), code
+
+    def get_request_data():
+        body = request.get_data()
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body)['data']
+
+    @app.route('/')
+    @limiter.exempt
+    def index():
+        return respond("local competition server")
+
+    @app.route('/' + BLOCK_PROPOSAL, methods=['POST'])
+    def block_proposal():
+        try:
+            data = get_request_data()
+        except (ValueError, KeyError, TypeError, OSError):
+            return respond("malformed request", code=400)
+        msg, code = server.propose_block(data)
+        return respond(msg, code=code)
+
+    @app.route('/' + GET_BLOCKCHAIN)
+    def get_blockchain():
+        height = request.args.get('height', type=int)
+        tip = request.args.get('tip')
+        return respond("blockchain", server.get_blockchain(height, tip))
+
+    @app.route('/' + GET_USERS)
+    def get_users():
+        return respond("users", [db.row_to_dict(row) for row in db.get_users()])
+
+    @app.route('/' + REQUEST_TXS)
+    def request_txs():
+        return respond("transactions", server.get_transactions())
+
+    @app.route('/' + GET_DATABASE)
+    def get_database():
+        return respond("database", db.get_users())
+
+    @app.route('/' + REQUEST_DIFFICULTY)
+    def request_difficulty():
+        return respond(f"difficulty: {server.difficulty}", server.difficulty)
+
+    @app.route('/' + SET_DIFFICULTY, methods=['POST'])
+    @limiter.exempt
+    def set_difficulty():
+        try:
+            server.difficulty = int(get_request_data())
+        except (ValueError, KeyError, TypeError):
+            return respond("malformed request", code=400)
+        return respond(f"difficulty: {server.difficulty}", server.difficulty)
+
+    @app.route('/' + SET_RATE_LIMIT, methods=['POST'])
+    @limiter.exempt
+    def set_rate_limit():
+        try:
+            server.rate_limit = str(get_request_data())
+        except (ValueError, KeyError, TypeError):
+            return respond("malformed request", code=400)
+        return respond(f"rate limit: {server.rate_limit}", server.rate_limit)
+
+    @app.route('/' + STATS)
+    @limiter.exempt
+    def stats():
+        return respond("stats", server.get_stats())
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="local stand-in competition server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(PORT))
+    parser.add_argument("--https", action="store_true", help="self-signed certificate, as the real server")
+    parser.add_argument("--difficulty", type=int, default=DIFFICULTY)
+    parser.add_argument("--rate-limit", default="1200 per minute")
+    parser.add_argument("--users", type=int, default=10, help="simulated users sending transactions")
+    parser.add_argument("--tx-rate", type=float, default=5.0, help="transactions per second")
+    parser.add_argument("--miners", type=int, default=2, help="simulated competing miners")
+    parser.add_argument("--hashrate", type=float, default=500000, help="hashes per second of each simulated miner")
+    parser.add_argument("--fork-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--path", default=LOCAL_SERVER_PATH, help="directory of the users database and keys")
+    args = parser.parse_args(argv)
+
+    server = CompetitionServer(args.difficulty, args.rate_limit, path=args.path)
+    server.register_self()
+    threads = []
+    if args.users > 1 and args.tx_rate > 0:
+        threads.append(TransactionGenerator(server, args.users, args.tx_rate, seed=args.seed))
+    for i in range(args.miners):
+        seed = None if args.seed is None else args.seed + i + 1
+        threads.append(SimulatedMiner(server, f"miner{i}", args.hashrate, args.fork_rate, seed=seed))
+    for t in threads:
+        t.start()
+    try:
+        create_app(server).run(args.host, args.port, threaded=True, ssl_context='adhoc' if args.https else None)
+    finally:
+        for t in threads:
+            t.stop()
+
+
+if __name__ == "__main__":
+    main()
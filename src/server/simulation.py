@@ -0,0 +1,88 @@
+# server/simulation.py
+"""
+load generated on the local stand-in server: users sending each other transactions and competing miners.
+Both run in daemon threads and stop with stop().
+"""
+import random
+import threading
+
+
+class TransactionGenerator(threading.Thread):
+    """
+    simulated users sending each other signed transactions, arrivals are a Poisson process of the given rate
+    """
+    def __init__(self, server, n_users=10, rate=5.0, max_amount=50, seed=None):
+        """
+        :param server: server.local.CompetitionServer
+        :param n_users: int, number of simulated users, registered in the server database
+        :param rate: float, transactions per second
+        :param max_amount: int, maximum amount of a transaction
+        :param seed: int, for reproducible runs
+        """
+        super().__init__(daemon=True)
+        self.server = server
+        self.rate = rate
+        self.max_amount = max_amount
+        self.rng = random.Random(seed)
+        self.stop_event = threading.Event()
+        self.users = [server.register_user(f"user{i}") for i in range(n_users)]
+        self.generated = 0
+
+    def make_transaction(self):
+        """
+        :return: Transaction, signed by its sender
+        """
+        sender, receiver = self.rng.sample(self.users, 2)
+        # the sender keeps its own list of sent transactions, User.make_transaction chains them by prev_hash
+        return sender.make_transaction(receiver.address, self.rng.randint(1, self.max_amount))
+
+    def run(self):
+        while not self.stop_event.wait(self.rng.expovariate(self.rate)):
+            try:
+                self.server.add_transaction(self.make_transaction())
+                self.generated += 1
+            except ValueError:
+                # insufficient funds
+                pass
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class SimulatedMiner(threading.Thread):
+    """
+    competing miner with a given hashrate. It does not hash: the time to a solution is drawn from the exponential
+    distribution of a proof of work at the current difficulty, then a block is built on the server tip (or, to
+    create forks, on its parent) and added without the difficulty check
+    """
+    def __init__(self, server, username, hashrate=100000, fork_rate=0.05, seed=None):
+        """
+        :param server: server.local.CompetitionServer
+        :param username: str, registered in the server database
+        :param hashrate: float, hashes per second
+        :param fork_rate: float, probability of mining on the parent of the tip
+        :param seed: int, for reproducible runs
+        """
+        super().__init__(daemon=True)
+        self.server = server
+        self.hashrate = hashrate
+        self.fork_rate = fork_rate
+        self.rng = random.Random(seed)
+        self.stop_event = threading.Event()
+        self.user = server.register_user(username)
+        self.mined = 0
+
+    def get_solve_time(self):
+        """
+        :return: float, seconds to the next solution, a hash has difficulty leading zeros with probability 16^-d
+        """
+        return self.rng.expovariate(self.hashrate / 16 ** self.server.difficulty)
+
+    def run(self):
+        while not self.stop_event.wait(self.get_solve_time()):
+            _, code = self.server.add_simulated_block(self.user, fork=self.rng.random() < self.fork_rate)
+            if code == 200:
+                self.mined += 1
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,21 @@
+# tests/blocks.py
+"""
+blocks built by hand for the fork choice and mempool tests
+"""
+from abstractions.block import Block, get_header
+from backbone.merkle import MerkleTree
+from utils.cryptographic import double_hash
+
+
+def make_block(prev, transactions, nonce=0):
+    """
+    :param prev: Block, None for a genesis block
+    :param transactions: list of Transaction objects
+    :param nonce: int, tells apart blocks with the same parent and transactions
+    :return: Block with a valid hash, the difficulty is not enforced
+    """
+    block = Block(None, nonce, 1700000000 + nonce, 0, prev.height + 1 if prev else 0,
+                  prev.hash if prev else 'None', transactions,
+                  merkle_root=MerkleTree([t.hash for t in transactions]).get_root_hash())
+    block.hash = double_hash(get_header(block))
+    return block
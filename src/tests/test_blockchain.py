@@ -0,0 +1,59 @@
+# tests/test_blockchain.py
+"""
+validation cache of Blockchain. Run from src/ with: python -m pytest tests
+"""
+import json
+
+from abstractions.block import Block, Blockchain
+from backbone.chainstore import ChainStore
+from benchmarks.synthetic import make_chain_dicts
+
+
+def forge(block_dict):
+    """
+    :param block_dict: dict, see Block.to_dict
+    :return: Block with the same hash and another header
+    """
+    forged = Block.from_dict(block_dict)
+    forged.nonce += 1
+    return forged
+
+
+def test_chain_valid():
+    blockchain = Blockchain.load_json(json.dumps({"chain": make_chain_dicts(20, 1)}))
+    assert blockchain.is_valid
+    assert len(blockchain.validated) == 19
+
+
+def test_forged_header_rejected(tmp_path):
+    validated_file = str(tmp_path / "validated.pkl")
+    dicts = make_chain_dicts(20, 1)
+    assert Blockchain.from_dict({"chain": dicts}, validated_file).is_valid
+    # a block reusing a validated hash with another header, as the server could send it
+    blocks = [Block.from_dict(d) for d in dicts[:-1]]
+    assert not Blockchain(blocks + [forge(dicts[-1])], validated_file).is_valid
+    blockchain = Blockchain(blocks, validated_file)
+    assert blockchain.is_valid
+    assert not blockchain.add_block(forge(dicts[-1]))
+    assert blockchain.add_block(Block.from_dict(dicts[-1]))
+
+
+def test_store_load_trusts_cache(tmp_path):
+    store = ChainStore(str(tmp_path / "blockchain.pkl"))
+    assert store.replace(make_chain_dicts(20, 1)) == 20
+    store.save()
+    assert (tmp_path / "validated.pkl").exists()
+    loaded = ChainStore.load(store.path)
+    assert loaded.blockchain.is_valid
+    assert loaded.get_tip() == store.get_tip()
+
+
+def test_add_known_block():
+    dicts = make_chain_dicts(20, 1)
+    blockchain = Blockchain.from_dict({"chain": dicts})
+    held = blockchain.chain[dicts[5]["hash"]]
+    copy = Block.from_dict(dicts[5])
+    copy.main_chain = copy.confirmed = False
+    assert blockchain.add_block(copy)
+    assert blockchain.chain[copy.hash] is held
+    assert len(blockchain.block_list) == len(blockchain.chain) == 20
@@ -0,0 +1,38 @@
+# tests/test_chainfile.py
+"""
+the binary chain format round-trips every block with to_dict, signatures and transactions included.
+Run from src/ with: python -m pytest tests
+"""
+from abstractions.block import Blockchain
+from backbone.chainfile import ChainFile, write_chain
+from backbone.chainstore import ChainStore
+from benchmarks.synthetic import make_chain_dicts
+
+
+def test_round_trip(tmp_path):
+    dicts = make_chain_dicts(30, 4, fork_rate=0.3)
+    # a value which does not fit the compact encoding is kept as it is
+    dicts[3]["mined_by"] = None
+    blockchain = Blockchain.from_dict({"chain": dicts})
+    expected = {h: b.to_dict() for h, b in blockchain.chain.items()}
+    path = str(tmp_path / "blockchain.bin")
+    write_chain(blockchain, path)
+    with ChainFile(path) as chain_file:
+        assert len(chain_file) == len(expected)
+        assert chain_file.get_height() == blockchain.height
+        for h, d in expected.items():
+            assert chain_file.get_by_hash(h).to_dict() == d
+            assert chain_file.get_block_dict(chain_file.find(h)) == d
+            assert h in {b.hash for b in chain_file.get_by_height(d["height"])}
+        assert chain_file.get_by_hash("0" * 64) is None
+        assert {h: b.to_dict() for h, b in chain_file.to_blockchain().chain.items()} == expected
+
+
+def test_store_writes_chain_file(tmp_path):
+    store = ChainStore(str(tmp_path / "blockchain.pkl"))
+    assert store.open_chain_file() is None
+    store.replace(make_chain_dicts(10, 2))
+    store.save()
+    with store.open_chain_file() as chain_file:
+        assert len(chain_file) == 10
+        assert chain_file.get_by_hash(store.get_tip()).to_dict() == store.blockchain.get_tip().to_dict()
@@ -0,0 +1,76 @@
+# tests/test_fork_choice.py
+"""
+fork choice of Blockchain: the longest branch is the main chain, the first seen wins a tie and the blocks followed
+by N_BLOCKS_PER_BRANCH blocks are confirmed and never reorganized. Run from src/ with: python -m pytest tests
+"""
+from abstractions.block import Blockchain
+from server import N_BLOCKS_PER_BRANCH
+from tests.blocks import make_block
+
+
+def extend(blockchain, prev, n, nonce):
+    """
+    :param blockchain: Blockchain object
+    :param prev: Block, parent of the first new block
+    :param n: int, number of blocks added
+    :param nonce: int, nonce of the first block, the next ones are incremented
+    :return: list of the Block objects added
+    """
+    blocks = []
+    for i in range(n):
+        prev = make_block(prev, [], nonce + i)
+        assert blockchain.add_block(prev)
+        blocks.append(prev)
+    return blocks
+
+
+def get_main_chain(blockchain):
+    return {h for h, b in blockchain.chain.items() if b.main_chain}
+
+
+def test_reorg():
+    genesis = make_block(None, [])
+    blockchain = Blockchain([genesis])
+    a = extend(blockchain, genesis, 2, 100)
+    assert blockchain.get_tip() is a[-1]
+    b = extend(blockchain, genesis, 3, 200)
+    assert blockchain.get_tip() is b[-1]
+    assert blockchain.height == 3
+    assert get_main_chain(blockchain) == {genesis.hash} | {x.hash for x in b}
+    assert [x.hash for x in blockchain.iter_branch()] == [genesis.hash] + [x.hash for x in b]
+    # the flags set by add_block are the ones confirm_chain computes from the index
+    flags = {h: (x.main_chain, x.confirmed) for h, x in blockchain.chain.items()}
+    blockchain.confirm_chain()
+    assert flags == {h: (x.main_chain, x.confirmed) for h, x in blockchain.chain.items()}
+
+
+def test_equal_length_tie():
+    genesis = make_block(None, [])
+    blockchain = Blockchain([genesis])
+    a = extend(blockchain, genesis, 2, 100)
+    b = extend(blockchain, genesis, 2, 200)
+    # the first branch seen stays the main chain, the other one is not on it until it is longer
+    assert blockchain.get_tip() is a[-1]
+    assert not any(x.main_chain for x in b)
+    c = extend(blockchain, b[-1], 1, 300)
+    assert blockchain.get_tip() is c[-1]
+    assert not any(x.main_chain for x in a)
+
+
+def test_confirmation_depth():
+    genesis = make_block(None, [])
+    blockchain = Blockchain([genesis])
+    a = extend(blockchain, genesis, N_BLOCKS_PER_BRANCH, 100)
+    # genesis is followed by N_BLOCKS_PER_BRANCH blocks
+    assert genesis.confirmed
+    assert not any(x.confirmed for x in a)
+    a += extend(blockchain, a[-1], 1, 200)
+    assert a[0].confirmed and not a[1].confirmed
+    # a longer branch forking before the last confirmed block is never the main chain
+    b = extend(blockchain, genesis, N_BLOCKS_PER_BRANCH + 3, 300)
+    assert blockchain.get_tip() is a[-1]
+    assert not any(x.main_chain for x in b)
+    # one forking after it is
+    c = extend(blockchain, a[0], N_BLOCKS_PER_BRANCH + 3, 400)
+    assert blockchain.get_tip() is c[-1]
+    assert not any(x.main_chain for x in a[1:])
@@ -0,0 +1,77 @@
+# tests/test_hashing.py
+"""
+correctness of the mining backends, of the midstate hasher and of the Merkle proofs against the reference
+functions used by the server. Run from src/ with: python -m pytest tests
+"""
+import pytest
+
+from backbone.consensus import BACKENDS, check_backend
+from backbone.merkle import MerkleTree, EMPTY_ROOT
+from utils.cryptographic import MiningHasher, double_hash, hash_function
+
+AVAILABLE_BACKENDS = [b for b in BACKENDS.values() if b.is_available()]
+# headers around the SHA-256 block size, the nonce then crosses a padding boundary
+HEADERS = ["", "a" * 55, "b" * 56, "c" * 63, "d" * 64, "0" * 64 + "1707912345.123456" + "e" * 64]
+NONCES = [0, 1, 9, 10, 12345, 10 ** 12 + 7, 2 ** 63, 2 ** 64 - 1]
+
+
+@pytest.mark.parametrize("backend_class", AVAILABLE_BACKENDS, ids=lambda b: b.name)
+def test_check_backend(backend_class):
+    assert check_backend(backend_class())
+
+
+@pytest.mark.parametrize("backend_class", AVAILABLE_BACKENDS, ids=lambda b: b.name)
+@pytest.mark.parametrize("header", HEADERS)
+def test_backend_hash(backend_class, header):
+    backend = backend_class()
+    for nonce in NONCES:
+        assert backend.hash(header, nonce) == double_hash(header + str(nonce))
+
+
+@pytest.mark.parametrize("backend_class", AVAILABLE_BACKENDS, ids=lambda b: b.name)
+def test_backend_search(backend_class):
+    header = HEADERS[-1]
+    tested, nonce, d_hash = backend_class().search(header, 0, 1, 100000, 3)
+    assert nonce == tested - 1
+    assert d_hash == double_hash(header + str(nonce))
+    assert d_hash.startswith("000")
+    assert not any(double_hash(header + str(n)).startswith("000") for n in range(nonce))
+
+
+@pytest.mark.parametrize("backend_class", AVAILABLE_BACKENDS, ids=lambda b: b.name)
+def test_backend_search_not_found(backend_class):
+    # no nonce of 10 has 64 leading zeros
+    assert backend_class().search(HEADERS[-1], 0, 7, 10, 64) == (10, None, None)
+
+
+@pytest.mark.parametrize("header", HEADERS)
+def test_mining_hasher(header):
+    hasher = MiningHasher(header)
+    for nonce in NONCES:
+        assert hasher.double_hash(nonce) == double_hash(header + str(nonce))
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 5, 8, 13, 100])
+def test_merkle_proofs(n):
+    txs = [hash_function(str(i)) for i in range(n)]
+    tree = MerkleTree(txs)
+    root = tree.get_root_hash()
+    for t in txs:
+        proof = tree.get_proof(t)
+        assert MerkleTree.verify_proof(t, proof, root)
+        assert not MerkleTree.verify_proof(t, proof, hash_function("other root"))
+    assert tree.get_proof(hash_function("missing")) is None
+    assert not MerkleTree.verify_proof(hash_function("missing"), tree.get_proof(txs[0]), root)
+
+
+def test_merkle_incremental_matches_rebuild():
+    txs = [hash_function(str(i)) for i in range(9)]
+    tree = MerkleTree(txs[:1])
+    for t in txs[1:]:
+        tree.append(t)
+        assert tree.get_root_hash() == MerkleTree(tree.data).get_root_hash()
+    tree.replace(4, hash_function("x"))
+    assert tree.get_root_hash() == MerkleTree(tree.data).get_root_hash()
+    tree.pop()
+    assert tree.get_root_hash() == MerkleTree(tree.data).get_root_hash()
+    assert MerkleTree([]).get_root_hash() == EMPTY_ROOT
@@ -0,0 +1,47 @@
+# tests/test_mempool.py
+"""
+eviction of the mined transactions from the mempool, reorgs included. Run from src/ with: python -m pytest tests
+"""
+from abstractions.block import Blockchain
+from abstractions.transaction import Transaction
+from backbone.mempool import Mempool
+from benchmarks.synthetic import make_transaction_dicts
+from tests.blocks import make_block
+
+TRANSACTIONS = [Transaction.from_dict(t) for t in make_transaction_dicts(20)]
+
+
+def test_evict_mined_reorg(tmp_path):
+    genesis = make_block(None, [])
+    a1 = make_block(genesis, TRANSACTIONS[:3], 1)
+    blockchain = Blockchain([genesis])
+    assert blockchain.add_block(a1)
+    mempool = Mempool(str(tmp_path / "mempool.pkl"))
+    mempool.add_transactions(TRANSACTIONS[:6])
+    assert mempool.evict_mined(blockchain) == 3
+    assert not mempool.add_transaction(TRANSACTIONS[0])
+    # a longer branch without a1 becomes the main chain
+    b1 = make_block(genesis, TRANSACTIONS[3:4], 2)
+    b2 = make_block(b1, [], 3)
+    assert blockchain.add_block(b1) and blockchain.add_block(b2)
+    assert blockchain.get_tip() is b2
+    assert mempool.evict_mined(blockchain) == 1
+    # the server puts the transactions of a1 back in its pool
+    assert not mempool.is_known(TRANSACTIONS[0].hash)
+    assert mempool.add_transaction(TRANSACTIONS[0])
+    assert mempool.is_known(TRANSACTIONS[3].hash)
+    # the blocks are walked only once
+    assert mempool.evict_mined(blockchain) == 0
+
+
+def test_evict_mined_bounded(tmp_path):
+    blocks = [make_block(None, [])]
+    for i, t in enumerate(TRANSACTIONS):
+        blocks.append(make_block(blocks[-1], [t], i + 1))
+    blockchain = Blockchain(blocks)
+    mempool = Mempool(str(tmp_path / "mempool.pkl"))
+    mempool.evict_mined(blockchain, max_blocks=5)
+    assert len(mempool.seen_blocks) == 5
+    assert mempool.mined == {t.hash for t in TRANSACTIONS[-5:]}
+    mempool.save()
+    assert Mempool.load(mempool.path).seen_blocks == mempool.seen_blocks
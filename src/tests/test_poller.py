@@ -0,0 +1,24 @@
+# tests/test_poller.py
+"""
+parsing of the REQUEST_DIFFICULTY responses by the poller. Run from src/ with: python -m pytest tests
+"""
+import pytest
+import requests
+
+from backbone.poller import parse_difficulty
+
+
+@pytest.mark.parametrize("response", [("difficulty: 5", 5, 200), ("difficulty: 5", {"difficulty": 5}, 200)])
+def test_parse_difficulty(response):
+    assert parse_difficulty(*response) == 5
+
+
+@pytest.mark.parametrize("response", [
+    ("429 Too Many Requests: 1200 per 1 minute", None, 429),
+    ("<html>502 Bad Gateway</html>", "<html>502 Bad Gateway</html>", 502),
+    ("difficulty: 5", None, 200),
+    ("difficulty: 5", "5", 200),
+])
+def test_parse_difficulty_error(response):
+    with pytest.raises(requests.HTTPError):
+        parse_difficulty(*response)
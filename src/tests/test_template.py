@@ -0,0 +1,48 @@
+# tests/test_template.py
+"""
+block templates: ordering, conflicting spends, transactions kept from the previous template and its Merkle tree.
+Run from src/ with: python -m pytest tests
+"""
+from types import SimpleNamespace
+
+from backbone.consensus import Miner
+from backbone.merkle import MerkleTree
+from backbone.template import BlockTemplateBuilder
+
+
+def make_tx(tx_hash, source, prev_hash, fee):
+    return SimpleNamespace(hash=tx_hash, source_address=source, prev_hash=prev_hash, fee=fee)
+
+
+# k and k2 both spend the output p of sender s, c spends k and e spends k2
+K = make_tx('k', 's', 'p', 1)
+K2 = make_tx('k2', 's', 'p', 50)
+C = make_tx('c', 's', 'k', 5)
+D = make_tx('d', 't', 'None', 3)
+E = make_tx('e', 's', 'k2', 9)
+
+
+def get_hashes(transactions):
+    return [t.hash for t in transactions]
+
+
+def test_build_keeps_highest_fee_spend():
+    assert get_hashes(BlockTemplateBuilder([K, K2, C, D, E]).build()) == ['k2', 'e', 'd']
+
+
+def test_build_preselected_wins_conflicts():
+    template = BlockTemplateBuilder([K, K2, C, D, E]).build(preselected=[K])
+    assert get_hashes(template) == ['k', 'c', 'd']
+
+
+def test_build_preselected_counts_against_max_txs():
+    assert get_hashes(BlockTemplateBuilder([K, K2, C, D, E], max_txs=2).build(preselected=[K])) == ['k', 'c']
+
+
+def test_miner_merkle_tree_follows_template():
+    poller = SimpleNamespace(difficulty=None, subscribe=lambda callback: None)
+    miner = Miner(poller)
+    templates = [[K, C], [K, C, D], [K, D], [K2, E, D], [], [D]]
+    for template in templates:
+        assert miner.update_merkle_tree(template) == MerkleTree(get_hashes(template)).get_root_hash()
+        assert miner.merkle_tree.data == get_hashes(template)
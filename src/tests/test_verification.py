@@ -0,0 +1,63 @@
+# tests/test_verification.py
+"""
+batch signature verification: one wrong or malformed signature or key only fails its own item.
+Run from src/ with: python -m pytest tests
+"""
+import base64
+
+import pytest
+
+from abstractions.transaction import Transaction
+from backbone.mempool import Mempool
+from benchmarks.synthetic import make_transaction_dicts, get_user_keys
+from utils.cryptographic import verify_signatures, save_key, MIN_PARALLEL_SIGNATURES
+
+N_USERS = 5
+USER_KEYS = get_user_keys(N_USERS)
+SENDER_KEYS = {address: save_key(pub) for address, (pub, _) in USER_KEYS.items()}
+# a PEM key whose DER content is not an RSA public key
+MALFORMED_KEY = ("-----BEGIN RSA PUBLIC KEY-----\n" + base64.b64encode(b'\x30\x03\x02\x01\x05').decode()
+                 + "\n-----END RSA PUBLIC KEY-----\n")
+
+
+def make_items(n):
+    """
+    :param n: int, number of items
+    :return: (list of (message, signature, pubkey), list of the expected results)
+    """
+    txs = [Transaction.from_dict(t) for t in make_transaction_dicts(n, N_USERS, signed=True)]
+    items, expected = [], []
+    for i, t in enumerate(txs):
+        key = SENDER_KEYS[t.source_address]
+        signature = t.prev_owner_sig
+        if i % 5 == 1:
+            signature = signature[:-1] + bytes([signature[-1] ^ 1])
+        elif i % 5 == 2:
+            key = MALFORMED_KEY
+        elif i % 5 == 3:
+            signature = b'short'
+        items.append((t.hash, signature, key))
+        expected.append(i % 5 in (0, 4))
+    return items, expected
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_verify_signatures_mixed(n_workers):
+    items, expected = make_items(2 * MIN_PARALLEL_SIGNATURES)
+    assert verify_signatures(items, n_workers) == expected
+
+
+def test_mempool_rejects_forged(tmp_path):
+    dicts = make_transaction_dicts(20, N_USERS, signed=True)
+    dicts[3]["prev_owner_sig"] = dicts[4]["prev_owner_sig"]
+    dicts[5]["is_verified"] = True
+    dicts[5]["prev_owner_sig"] = dicts[6]["prev_owner_sig"]
+    mempool = Mempool(str(tmp_path / "mempool.pkl"))
+    mempool.sender_keys.update(SENDER_KEYS)
+    assert mempool.add_checked_transactions(Transaction.from_dict(t) for t in dicts) == 18
+    assert mempool.forged == {dicts[3]["hash"], dicts[5]["hash"]}
+    assert all(t.is_verified for t in mempool.transactions.values())
+    assert mempool.is_known(dicts[3]["hash"]) and dicts[3]["hash"] not in mempool
+    # forgotten once the server drops it
+    mempool.retain({d["hash"] for d in dicts[4:]})
+    assert mempool.forged == {dicts[5]["hash"]}
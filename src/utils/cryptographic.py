@@ -2,6 +2,13 @@ import hashlib
 import rsa
 import base64
 import json
+import functools
+import multiprocessing as mp
+
+from pyasn1.error import PyAsn1Error
+
+# below this number of signatures the process pool costs more than it saves
+MIN_PARALLEL_SIGNATURES = 64
 
 def verify_signature(message, signature, pubkey):
     """
@@ -22,6 +29,51 @@ def verify_signature(message, signature, pubkey):
         print(f"Verification error: {e}")
         return False
 
+def check_signature(item):
+    """
+    verify a signature without printing, used by verify_signatures
+    :param item: (message, signature, pubkey), pubkey is an rsa.PublicKey or its PEM string, None if unknown
+    :return: bool
+    """
+    message, signature, pubkey = item
+    if pubkey is None or signature is None:
+        return False
+    try:
+        if isinstance(pubkey, str):
+            pubkey = load_public(pubkey)
+        rsa.verify(bytes(message, 'utf-8'), signature, pubkey)
+        return True
+    except (rsa.VerificationError, ValueError, TypeError, PyAsn1Error):
+        # PyAsn1Error: malformed PEM key
+        return False
+
+def verify_signatures(items, n_workers=None, chunksize=32):
+    """
+    verify many signatures in parallel across a process pool
+    :param items: list of (message, signature, pubkey), pubkey is an rsa.PublicKey or its PEM string.
+    PEM strings are cheaper to send to the workers, which parse each key only once
+    :param n_workers: int, number of processes, defaults to the number of cores
+    :param chunksize: int, signatures sent to a worker at once
+    :return: list of bool, one per item
+    """
+    items = list(items)
+    if n_workers is None:
+        n_workers = mp.cpu_count()
+    if n_workers <= 1 or len(items) < MIN_PARALLEL_SIGNATURES:
+        return [check_signature(i) for i in items]
+    with mp.Pool(n_workers) as pool:
+        return pool.map(check_signature, items, chunksize)
+
+def sign_message(message, pvt):
+    """
+    sign a message with a private key
+    :param message: str, e.g. block hash
+    :param pvt: rsa.PrivateKey
+    :return: signature bytes
+    """
+    b_msg = bytes(message, 'utf-8')
+    return rsa.sign(b_msg, pvt, 'SHA-1')
+
 def save_key(key):
     """
     serializes public/private key
@@ -30,13 +82,43 @@ def save_key(key):
     """
     return key.save_pkcs1(format="PEM").decode('utf-8')
 
+@functools.lru_cache(maxsize=4096)
+def save_public(pub):
+    """
+    serializes a public key, cached as load_public: every transaction to the same user holds its key
+    :param pub: rsa.PublicKey
+    :return: str, PEM
+    """
+    return save_key(pub)
+
+@functools.lru_cache(maxsize=4096)
 def load_public(pub):
     """
-    deserializes public key
+    deserializes public key, parsed keys are cached since the same users sign many transactions and blocks
     :param pub:
     :return:
     """
-    return rsa.PublicKey.load_pkcs1(pub.encode('utf-8'))
+    return intern_public(rsa.PublicKey.load_pkcs1(pub.encode('utf-8')))
+
+# (n, e) -> the one rsa.PublicKey object shared by every transaction and user with that key.
+# rsa.PublicKey has no weak references, the oldest keys are dropped past MAX_PUBLIC_KEYS
+PUBLIC_KEYS = dict()
+MAX_PUBLIC_KEYS = 4096
+
+def intern_public(key):
+    """
+    :param key: rsa.PublicKey or None
+    :return: the interned rsa.PublicKey equal to key
+    """
+    if key is None:
+        return None
+    interned = PUBLIC_KEYS.get((key.n, key.e))
+    if interned is None:
+        if len(PUBLIC_KEYS) >= MAX_PUBLIC_KEYS:
+            # objects holding the dropped key keep it, only new equal keys are no longer shared with them
+            del PUBLIC_KEYS[next(iter(PUBLIC_KEYS))]
+        interned = PUBLIC_KEYS[(key.n, key.e)] = key
+    return interned
 
 def load_private(pvt):
     """
@@ -65,6 +147,16 @@ def load_signature(serialized_signature):
     return signature
 
 
+def unpack_hash(value):
+    """
+    hashes were stored as 32 bytes in the objects pickled by earlier versions
+    :param value: bytes, or str if it was not a hexadecimal hash, e.g. 'None' for the first transaction
+    :return: str, hexadecimal hash or value
+    """
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
 def hash_function(data):
     """
     hash data using SHA256
@@ -90,4 +182,28 @@ def double_hash(data):
     hash_obj.update(hex_hash.encode())
     # Get the final hexadecimal representation of the double SHA-256 hash
     d_hash = hash_obj.hexdigest()
-    return d_hash
\ No newline at end of file
+    return d_hash
+
+
+class MiningHasher:
+    """
+    double_hash of a block header where everything but the nonce is fixed.
+    The fixed prefix is absorbed once in a SHA-256 state (midstate), which is copied for every nonce.
+    mining_hasher.double_hash(nonce) == double_hash(header + str(nonce))
+    """
+    def __init__(self, header):
+        """
+        :param header: str, block header without nonce, see backbone.consensus.get_block_header
+        """
+        self.header = header
+        self.midstate = hashlib.sha256(header.encode())
+
+    def double_hash(self, nonce):
+        """
+        :param nonce: int
+        :return: same hexadecimal hash as double_hash(header + str(nonce))
+        """
+        hash_obj = self.midstate.copy()
+        hash_obj.update(str(nonce).encode())
+        # the second pass hashes the hexadecimal digest of the first one, as in double_hash
+        return hashlib.sha256(hash_obj.hexdigest().encode()).hexdigest()
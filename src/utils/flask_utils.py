@@ -4,38 +4,215 @@ communication between client and server is always with a serialized JSON object.
 Every class need to have a way to be serialized to a dict, and then to JSON
 """
 import os
+import re
+import gzip
+import time
+import codecs
+import asyncio
+import functools
 import requests
 import json
-from server import URL, ADDRESS
-from flask import jsonify, request
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from server import URL, ADDRESS, REQUEST_TIMEOUT, REQUEST_RETRIES, REQUEST_BACKOFF, REQUEST_MAX_DELAY, REQUEST_GZIP
+from utils import metrics
 
-def flask_call(method, endpoint="", data=None):
+# status codes worth retrying: Flask-Limiter rate limit and server temporarily unavailable
+RETRY_STATUS = (429, 503)
+
+session = None
+
+def get_session():
+    """
+    one requests.Session per process, so connections (and TLS handshakes) are reused between calls
+    :return: requests.Session
+    """
+    global session
+    if session is None:
+        session = requests.Session()
+        session.verify = False
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+def get_retry_delay(response, attempt, backoff=REQUEST_BACKOFF, max_delay=REQUEST_MAX_DELAY):
+    """
+    :param response: requests.Response or None if the connection failed
+    :param attempt: int, number of the failed attempt, from 0
+    :param backoff: float, first delay in seconds
+    :param max_delay: float, upper bound in seconds
+    :return: float, seconds to wait: the server Retry-After if any, exponential backoff otherwise
+    """
+    delay = backoff * 2 ** attempt
+    if response is not None:
+        try:
+            delay = max(0.0, float(response.headers.get('Retry-After')))
+        except (TypeError, ValueError):
+            pass
+    return min(delay, max_delay)
+
+def is_connect_error(error):
+    """
+    :param error: requests.ConnectionError or requests.Timeout
+    :return: bool, True if the request never reached the server (connection refused, connect timeout), so it can
+    be sent again even if it is not idempotent
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+def send_request(method, url, params=None, body=None, timeout=REQUEST_TIMEOUT, retries=REQUEST_RETRIES,
+                 use_gzip=REQUEST_GZIP, stream=False):
+    """
+    sends a request on the pooled session, retrying 429 and 503 with backoff. GET requests are also retried on
+    connection errors and timeouts, POST requests only if they never reached the server: a block proposal or a
+    transaction which timed out may have been applied already
+    :param method: 'GET' or 'POST'
+    :param url: str
+    :param params: dict, query string parameters
+    :param body: str, body of a POST request
+    :param timeout: float or (connect, read) tuple in seconds
+    :param retries: int, number of retries
+    :param use_gzip: bool, gzip the body
+    :param stream: bool, do not download the body immediately
+    :return: requests.Response
+    """
+    headers = dict()
+    if body is not None:
+        body = body.encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+        if use_gzip:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+    for attempt in range(retries + 1):
+        response = None
+        try:
+            response = get_session().request(method, url, params=params, data=body, headers=headers,
+                                             timeout=timeout, stream=stream)
+            if response.status_code not in RETRY_STATUS or attempt == retries:
+                return response
+            response.close()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries or (method != 'GET' and not is_connect_error(e)):
+                raise
+        time.sleep(get_retry_delay(response, attempt))
+
+def flask_call(method, endpoint="", data=None, params=None, timeout=REQUEST_TIMEOUT, retries=REQUEST_RETRIES):
     """
     Sends a GET or POST request to the specified endpoint using Flask.
 
     :param method: The HTTP method to use, either 'GET' or 'POST'.
     :param endpoint: The endpoint to append to the base URL.
     :param data: A dictionary containing data to be sent with a 'POST' request.
+    :param params: A dictionary of query string parameters for a 'GET' request.
+    :param timeout: seconds, or (connect, read) tuple
+    :param retries: retries on 429 and 503, and on connection errors, see send_request
     :return: A tuple containing a flask_response -> msg, data, status code
     """
     url = URL + endpoint
-    if method == 'GET':
-        resp = requests.get(url, verify=False)
-        return flask_response(resp)
-    elif method == 'POST':
-        resp = requests.post(url, data=json.dumps({'data' : data}), verify=False)
-        return flask_response(resp)
-    else:
-        return None, None, None
+    start = time.perf_counter()
+    try:
+        if method == 'GET':
+            resp = send_request('GET', url, params=params, timeout=timeout, retries=retries)
+        elif method == 'POST':
+            resp = send_request('POST', url, body=json.dumps({'data' : data}), timeout=timeout, retries=retries)
+        else:
+            return None, None, None
+    except (requests.ConnectionError, requests.Timeout):
+        metrics.inc(f"request.{endpoint}.error")
+        raise
+    # latency includes the retries, as seen by the caller
+    metrics.observe(f"request.{endpoint}", time.perf_counter() - start)
+    metrics.inc(f"request.{endpoint}.status.{resp.status_code}")
+    return flask_response(resp)
+
+async def async_flask_call(method, endpoint="", data=None, params=None, executor=None):
+    """
+    asyncio version of flask_call: the request runs on the pooled session in a thread of executor,
+    so several requests can be in flight while the event loop keeps running.
+
+    :param method: The HTTP method to use, either 'GET' or 'POST'.
+    :param endpoint: The endpoint to append to the base URL.
+    :param data: A dictionary containing data to be sent with a 'POST' request.
+    :param params: A dictionary of query string parameters for a 'GET' request.
+    :param executor: concurrent.futures.Executor, None for the event loop default one
+    :return: A tuple containing a flask_response -> msg, data, status code
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(flask_call, method, endpoint, data, params))
+
+def flask_stream(endpoint="", params=None, chunk_size=65536):
+    """
+    Sends a GET request and yields the body while it is being received, see iter_json_array.
+
+    :param endpoint: The endpoint to append to the base URL.
+    :param params: A dictionary of query string parameters.
+    :param chunk_size: bytes per chunk
+    :return: generator of bytes
+    """
+    with send_request('GET', URL + endpoint, params=params, stream=True) as resp:
+        resp.raise_for_status()
+        yield from resp.iter_content(chunk_size=chunk_size)
+
+def iter_json_array(chunks, key):
+    """
+    incrementally parses the array stored under key in a JSON document received in chunks,
+    yielding each element (a JSON object) as soon as it is complete.
+    e.g. iter_json_array(flask_stream(GET_BLOCKCHAIN), "chain") yields every block dict
+    :param chunks: iterable of str or bytes
+    :param key: str, name of the array
+    :return: generator of parsed elements
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    buffer = ''
+    pos = None
+    for chunk in chunks:
+        buffer += utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+        if pos is None:
+            match = start.search(buffer)
+            if match is None:
+                continue
+            pos = match.end()
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == ']':
+                return
+            try:
+                element, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # element not received completely yet
+                break
+            yield element
+        buffer = buffer[pos:]
+        pos = 0
+    if pos is not None:
+        raise ValueError(f"JSON array {key} is truncated or malformed")
 
 def flask_response(response):
     """
     :param response: response from flask
-    :return:
+    :return: msg, data, status code. The body is decoded once; if it is not a JSON object (e.g. a rate limit
+    page) msg is the raw text and data None
     """
-    return response.json()['msg'], response.json()['data'], response.status_code
+    try:
+        body = response.json()
+    except ValueError:
+        return response.text, None, response.status_code
+    if not isinstance(body, dict):
+        return response.text, None, response.status_code
+    return body.get('msg'), body.get('data'), response.status_code
 
 def get_data():
+    # server side only, the client never imports Flask
+    from flask import request
     return json.loads(request.data)['data']
 
 def is_folder_empty(folder):
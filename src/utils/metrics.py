@@ -0,0 +1,189 @@
+# utils/metrics.py
+"""
+in-process metrics of the hot paths: counters, gauges and timers, recorded by name (e.g. "request.get_blockchain").
+Recording is a dict update under a lock, nothing is written until start() is called: then the metrics are dumped
+as JSON every METRICS_INTERVAL seconds and, if a port is given, served on http://127.0.0.1:<port>/metrics
+"""
+import os
+import json
+import time
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from server import METRICS_PATH, METRICS_FILE, METRICS_INTERVAL
+
+
+class Metrics:
+    """
+    thread-safe registry of counters, gauges and timers
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.gauges = dict()
+        self.timers = dict()  # name -> {count, total, min, max, last} in seconds
+        self.started = time.time()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def get(self, name, default=None):
+        with self.lock:
+            return self.gauges.get(name, default)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            t = self.timers.get(name)
+            if t is None:
+                self.timers[name] = {"count": 1, "total": seconds, "min": seconds, "max": seconds, "last": seconds}
+                return
+            t["count"] += 1
+            t["total"] += seconds
+            t["min"] = min(t["min"], seconds)
+            t["max"] = max(t["max"], seconds)
+            t["last"] = seconds
+
+    def snapshot(self):
+        """
+        :return: dict, copy of every metric, timers with their mean
+        """
+        with self.lock:
+            timers = {name: dict(t, mean=t["total"] / t["count"]) for name, t in self.timers.items()}
+            return {
+                "time": time.time(),
+                "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timers": timers,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+            self.started = time.time()
+
+
+registry = Metrics()
+
+
+def inc(name, value=1):
+    registry.inc(name, value)
+
+
+def set_gauge(name, value):
+    registry.set(name, value)
+
+
+def get_gauge(name, default=None):
+    return registry.get(name, default)
+
+
+def observe(name, seconds):
+    registry.observe(name, seconds)
+
+
+def timed(name):
+    """
+    decorator recording the duration of every call under name
+    :param name: str
+    :return:
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def dump(path=METRICS_PATH + METRICS_FILE):
+    """
+    writes a snapshot as JSON, atomically so a reader never sees half a file
+    :param path: str
+    :return:
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(registry.snapshot(), f, indent=2)
+    os.replace(tmp, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = json.dumps(registry.snapshot()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep the terminal of the miner clean
+        pass
+
+
+class MetricsReporter:
+    """
+    periodic JSON dump and optional local HTTP endpoint, both in daemon threads
+    """
+    def __init__(self, path=METRICS_PATH + METRICS_FILE, interval=METRICS_INTERVAL, port=None):
+        """
+        :param path: str, JSON file
+        :param interval: float, seconds between two dumps
+        :param port: int, serve the metrics on 127.0.0.1:port, None not to serve them
+        """
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.httpd = None
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            dump(self.path)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        if self.port is not None:
+            self.httpd = ThreadingHTTPServer(('127.0.0.1', self.port), MetricsHandler)
+            threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        stops the threads and writes the last snapshot
+        :return:
+        """
+        self.stop_event.set()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        dump(self.path)
+
+
+def start(port=None, path=METRICS_PATH + METRICS_FILE, interval=METRICS_INTERVAL):
+    """
+    :param port: int, serve the metrics on 127.0.0.1:port, None not to serve them
+    :param path: str, JSON file
+    :param interval: float, seconds between two dumps
+    :return: MetricsReporter, call stop() at exit
+    """
+    return MetricsReporter(path, interval, port).start()
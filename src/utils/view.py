@@ -1,11 +1,12 @@
 # utils/view.py
 from server import DIFFICULTY
 
-import networkx as nx
-import matplotlib.pyplot as plt
-from prettytable import PrettyTable
-import matplotlib.patches as mpatches
+import os
+import sys
+from html import escape
 from datetime import datetime
+# matplotlib and prettytable are imported by the functions using them: most commands and every
+# mining worker import this module only for Colors or a table, and must not pay for the plotting stack
 
 class Colors:
     """
@@ -50,6 +51,7 @@ def create_visualization_table(fields, row_list, title):
     :param title : table title
     :return: PrettyTable object
     """
+    from prettytable import PrettyTable
     table = PrettyTable()
 
     # Define the column fields
@@ -70,6 +72,7 @@ def visualize_blockchain_terminal(blocks, n_blocks=15):
     :param blocks: A list of Block objects.
     :param n_blocks: number of blocks to be represented
     """
+    from prettytable import PrettyTable
     # Create a new table
     table = PrettyTable()
     table.field_names = ["Block", "Prev Hash", "Nonce", "Time", "Creation Time (s)", "Mined By", "Difficulty"]
@@ -99,6 +102,100 @@ def visualize_blockchain_terminal(blocks, n_blocks=15):
 
 
 
+class TerminalDashboard:
+    """
+    live view of the last blocks, redrawn in place. A row is formatted (colors, difficulty, time) once per block
+    and state, and only the lines which changed since the last frame are written to the terminal
+    """
+    FIELDS = (("Block", 8), ("Prev Hash", 9), ("Height", 7), ("Time", 19), ("Creation (s)", 12), ("Mined By", 14),
+              ("Difficulty", 10))
+
+    def __init__(self, out=None):
+        """
+        :param out: text stream, sys.stdout by default
+        """
+        self.out = out if out is not None else sys.stdout
+        self.rows = dict()  # block hash -> ((main_chain, confirmed), formatted row)
+        self.lines = []  # last frame drawn
+        self.header = self.format_line([f for f, _ in self.FIELDS])
+
+    def format_line(self, values):
+        return " ".join(str(v)[:width].ljust(width) for v, (_, width) in zip(values, self.FIELDS))
+
+    def get_row(self, block):
+        """
+        :param block: Block
+        :return: str, row of the block, formatted again only if its state changed
+        """
+        state = (block.main_chain, block.confirmed)
+        cached = self.rows.get(block.hash)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+        node_color = Colors.FAIL
+        if block.main_chain:
+            node_color = Colors.OKGREEN if block.confirmed else Colors.OKBLUE
+        creation_time = block.creation_time
+        if isinstance(creation_time, float):
+            creation_time = f"{creation_time:.2f}"
+        row = node_color + self.format_line([
+            get_hash_for_visualization(block.hash),
+            get_hash_for_visualization(block.prev),
+            block.height,
+            datetime.fromtimestamp(block.time).strftime('%d-%m-%y : %H:%M:%S'),
+            creation_time,
+            block.mined_by,
+            get_difficulty_from_hash(block.hash),
+        ]) + Colors.ENDC
+        self.rows[block.hash] = (state, row)
+        return row
+
+    def render(self, blocks, status):
+        """
+        :param blocks: list of Block objects, ordered as displayed
+        :param status: dict, label -> value shown above the blocks
+        :return: list of str, lines of the frame
+        """
+        lines = ["  ".join(Colors.BOLD + f"{label}: " + Colors.ENDC + str(value) for label, value in status.items()),
+                 "",
+                 Colors.BOLD + self.header + Colors.ENDC]
+        lines += [self.get_row(b) for b in blocks]
+        # rows of the blocks out of the view are not kept
+        shown = {b.hash for b in blocks}
+        self.rows = {h: r for h, r in self.rows.items() if h in shown}
+        return lines
+
+    def update(self, blocks, status):
+        """
+        draws a new frame, writing only the lines that differ from the previous one
+        :param blocks: list of Block objects, ordered as displayed
+        :param status: dict, label -> value shown above the blocks
+        :return: int, number of lines written
+        """
+        lines = self.render(blocks, status)
+        output = []
+        changed = 0
+        if not self.lines:
+            output.append("\033[?25l\033[2J")  # hide the cursor, clear the screen
+        for i, line in enumerate(lines):
+            if i >= len(self.lines) or self.lines[i] != line:
+                output.append(f"\033[{i + 1};1H{line}\033[K")
+                changed += 1
+        if len(lines) < len(self.lines):
+            output.append(f"\033[{len(lines) + 1};1H\033[J")
+        self.lines = lines
+        self.out.write("".join(output))
+        self.out.flush()
+        return changed
+
+    def close(self):
+        """
+        moves the cursor below the last frame and shows it again
+        :return:
+        """
+        self.out.write(f"\033[{len(self.lines) + 1};1H\033[?25h\n")
+        self.out.flush()
+
+
 def get_difficulty_from_hash(hash):
     """
 
@@ -113,46 +210,197 @@ def get_difficulty_from_hash(hash):
             break
     return diff
 
-def visualize_blockchain(blocks, path="../vis/blockchain/blockchain.pdf", n_blocks=15):
+BLOCKCHAIN_FIGURE = "blockchain"  # matplotlib figure reused by every call of visualize_blockchain
+MAX_LABELS = 200  # miner names are drawn only on smaller graphs, they are unreadable beyond
+
+
+def get_block_color(block):
     """
-    Visualize the last ten blocks of the blockchain with different node colors based on their properties.
+    :param block: Block
+    :return: str, red if not on main chain, lightblue if on main chain, green if also confirmed
+    """
+    if not block.main_chain:
+        return 'red'
+    if block.confirmed:
+        return 'green'
+    return 'lightblue'
+
+
+class BlockchainLayout:
+    """
+    deterministic height-by-branch layout: x is the block height, y the lane of its branch.
+    A block continues the lane of its previous block if it is the first child placed there, any other child opens
+    the nearest lane free since the height before it, so lanes of dead branches are reused.
+    Positions never move once assigned: blocks can be added incrementally, e.g. as the poller sees them
+    """
+    def __init__(self):
+        self.positions = dict()  # block hash -> (height, lane)
+        self.lane_tips = dict()  # lane -> (hash, height) of its last block
+
+    def get_free_lane(self, lane, height):
+        """
+        :param lane: int, lane of the previous block
+        :param height: int, height of the new block
+        :return: int, nearest lane with no block since height - 1, alternating above and below
+        """
+        for distance in range(1, len(self.lane_tips) + 2):
+            for candidate in (lane + distance, lane - distance):
+                tip = self.lane_tips.get(candidate)
+                if tip is None or tip[1] < height - 1:
+                    return candidate
+
+    def add(self, block):
+        """
+        :param block: Block
+        :return: (int, int), position of the block
+        """
+        position = self.positions.get(block.hash)
+        if position is not None:
+            return position
+        parent = self.positions.get(block.prev)
+        if parent is None:
+            # genesis, or previous block not drawn: a new root
+            lane = 0 if not self.lane_tips else self.get_free_lane(0, block.height)
+        else:
+            lane = parent[1]
+            if self.lane_tips[lane][0] != block.prev:
+                lane = self.get_free_lane(lane, block.height)
+        self.positions[block.hash] = (block.height, lane)
+        self.lane_tips[lane] = (block.hash, block.height)
+        return block.height, lane
+
+    def add_blocks(self, blocks):
+        """
+        adds the blocks by height, main chain first, so that the main chain stays on lane 0
+        :param blocks: list of Block objects
+        :return:
+        """
+        for b in sorted(blocks, key=lambda b: (b.height, not b.main_chain, b.time, b.hash)):
+            self.add(b)
+
+
+def visualize_blockchain(blocks, path="../vis/blockchain/blockchain.pdf", n_blocks=None):
+    """
+    Visualize the blocks of the blockchain by height and branch, with different node colors based on their
+    properties. The figure is reused and cleared at every call.
 
     :param blocks: A list of Block objects.
     :param path: The path to save the visualization.
-    :param n_blocks: number of blocks to be represented
+    :param n_blocks: number of heights to be represented, counted back from the highest block, None for all
     """
-    # Create a new graph
-    g = nx.DiGraph()
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as mpatches
+    from matplotlib.collections import LineCollection
 
-    # Add the last ten blocks to the graph
-    last_ten_blocks = blocks[-n_blocks:]
-    for b in last_ten_blocks:
-        node_color = 'red'
-        if b.main_chain:
-            node_color = 'lightblue'
-            if b.confirmed:
-                node_color = 'green'
-        g.add_node(b.hash, color=node_color, label=b.mined_by)
+    if n_blocks is not None and blocks:
+        lowest = max(b.height for b in blocks) - n_blocks + 1
+        blocks = [b for b in blocks if b.height >= lowest]
+    layout = BlockchainLayout()
+    layout.add_blocks(blocks)
+    positions = layout.positions
 
-    # Add edges between blocks
-    for b in last_ten_blocks:
-        if b.prev is not None and b.prev in g:
-            g.add_edge(b.hash, b.prev)
+    # one figure for the whole process, its size follows the number of heights and lanes
+    heights = [p[0] for p in positions.values()] or [0]
+    lanes = [p[1] for p in positions.values()] or [0]
+    width = min(max(6, 0.25 * (max(heights) - min(heights))), 400)
+    height = min(max(3, 0.5 * (max(lanes) - min(lanes))), 100)
+    fig = plt.figure(BLOCKCHAIN_FIGURE)
+    fig.clf()
+    fig.set_size_inches(width, height)
+    ax = fig.add_subplot()
 
-    # Draw the graph
-    pos = nx.spring_layout(g)
-    node_colors = [g.nodes[n]['color'] for n in g.nodes]
-    nx.draw(g, pos, node_color=node_colors, labels=nx.get_node_attributes(g, 'label'), with_labels=True)
+    # edges as a single collection, nodes as a single scatter
+    edges = [(positions[b.prev], positions[b.hash]) for b in blocks if b.prev in positions]
+    ax.add_collection(LineCollection(edges, colors='gray', linewidths=0.8, zorder=1))
+    xs, ys = zip(*(positions[b.hash] for b in blocks)) if blocks else ((), ())
+    ax.scatter(xs, ys, c=[get_block_color(b) for b in blocks], s=60 if len(blocks) <= MAX_LABELS else 12, zorder=2)
+    if len(blocks) <= MAX_LABELS:
+        for b in blocks:
+            ax.annotate(str(b.mined_by), positions[b.hash], textcoords="offset points", xytext=(0, 6), ha='center',
+                        va='bottom', rotation=90, fontsize=6)
+    ax.set_xlabel("height")
+    ax.set_yticks([])
+    ax.margins(0.02, 0.2)
 
     # Add color legend
     red_patch = mpatches.Patch(color='red', label='Not on main chain')
     blue_patch = mpatches.Patch(color='lightblue', label='On main chain')
     green_patch = mpatches.Patch(color='green', label='Confirmed')
-    plt.legend(handles=[red_patch, blue_patch, green_patch], loc='upper left')
+    ax.legend(handles=[red_patch, blue_patch, green_patch], loc='upper left', bbox_to_anchor=(1, 1))
 
-    plt.savefig(path)
+    fig.savefig(path, bbox_inches='tight')
     print(Colors.BOLD + "blockchain saved " + Colors.ENDC + "in : " + Colors.OKGREEN + f"{path}" + Colors.ENDC)
 
+
+class BlockchainSVG:
+    """
+    SVG drawing of the blockchain kept up to date incrementally: update() only lays out the new blocks and
+    recolors the ones whose state changed, then rewrites the file atomically. No plotting library is needed
+    """
+    X_STEP = 20
+    Y_STEP = 20
+    MARGIN = 20
+
+    def __init__(self, path="../vis/blockchain/blockchain.svg"):
+        """
+        :param path: str, SVG file
+        """
+        self.path = path
+        self.layout = BlockchainLayout()
+        self.nodes = dict()  # block hash -> [x, y, color, title]
+        self.edges = []  # (x1, y1, x2, y2)
+
+    def get_point(self, position):
+        return position[0] * self.X_STEP, position[1] * self.Y_STEP
+
+    def update(self, blocks):
+        """
+        :param blocks: list of Block objects, new or already drawn
+        :return: int, number of new blocks drawn
+        """
+        new_blocks = [b for b in blocks if b.hash not in self.nodes]
+        for b in blocks:
+            node = self.nodes.get(b.hash)
+            if node is not None:
+                node[2] = get_block_color(b)
+        self.layout.add_blocks(new_blocks)
+        for b in new_blocks:
+            x, y = self.get_point(self.layout.positions[b.hash])
+            self.nodes[b.hash] = [x, y, get_block_color(b),
+                                escape(f"{b.height} {b.mined_by} {b.hash}")]
+            parent = self.layout.positions.get(b.prev)
+            if parent is not None:
+                self.edges.append(self.get_point(parent) + (x, y))
+        self.save()
+        return len(new_blocks)
+
+    def to_svg(self):
+        """
+        :return: str, SVG document
+        """
+        points = [(n[0], n[1]) for n in self.nodes.values()] or [(0, 0)]
+        min_x = min(p[0] for p in points) - self.MARGIN
+        min_y = min(p[1] for p in points) - self.MARGIN
+        width = max(p[0] for p in points) - min_x + self.MARGIN
+        height = max(p[1] for p in points) - min_y + self.MARGIN
+        lines = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="{min_x} {min_y} {width} {height}" '
+                 f'width="{width}" height="{height}">',
+                 '<g stroke="gray" stroke-width="1">']
+        lines += [f'<line x1="{e[0]}" y1="{e[1]}" x2="{e[2]}" y2="{e[3]}"/>' for e in self.edges]
+        lines.append('</g>')
+        lines += [f'<circle cx="{n[0]}" cy="{n[1]}" r="5" fill="{n[2]}"><title>{n[3]}</title></circle>'
+                  for n in self.nodes.values()]
+        lines.append('</svg>')
+        return "\n".join(lines)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.to_svg())
+        os.replace(tmp, self.path)
+
+
 def get_hash_for_visualization(hash, n=6):
     """
     it gets the first n-non-zero characters of a block hash. For visualization purpose only.